@@ -0,0 +1,211 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import unittest
+
+import numpy as np
+
+import correlators.analysis
+import correlators.bootstrap
+import correlators.transform
+
+
+def synthetic_ensemble(configurations, T=48, seed=0, noise=0.005):
+    '''
+    Generates correlators with known masses and correlated noise.
+    '''
+    rng = np.random.RandomState(seed)
+    time = np.arange(T // 2 + 1)
+    c2 = 3 * (np.exp(-0.2 * time) + np.exp(-0.2 * (T - time)))
+    c4 = 9 * (np.exp(-0.45 * time) + np.exp(-0.45 * (T - time))) + 1e-6
+
+    combined = []
+    for i in range(configurations):
+        common = 1 + 0.01 * rng.randn()
+        combined.append((
+            c2 * common * (1 + noise * rng.randn(len(time))),
+            c4 * common**2 * (1 + noise * rng.randn(len(time))),
+        ))
+    return combined
+
+
+class TestSubset(unittest.TestCase):
+    def test_evenly_spaced(self):
+        configurations = list(range(10))
+        self.assertEqual(correlators.analysis.subset(configurations, 5),
+                         [0, 2, 4, 7, 9])
+        self.assertEqual(correlators.analysis.subset(configurations, 4),
+                         [0, 3, 6, 9])
+        self.assertEqual(correlators.analysis.subset(configurations, 3),
+                         [0, 4, 9])
+
+    def test_exact_count(self):
+        for n in [10, 99, 100, 101, 257]:
+            configurations = list(range(n))
+            for count in [1, 2, 7, 50, 99, 100]:
+                selected = correlators.analysis.subset(configurations, count)
+                self.assertEqual(len(selected), min(count, n))
+                self.assertEqual(len(set(selected)), len(selected))
+
+    def test_all(self):
+        configurations = list(range(10))
+        self.assertEqual(correlators.analysis.subset(configurations, 10),
+                         configurations)
+        self.assertEqual(correlators.analysis.subset(configurations, None),
+                         configurations)
+
+
+class TestFittedQuantities(unittest.TestCase):
+    def test_names(self):
+        quantities = correlators.analysis.fitted_quantities()
+        self.assertIn('m_2', quantities)
+        self.assertIn('corr__p_value_2', quantities)
+        self.assertNotIn('m_pi/f_pi', quantities)
+        self.assertNotIn('a0*m_pi_paper', quantities)
+
+
+class TestCombineStage(unittest.TestCase):
+    def test_combine(self):
+        two_points, four_points = zip(*synthetic_ensemble(60))
+        loaded = {
+            'two_points': list(two_points),
+            'four_points': list(four_points),
+            'parameters': {'T': '48', 'L': '24'},
+        }
+
+        combined = correlators.analysis.combine_stage(loaded, 2, None)
+        self.assertEqual(combined['configurations'], 60)
+        self.assertEqual(len(combined['combined']), 30)
+        self.assertEqual((combined['T'], combined['L']), (48, 24))
+
+        combined = correlators.analysis.combine_stage(loaded, 1, 20)
+        self.assertEqual(combined['configurations'], 20)
+        self.assertEqual(len(combined['combined']), 20)
+
+
+class TestCentralFit(unittest.TestCase):
+    def test_masses(self):
+        combined = synthetic_ensemble(60)
+
+        p_2, p_4 = correlators.analysis.central_fit(combined, 48)
+        self.assertEqual(len(p_2), 2)
+        self.assertEqual(len(p_4), 3)
+        self.assertAlmostEqual(p_2[0], 0.2, places=3)
+        self.assertAlmostEqual(p_2[1], 3.0, places=1)
+        self.assertAlmostEqual(p_4[0], 0.45, places=2)
+
+        p_2_shifted, p_4 = correlators.analysis.central_fit(combined, 48,
+                                                            'shifted')
+        self.assertEqual(list(p_2_shifted), list(p_2))
+        self.assertEqual(len(p_4), 2)
+        self.assertAlmostEqual(p_4[0], 0.45, places=2)
+
+
+class TestRatioBootstrap(unittest.TestCase):
+    def test_energy_shift(self):
+        combined = synthetic_ensemble(60, noise=0.2)
+        indices = correlators.bootstrap.generate_indices(60, 40, seed=1)
+
+        # Close to the middle the noise makes the correlator rise in some
+        # replicas, so their effective mass is not defined there.
+        averages = np.mean(np.array([c2 for c2, c4 in combined])[indices],
+                           axis=1)
+        m_eff = correlators.transform.effective_mass_periodic(averages, 48)
+        self.assertTrue(np.any(np.isnan(m_eff[:, 13:])))
+
+        replicas = correlators.analysis.ratio_bootstrap(combined, 48, 24,
+                                                        indices)
+
+        self.assertEqual(replicas.shape, (40, 5))
+        val, err, failed = correlators.analysis.replica_statistics(replicas)
+        self.assertEqual(failed, 0)
+        self.assertLess(abs(val[0] - 0.2), 3 * err[0])
+        self.assertLess(abs(val[1] - 0.05), 3 * err[1])
+
+    def test_given_replicas(self):
+        # Each row of the results belongs to the same row of the indices.
+        combined = synthetic_ensemble(60)
+        indices = correlators.bootstrap.generate_indices(60, 20, seed=1)
+        indices[1] = indices[0]
+
+        for method in [
+                correlators.analysis.ratio_bootstrap,
+                lambda *args: correlators.analysis.excited_states_bootstrap(
+                    *args, states=1, omit_pre=13)]:
+            replicas = method(combined, 48, 24, indices)
+            reversed_replicas = method(combined, 48, 24, indices[::-1])
+
+            self.assertTrue(np.all(np.isfinite(replicas)))
+            self.assertTrue(np.allclose(replicas[0], replicas[1]))
+            self.assertTrue(np.allclose(reversed_replicas, replicas[::-1]))
+
+    def test_weighted_plateau(self):
+        m_eff = np.array([[0.2, 0.3, np.nan],
+                          [np.nan, np.nan, np.nan]])
+        plateau = correlators.analysis.weighted_plateau(m_eff, [1, 3, 1])
+        self.assertAlmostEqual(plateau[0], 0.275)
+        self.assertTrue(np.isnan(plateau[1]))
+
+
+class TestCorrelatedBootstrap(unittest.TestCase):
+    def setUp(self):
+        self.T = 48
+        self.combined = synthetic_ensemble(60, self.T)
+        self.p0_2, self.p0_4 = correlators.analysis.central_fit(self.combined,
+                                                                self.T)
+
+    def bootstrap(self, covariance, combined, indices):
+        return correlators.analysis.correlated_bootstrap(
+            combined, self.T, 24, self.p0_2, self.p0_4, covariance, indices)
+
+    def test_modes_agree(self):
+        indices = np.random.RandomState(1).randint(60, size=(30, 60))
+        results = {}
+        for covariance in ['fixed', 'replica']:
+            replicas = self.bootstrap(covariance, self.combined, indices)
+            self.assertEqual(replicas.shape, (30, 13))
+            results[covariance] = \
+                correlators.analysis.replica_statistics(replicas)
+
+        fixed_val, fixed_err, fixed_failed = results['fixed']
+        replica_val, replica_err, replica_failed = results['replica']
+        self.assertEqual(fixed_failed, 0)
+        self.assertEqual(replica_failed, 0)
+        self.assertAlmostEqual(fixed_val[0], 0.2, places=2)
+        self.assertAlmostEqual(fixed_val[1], 0.45, places=2)
+        for i in range(4):
+            self.assertLess(abs(fixed_val[i] - replica_val[i]), fixed_err[i])
+
+    def test_resampled_correlation_matrices(self):
+        # The correlation matrices from the counts are the ones of the
+        # resampled lists.
+        indices = np.random.RandomState(3).randint(60, size=(5, 60))
+        replicas = self.bootstrap('replica', self.combined, indices)
+
+        expected = correlators.bootstrap.transform_replicas(
+            correlators.analysis.mass_difference_correlated_decorator(
+                self.T, 24, self.p0_2, self.p0_4),
+            self.combined, indices)
+
+        self.assertTrue(np.allclose(replicas, expected, rtol=1e-5))
+
+    def test_singular_replicas_fail(self):
+        # With fewer configurations than time slices in the fit window the
+        # correlation matrix of every replica is singular.
+        combined = self.combined[:8]
+        indices = np.random.RandomState(2).randint(8, size=(3, 8))
+
+        replicas = self.bootstrap('replica', combined, indices)
+
+        self.assertTrue(np.all(np.isnan(replicas)))
+        val, err, failed = correlators.analysis.replica_statistics(replicas)
+        self.assertEqual(failed, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import unittest
+
+import numpy as np
+
+import correlators.autocorrelation
+import correlators.bootstrap
+
+
+def markov_chain(phi, n, k, seed):
+    rng = np.random.RandomState(seed)
+    noise = rng.normal(size=(n, k))
+    chain = np.zeros((n, k))
+    for i in range(1, n):
+        chain[i] = phi * chain[i - 1] + noise[i]
+    return chain
+
+
+class TestAutocorrelation(unittest.TestCase):
+    def test_direct_sum(self):
+        series = np.random.RandomState(0).normal(size=(50, 3))
+        gamma = correlators.autocorrelation.autocorrelation_function(series)
+        deviation = series - np.mean(series, axis=0)
+        for w in [0, 1, 7, 49]:
+            direct = np.mean(deviation[:50 - w] * deviation[w:], axis=0)
+            self.assertTrue(np.allclose(gamma[w], direct))
+
+    def test_markov_chain(self):
+        phi = 0.8
+        exact = (1 + phi) / (1 - phi) / 2
+        chain = markov_chain(phi, 20000, 3, 1)
+        tau, tau_err, window = \
+            correlators.autocorrelation.integrated_autocorrelation_time(chain)
+        self.assertTrue(np.all(np.abs(tau - exact) < 3 * tau_err))
+
+        derived = correlators.autocorrelation.derived_series(
+            chain + 5, lambda mean: mean[0] * mean[1])
+        self.assertEqual(derived.shape, (20000,))
+        tau, tau_err, window = \
+            correlators.autocorrelation.integrated_autocorrelation_time(derived)
+        self.assertLess(abs(tau - exact), 3 * tau_err)
+
+        size = correlators.autocorrelation.recommended_block_size([tau])
+        self.assertEqual(size, int(np.ceil(2 * tau)))
+
+
+class TestBlocks(unittest.TestCase):
+    def test_block_averages(self):
+        sets = [np.array([i, 2 * i]) for i in range(7)]
+        blocks = correlators.bootstrap.block(sets, 3)
+        self.assertEqual(len(blocks), 2)
+        self.assertTrue(np.allclose(blocks[1], [4, 8]))
+        self.assertRaises(ValueError, correlators.bootstrap.block, sets, 4)
+
+    def test_blocked_bootstrap_error(self):
+        chain = markov_chain(0.9, 4000, 1, 2)
+        naive = np.std(correlators.bootstrap.bootstrap_averages(
+            chain, 200, seed=0))
+        blocked = np.std(correlators.bootstrap.bootstrap_averages(
+            chain, 200, seed=0, block_size=100))
+        # The variance is larger by 2 tau_int = 19.
+        self.assertGreater(blocked / naive, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import correlators.cache
+import correlators.fit
+import correlators.kernels
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        correlators.cache.configure(self.directory)
+        self.get_backend = correlators.kernels.get_backend
+
+    def tearDown(self):
+        correlators.cache.configure(None)
+        correlators.kernels.get_backend = self.get_backend
+        shutil.rmtree(self.directory)
+
+    def key(self, shift=48, y=None, p0=(0.2, 3.0)):
+        func = correlators.fit.cosh_fit_decorator(shift)
+        if y is None:
+            y = np.linspace(1, 2, 10)
+        return correlators.cache.key('fit', func, [np.arange(10), y, None],
+                                     [13, 0, list(p0)])
+
+    def test_key(self):
+        self.assertEqual(self.key(), self.key())
+        self.assertEqual(self.key(y=np.linspace(1, 2, 10).tolist()),
+                         self.key())
+        self.assertNotEqual(self.key(shift=64), self.key())
+        self.assertNotEqual(self.key(y=np.linspace(1, 3, 10)), self.key())
+        self.assertNotEqual(self.key(p0=(0.2, 3.1)), self.key())
+
+    def test_key_depends_on_backend_and_code(self):
+        key = self.key()
+
+        correlators.kernels.get_backend = lambda: 'numba'
+        self.assertNotEqual(self.key(), key)
+        correlators.kernels.get_backend = self.get_backend
+
+        digest = correlators.cache.code_digest()
+        correlators.cache._code_digest = 'changed'
+        try:
+            self.assertNotEqual(self.key(), key)
+        finally:
+            correlators.cache._code_digest = digest
+        self.assertEqual(self.key(), key)
+
+    def test_round_trip(self):
+        calls = []
+
+        def compute():
+            calls.append(None)
+            return np.array([0.2, 3.0]), 1.5
+
+        func = correlators.fit.cosh_fit_decorator(48)
+        arguments = [func, [np.arange(10)], [13, 0]]
+        first = correlators.cache.memoize('fit', compute, *arguments)
+        second = correlators.cache.memoize('fit', compute, *arguments)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(list(second[0]), list(first[0]))
+        self.assertEqual(second[1], 1.5)
+
+        correlators.cache.memoize('fit', compute, func, [np.arange(11)],
+                                  [13, 0])
+        self.assertEqual(len(calls), 2)
+
+    def test_eviction(self):
+        value = np.zeros(1000)
+        correlators.cache.put('probe', value)
+        size = os.path.getsize(os.path.join(self.directory, 'probe.pickle'))
+        os.remove(os.path.join(self.directory, 'probe.pickle'))
+
+        correlators.cache.configure(self.directory, 10 * size)
+        for i in range(10):
+            digest = 'entry{}'.format(i)
+            correlators.cache.put(digest, value)
+            path = os.path.join(self.directory, digest + '.pickle')
+            os.utime(path, (1000 + i, 1000 + i))
+
+        # Reading an entry marks it as recently used.
+        self.assertIsNotNone(correlators.cache.get('entry0'))
+        correlators.cache.put('entry10', value)
+
+        remaining = sorted(filename[:-len('.pickle')]
+                           for filename in os.listdir(self.directory))
+        self.assertEqual(remaining, ['entry0', 'entry10', 'entry3', 'entry4',
+                                     'entry5', 'entry6', 'entry7', 'entry8',
+                                     'entry9'])
+        self.assertLessEqual(len(remaining) * size, 0.9 * 10 * size)
+
+
+if __name__ == '__main__':
+    unittest.main()
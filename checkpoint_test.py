@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+import correlators.checkpoint
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.leaf = os.path.join(self.directory, 'leaf')
+        os.makedirs(self.leaf)
+        self.data = os.path.join(self.leaf, 'C2_pi+-_conf0001.dat')
+        with open(self.data, 'wb') as f:
+            f.write(b'12345678')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key_changes(self):
+        options = {'seed': 1}
+        original = correlators.checkpoint.key(self.leaf, options)
+
+        self.assertEqual(correlators.checkpoint.key(self.leaf, options),
+                         original)
+        self.assertNotEqual(correlators.checkpoint.key(self.leaf, {'seed': 2}),
+                            original)
+
+        for name, value in [('invalidate', ['fit']), ('plot_dir', 'plots'),
+                            ('artifact_dir', 'artifacts')]:
+            self.assertEqual(correlators.checkpoint.key(
+                self.leaf, dict(options, **{name: value})), original)
+
+        stat = os.stat(self.data)
+        os.utime(self.data, (stat.st_atime, stat.st_mtime + 10))
+        self.assertNotEqual(correlators.checkpoint.key(self.leaf, options),
+                            original)
+
+    def test_round_trip(self):
+        directory = os.path.join(self.directory, 'checkpoints')
+        series = pd.Series({'m_2_val': 0.22})
+
+        self.assertIsNone(correlators.checkpoint.load(directory, 'abc'))
+        self.assertFalse(correlators.checkpoint.exists(directory, 'abc'))
+        correlators.checkpoint.store(directory, 'abc', self.leaf, 'A40.24',
+                                     series, {'c2': [1.0]}, {'duration': 1.0})
+        self.assertTrue(correlators.checkpoint.exists(directory, 'abc'))
+        ensemble, results, figures = correlators.checkpoint.load(directory,
+                                                                 'abc')
+
+        self.assertEqual(ensemble, 'A40.24')
+        self.assertEqual(results['m_2_val'], 0.22)
+        self.assertEqual(figures, {'c2': [1.0]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,12 +17,20 @@ from __future__ import division, absolute_import, print_function, \
 
 import argparse
 import logging
+import os
 
 import colorsys
-import matplotlib.pyplot as pl
 import numpy as np
-import pandas as pd
 
+import correlators.analysis
+import correlators.cache
+import correlators.checkpoint
+import correlators.daemon
+import correlators.kernels
+import correlators.pipeline
+import correlators.render
+import correlators.results
+import correlators.sharding
 import correlators.traversal
 import unitprint
 
@@ -38,6 +46,13 @@ COLORMAPPER_9 = [
     '#999999',
 ]
 
+QUICK_CONFIGURATIONS = 50
+'Largest number of configurations per ensemble with ``--quick``.'
+
+QUICK_SAMPLE_COUNT = 50
+'Number of bootstrap replicas with ``--quick``.'
+
+
 def coloriter(n):
     return iter([
         colorsys.hsv_to_rgb(x*1.0/n, .9, .9)
@@ -50,22 +65,153 @@ def main():
 
     logging.basicConfig(level=logging.INFO)
 
+    correlators.kernels.set_backend(options.kernels)
+
+    if options.fit_cache is not None:
+        correlators.cache.configure(options.fit_cache,
+                                    options.fit_cache_size * 1024**2)
+        if options.seed is None:
+            logging.warning('The fit cache is used without --seed, the '
+                            'bootstrap replicas will not be found in it.')
+
+    if options.serve is not None:
+        correlators.daemon.serve(options.serve, options.max_memory * 1024**2)
+        return
+
+    if options.quick:
+        reference_dir = _apply_quick(options)
+
     if options.plot_only:
-        result = pd.read_csv('results.csv')
+        result = correlators.results.load(options.results_dir)
+    elif options.merge is not None:
+        correlators.results.create(options.results_dir)
+        result = correlators.sharding.merge(options.merge,
+                                            store=options.results_dir)
+        _export(options, result)
     else:
-        result = correlators.traversal.handle_path(options.path).T
-        pd.set_option('display.max_columns', None)
-        print(result)
-        result.to_csv('results.csv')
+        if options.path is None:
+            raise RuntimeError('A path is needed unless --merge or '
+                               '--plot-only is given.')
+
+        # Workers of a distributed run only contribute their partial results.
+        store = None
+        if options.partial_dir is None:
+            store = options.results_dir
+            correlators.results.create(store)
+
+        result = correlators.traversal.handle_path(
+            options.path,
+            store=store,
+            jobs=options.jobs,
+            prefetch=options.prefetch,
+            shard=options.shard,
+            partial_dir=options.partial_dir,
+            queue=options.queue,
+            checkpoint_dir=None if options.no_checkpoints
+            else options.checkpoint_dir,
+            covariance=options.covariance,
+            compare_covariance=options.compare_covariance,
+            joint=options.joint,
+            seed=options.seed,
+            formula=options.formula,
+            ratio=options.ratio,
+            c4_model=options.c4_model,
+            states=options.states,
+            t_min=options.t_min,
+            block_size=options.block_size,
+            artifact_dir=options.artifact_dir,
+            plot_dir=None if options.no_plots else options.plot_dir,
+            invalidate=options.invalidate,
+            sample_count=QUICK_SAMPLE_COUNT if options.quick else 250,
+            max_configurations=QUICK_CONFIGURATIONS if options.quick else None,
+        )
+        print(result.to_string())
+
+        if options.quick:
+            _report_quick(result, options.results_dir, reference_dir)
 
+        if store is None:
+            return
+
+        _export(options, result)
+
+    if options.no_plots:
+        return
+
+    correlators.render.render_directory(options.plot_dir, jobs=options.jobs)
     plot_results(result)
 
 
+def _apply_quick(options):
+    '''
+    Changes the options for an approximate preview.
+
+    The results go into a separate store and CSV file with ``-quick`` in the
+    name, such that the results of the last full run stay for comparison.
+
+    :returns: Location of the results of the last full run
+    :rtype: str
+    '''
+    if options.plot_only or options.merge is not None:
+        raise RuntimeError('--quick only works for an analysis.')
+
+    reference_dir = options.results_dir
+    options.results_dir += '-quick'
+    if options.csv:
+        stem, extension = os.path.splitext(options.csv)
+        options.csv = stem + '-quick' + extension
+    options.covariance = 'fixed'
+    options.compare_covariance = False
+    options.no_plots = True
+
+    return reference_dir
+
+
+def _report_quick(result, results_dir, reference_dir):
+    '''
+    Labels the results as approximate and compares them with the last full
+    run.
+    '''
+    print()
+    print('APPROXIMATE results from --quick with at most {} configurations, '
+          '{} bootstrap replicas and fixed covariance, stored in `{}`.'.format(
+              QUICK_CONFIGURATIONS, QUICK_SAMPLE_COUNT, results_dir))
+
+    if not correlators.results.exists(reference_dir):
+        print('There is no full run in `{}` to compare with.'.format(
+            reference_dir))
+        return
+
+    # The constants of the ensembles are the same in both runs.
+    deviation = correlators.results.deviation(
+        result, correlators.results.load(reference_dir),
+        correlators.analysis.fitted_quantities()).T
+    if deviation.empty:
+        print('No ensemble of the full run in `{}` has been analyzed.'.format(
+            reference_dir))
+        return
+
+    deviation['largest'] = deviation.abs().max(axis=1)
+    print('Deviation from the last full run in `{}` in units of its '
+          'error:'.format(reference_dir))
+    print(deviation.to_string(float_format='{:+.2f}'.format))
+
+
+def _export(options, result):
+    '''
+    Writes the results as CSV unless disabled.
+    '''
+    if options.csv:
+        result.to_csv(options.csv)
+
+
 def leading_order(x):
     return - x**2 / (8 * np.pi)
 
 
 def plot_results(result):
+    import matplotlib.pyplot as pl
+
     fig = pl.figure()
     ax = fig.add_subplot(1, 1, 1)
 
@@ -77,7 +223,7 @@ def plot_results(result):
         ax.errorbar(
             data['m_pi/f_pi_val'], data['a0*m2_val'],
             xerr=data['m_pi/f_pi_err'], yerr=data['a0*m2_err'],
-            linestyle='none', marker='o', label=data[0], color=color,
+            linestyle='none', marker='o', label=ensemble, color=color,
         )
         ax.errorbar(
             data['m_pi/f_pi_val']+0.005, data['corr__a0*m2_val'],
@@ -109,6 +255,30 @@ def plot_results(result):
     fig.savefig('result.pdf')
 
 
+def block_size_type(value):
+    '''
+    Parses the block size, which is a positive integer or ``auto``.
+    '''
+    if value == 'auto':
+        return value
+
+    size = int(value)
+    if size < 1:
+        raise argparse.ArgumentTypeError('Block size has to be positive.')
+    return size
+
+
+def shard_type(value):
+    '''
+    Parses the shard specification, see
+    :func:`correlators.sharding.parse_shard`.
+    '''
+    try:
+        return correlators.sharding.parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 def _parse_args():
     '''
     Parses the command line arguments.
@@ -117,8 +287,127 @@ def _parse_args():
     :rtype: Namespace
     '''
     parser = argparse.ArgumentParser(description='')
-    parser.add_argument('path')
-    parser.add_argument('--plot-only', action='store_true')
+    parser.add_argument('path', nargs='?')
+    parser.add_argument('--plot-only', action='store_true',
+                        help='Only draw the figures from the saved results.')
+    parser.add_argument('--no-plots', action='store_true',
+                        help='Neither save the data of the figures nor draw '
+                        'them.')
+    parser.add_argument('--plot-dir', metavar='DIR',
+                        default=correlators.render.DEFAULT_DIRECTORY,
+                        help='Save the data of the figures there and draw the '
+                        'figures whose data has changed, using --jobs '
+                        'processes. Default: %(default)s')
+    parser.add_argument('--covariance', choices=['replica', 'fixed'],
+                        default='replica',
+                        help='Recompute the correlation matrix for every '
+                        'bootstrap replica or estimate it once on the '
+                        'original ensemble. Default: %(default)s')
+    parser.add_argument('--compare-covariance', action='store_true',
+                        help='Also run the other covariance mode and log '
+                        'timing and differences.')
+    parser.add_argument('--joint', action='store_true',
+                        help='Also fit both correlators simultaneously with '
+                        'their block correlation matrix.')
+    parser.add_argument('--ratio', action='store_true',
+                        help='Also determine the energy shift with the ratio '
+                        'method for a cross-check.')
+    parser.add_argument('--c4-model', choices=['offset', 'shifted'],
+                        default='offset',
+                        help='Fit the four-point function with a constant '
+                        'offset or fit its shifted difference where the '
+                        'offset cancels. Default: %(default)s')
+    parser.add_argument('--states', type=int, metavar='N',
+                        help='Also fit models with N states to the bootstrap '
+                        'replicas, starting at --t-min.')
+    parser.add_argument('--t-min', type=int, default=5,
+                        help='First time slice of the multi-state fits. '
+                        'Default: %(default)s')
+    parser.add_argument('--block-size', type=block_size_type, default=1,
+                        metavar='N',
+                        help='Average blocks of N consecutive configurations '
+                        'before resampling, `auto` uses the recommendation '
+                        'from the autocorrelation analysis. Default: '
+                        '%(default)s')
+    parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                        help='Analyze N folders in parallel processes. '
+                        'Default: %(default)s')
+    parser.add_argument('--prefetch', type=int, default=1, metavar='N',
+                        help='Load up to N folders in the background while '
+                        'one is analyzed, 0 disables it. Only used with a '
+                        'single job. Default: %(default)s')
+    parser.add_argument('--quick', action='store_true',
+                        help='Approximate preview with at most {} '
+                        'configurations per ensemble, {} bootstrap replicas, '
+                        'fixed covariance and no plots. The results get '
+                        '`-quick` in their names and are compared with the '
+                        'last full run.'.format(QUICK_CONFIGURATIONS,
+                                                QUICK_SAMPLE_COUNT))
+    parser.add_argument('--results-dir', metavar='DIR', default='results',
+                        help='Store the results in binary columns there, '
+                        'this is read by --plot-only. Default: %(default)s')
+    parser.add_argument('--csv', metavar='FILE', default='results.csv',
+                        help='Also export the results as CSV, an empty name '
+                        'disables it. Default: %(default)s')
+    parser.add_argument('--partial-dir', metavar='DIR',
+                        help='Write the results of every folder into this '
+                        'shared directory instead of the results store.')
+    parser.add_argument('--shard', type=shard_type, metavar='I/N',
+                        help='Only analyze every N-th folder starting with '
+                        'the I-th, counting from zero.')
+    parser.add_argument('--queue', action='store_true',
+                        help='Claim folders in --partial-dir such that any '
+                        'number of processes can work on the same tree.')
+    parser.add_argument('--merge', metavar='DIR',
+                        help='Combine the partial results in DIR into the '
+                        'results store and plot them.')
+    parser.add_argument('--checkpoint-dir', metavar='DIR',
+                        default=correlators.checkpoint.DEFAULT_DIRECTORY,
+                        help='Store the results of every folder as soon as it '
+                        'is done and reuse them in later runs if data, '
+                        'options and code are unchanged. Default: '
+                        '%(default)s')
+    parser.add_argument('--no-checkpoints', action='store_true',
+                        help='Neither use nor store checkpoints.')
+    parser.add_argument('--artifact-dir', nargs='?', metavar='DIR',
+                        const=correlators.pipeline.DEFAULT_DIRECTORY,
+                        help='Store the output of every analysis stage and '
+                        'only rerun stages whose inputs have changed. '
+                        'Without DIR %(const)s is used.')
+    parser.add_argument('--invalidate', action='append', default=[],
+                        metavar='STAGE',
+                        choices=[stage['name']
+                                 for stage in correlators.analysis.STAGES],
+                        help='Rerun this stage and the ones depending on it. '
+                        'Can be given multiple times.')
+    parser.add_argument('--serve', metavar='SOCKET',
+                        help='Keep the ensembles in memory and answer '
+                        'requests from `python -m correlators.client` on '
+                        'this Unix socket.')
+    parser.add_argument('--max-memory', type=int, metavar='MB',
+                        default=correlators.daemon.DEFAULT_MAX_BYTES // 1024**2,
+                        help='Memory for the ensembles of --serve, the least '
+                        'recently used ones are dropped. Default: '
+                        '%(default)s MB')
+    parser.add_argument('--kernels', choices=sorted(correlators.kernels.KERNELS),
+                        default=correlators.kernels.get_backend(),
+                        help='Implementation of the inner kernels. '
+                        'Default: %(default)s')
+    parser.add_argument('--formula', choices=['expansion', 'luescher'],
+                        default='expansion',
+                        help='Finite volume formula for the scattering '
+                        'length. Default: %(default)s')
+    parser.add_argument('--seed', type=int,
+                        help='Seed for the bootstrap replicas.')
+    parser.add_argument('--fit-cache', nargs='?', metavar='DIR',
+                        const=os.path.join(correlators.cache.DEFAULT_DIRECTORY,
+                                           'fits'),
+                        help='Reuse fit results from the given cache '
+                        'directory. Default directory: %(const)s')
+    parser.add_argument('--fit-cache-size', type=int, default=500,
+                        metavar='MB',
+                        help='Size limit of the fit cache. Default: '
+                        '%(default)s MB')
     options = parser.parse_args()
 
     return options
@@ -12,15 +12,18 @@ from __future__ import division, absolute_import, print_function, \
     unicode_literals
 
 import logging
+import random
+import time
 
-import matplotlib.pyplot as pl
 import numpy as np
-import pandas as pd
 
+import correlators.autocorrelation
 import correlators.bootstrap
+import correlators.checkpoint
 import correlators.corrfit
 import correlators.fit
 import correlators.loader
+import correlators.pipeline
 import correlators.plot
 import correlators.scatlen
 import correlators.transform
@@ -87,110 +90,538 @@ ENSENBLE_DATA = {
 'List of ensembles used in arXiv:1412.0408v1'
 
 
-def handle_path(path):
+COLUMNS = {
+    '': ['m_2', 'm_4', 'Delta E', 'a_0', 'amp_2', 'amp_4', 'offset_4',
+         'a0*m2', 'm2**2'],
+    'corr': ['m_2', 'm_4', 'Delta E', 'a_0', 'amp_2', 'amp_4', 'offset_4',
+             'a0*m2', 'm2**2', 'chi_sq_2', 'chi_sq_4', 'p_value_2',
+             'p_value_4'],
+    'joint': ['m_2', 'm_4', 'Delta E', 'a_0', 'amp_2', 'amp_4', 'offset_4',
+              'a0*m2', 'm2**2', 'chi_sq', 'p_value'],
+    'ratio': ['m_2', 'Delta E', 'a_0', 'amp', 'a0*m2'],
+    'states': ['m_2', 'm_4', 'Delta E', 'a_0', 'amp_2', 'amp_4', 'offset_4',
+               'a0*m2', 'chi_sq_2', 'chi_sq_4'],
+}
+'Names of the results of each method, the prefix of the columns is the key.'
+
+
+def fitted_quantities():
+    '''
+    Lists the quantities that are determined by the fits.
+
+    The constants of the ensembles that are copied into the results, like
+    ``m_pi/f_pi``, are not among them.
+
+    :returns: Names of the columns without the ``_val`` or ``_err`` suffix
+    :rtype: list
+    '''
+    return [(method + '__' if method else '') + name
+            for method, names in sorted(COLUMNS.items()) for name in names]
+
+
+def handle_path(path, covariance='replica', compare_covariance=False,
+                joint=False, seed=None, formula='expansion', ratio=False,
+                c4_model='offset', states=None, t_min=5, block_size=1,
+                artifact_dir=None, invalidate=(), sample_count=250,
+                max_configurations=None):
     '''
     Performs the analysis of all the files in the given folder.
+
+    The analysis is split into the stages in :data:`STAGES`, which are run
+    with :func:`correlators.pipeline.run`.
+
+    :param str covariance: Either ``replica`` to recompute the correlation
+        matrix for every bootstrap replica or ``fixed`` to estimate it once on
+        the original ensemble and reuse it for all replicas.
+    :param bool compare_covariance: Also run the correlated fits with the other
+        covariance mode and log the timing and the differences.
+    :param bool joint: Additionally perform the simultaneous correlated fit of
+        the two- and four-point function.
+    :param int seed: Seed for the bootstrap. With a fixed seed the replicas
+        are the same in every run, which is needed to reuse cached fits.
+    :param str formula: Finite volume formula for the scattering length, see
+        :func:`correlators.scatlen.compute_a0`.
+    :param bool ratio: Additionally determine the energy shift with the ratio
+        method, see :func:`ratio_bootstrap`.
+    :param str c4_model: Either ``offset`` to fit the four-point function with
+        a constant offset or ``shifted`` to fit its shifted difference where
+        the offset cancels, see :func:`four_point_model`.
+    :param int states: If given, additionally fit models with this number of
+        states from ``t_min`` on, see :func:`excited_states_bootstrap`.
+    :param int t_min: First time slice used in the multi-state fits.
+    :param block_size: Number of consecutive configurations that are averaged
+        before resampling or ``auto`` to use the recommendation of
+        :func:`autocorrelation_analysis`.
+    :param str artifact_dir: Store the output of every stage there and reuse
+        it as long as its inputs are unchanged.
+    :param list invalidate: Names of stages to run again together with the
+        stages depending on them.
+    :param int sample_count: Number of bootstrap replicas.
+    :param int max_configurations: Only use this many configurations, evenly
+        spaced over the whole ensemble. This is meant for quick previews, see
+        :func:`subset`.
+    :returns: Ensemble, results and the data of the figures for
+        :func:`correlators.render.save`
     '''
     LOGGER.info('Working on path `%s`.', path)
-    two_points, four_points, parameters = correlators.loader.folder_loader(path)
 
-    name = parameters['path'].replace('/', '__')
+    options = {
+        'path': path,
+        'manifest': correlators.checkpoint.manifest(path),
+        'block_size': block_size,
+        'max_configurations': max_configurations,
+        'seed': seed,
+        'sample_count': sample_count,
+        'covariance': covariance,
+        'compare_covariance': compare_covariance,
+        'joint': joint,
+        'ratio': ratio,
+        'c4_model': c4_model,
+        'states': states,
+        't_min': t_min,
+        'formula': formula,
+    }
+    outputs = correlators.pipeline.run(STAGES, options, artifact_dir,
+                                       invalidate)
+
+    import pandas as pd
+
+    parameters = outputs['load']['parameters']
+    combined = outputs['combine']
+    replicas = outputs['scatlen']
+
+    series = pd.Series({
+        'm_pi/f_pi_val': ENSENBLE_DATA[parameters['ensemble']]['m_pi/f_pi_val'],
+        'm_pi/f_pi_err': ENSENBLE_DATA[parameters['ensemble']]['m_pi/f_pi_err'],
+        'L': parameters['L'],
+        'T': parameters['T'],
+        'a0*m_pi_paper_val':
+        ENSENBLE_DATA[parameters['ensemble']]['a0*m_pi_paper_val'],
+        'a0*m_pi_paper_err':
+        ENSENBLE_DATA[parameters['ensemble']]['a0*m_pi_paper_err'],
+        'block_size': combined['block_size'],
+        'configurations': combined['configurations'],
+        'sample_count': len(outputs['resample']['indices']),
+    })
+
+    for method, names in sorted(COLUMNS.items()):
+        if method not in replicas:
+            continue
+        prefix = method + '__' if method else ''
+        val, err, failed = replica_statistics(replicas[method])
+        if failed > 0:
+            LOGGER.warning('%d of %d replicas of the %s fits have failed.',
+                           failed, len(replicas[method]), method or 'plain')
+        for column, v, e in zip(names, val, err):
+            series['{}{}_val'.format(prefix, column)] = v
+            series['{}{}_err'.format(prefix, column)] = e
+        series['{}failed_replicas'.format(prefix)] = failed
+
+    for observable, (tau, tau_err) in combined['tau_int'].items():
+        series['tau_int_{}_val'.format(observable)] = tau
+        series['tau_int_{}_err'.format(observable)] = tau_err
+
+    return parameters['ensemble'], series, outputs['figures']
+
+
+def replica_statistics(results):
+    '''
+    Computes value and error of the results of all replicas.
+
+    Replicas with a NaN anywhere in their results have failed, they are left
+    out.
+
+    :param np.array results: Results with one row per replica
+    :returns: Average and standard deviation over the successful replicas and
+        the number of failed replicas
+    :rtype: tuple(np.array, np.array, int)
+    '''
+    results = np.asarray(results, dtype=float)
+    succeeded = ~np.any(np.isnan(results), axis=1)
+    val = np.mean(results[succeeded], axis=0)
+    err = np.std(results[succeeded], axis=0)
+    return val, err, int(np.sum(~succeeded))
 
-    m_pi_f_pi_val = ENSENBLE_DATA[parameters['ensemble']]['m_pi/f_pi_val']
-    m_pi_f_pi_err = ENSENBLE_DATA[parameters['ensemble']]['m_pi/f_pi_err']
 
-    a0_mpi_paper_val = ENSENBLE_DATA[parameters['ensemble']]['a0*m_pi_paper_val']
-    a0_mpi_paper_err = ENSENBLE_DATA[parameters['ensemble']]['a0*m_pi_paper_err']
+def load_stage(path, manifest):
+    '''
+    Loads and folds the correlators of a folder.
+
+    :param list manifest: Files of the folder, see
+        :func:`correlators.checkpoint.manifest`. It is not used, but makes the
+        artifact depend on the files.
+    '''
+    two_points, four_points, parameters = \
+        correlators.loader.folder_loader(path)
+    return {
+        'two_points': two_points,
+        'four_points': four_points,
+        'parameters': parameters,
+    }
 
-    T = int(parameters['T'])
-    L = int(parameters['L'])
+
+def subset(configurations, count):
+    '''
+    Selects evenly spaced configurations.
+
+    Exactly ``count`` configurations are taken, the first and the last one
+    and the others as evenly spaced between them as possible. The selection
+    is the same in every run.
+
+    :param list configurations: Measurements ordered by configuration
+    :param int count: Largest number of configurations, ``None`` for all
+    :rtype: list
+    '''
+    if count is None or len(configurations) <= count:
+        return configurations
+
+    indices = np.linspace(0, len(configurations) - 1, count).round()
+    return [configurations[i] for i in indices.astype(int)]
+
+
+def combine_stage(loaded, block_size, max_configurations):
+    '''
+    Groups the correlators by configuration and averages blocks of them.
+    '''
+    T = int(loaded['parameters']['T'])
+    L = int(loaded['parameters']['L'])
 
     # Combine the two lists of data into one list of lists. That way the
     # configurations are grouped together.
-    combined = zip(two_points, four_points)
+    combined = list(zip(loaded['two_points'], loaded['four_points']))
+    combined = subset(combined, max_configurations)
+    if len(combined) < len(loaded['two_points']):
+        LOGGER.info('Using %d of %d configurations.', len(combined),
+                    len(loaded['two_points']))
+
+    tau_int, recommended = autocorrelation_analysis(combined)
+    if block_size == 'auto':
+        # The correlation matrix in the fit window needs more blocks than
+        # time slices to be invertible.
+        largest = len(combined) // (T // 2 + 1 - 13 + 2)
+        if recommended > largest:
+            LOGGER.warning('Only %d configurations, reducing the block size '
+                           'from %d to %d.', len(combined), recommended,
+                           largest)
+        block_size = max(1, min(recommended, largest))
+    LOGGER.info('Using blocks of %d configurations, recommended are %d.',
+                block_size, recommended)
+
+    return {
+        'combined': correlators.bootstrap.block(combined, block_size),
+        'block_size': block_size,
+        'configurations': len(combined),
+        'tau_int': tau_int,
+        'T': T,
+        'L': L,
+    }
+
+
+def resample_stage(combined, seed, sample_count):
+    '''
+    Draws the bootstrap replicas that all methods use.
 
-    #fig = pl.figure()
-    #ax = fig.add_subplot(1, 1, 1)
+    The replicas are rows of indices of the configurations, see
+    :func:`correlators.bootstrap.generate_indices`.
 
-    val, err = correlators.bootstrap.bootstrap_pre_transform(
-        mass_difference_decorator(T, L),
-        combined,
-    )
+    Without a seed a random one is drawn, it is part of the artifact.
+    '''
+    if seed is None:
+        seed = random.randint(0, 2**31 - 1)
 
-    p0_2 = [val[0], val[4]]
-    p0_4 = [val[1], val[5], val[6]]
+    return {
+        'seed': seed,
+        'indices': correlators.bootstrap.generate_indices(
+            len(combined['combined']), sample_count, seed),
+    }
 
-    corr_fit_param, corr_fit_err = correlators.bootstrap.bootstrap_pre_transform(
-        mass_difference_correlated_decorator(T, L, p0_2, p0_4),
-        combined
-    )
 
-    print(corr_fit_param, corr_fit_err)
+def central_stage(combined, c4_model):
+    '''
+    Fits both correlators on the full ensemble, see :func:`central_fit`.
+    '''
+    p_2, p_4 = central_fit(combined['combined'], combined['T'], c4_model)
+    return {'p_2': p_2, 'p_4': p_4}
 
-    #fig.savefig('newton_' + name + '.pdf')
 
-    series = pd.Series({
-        'm_2_val': val[0],
-        'm_2_err': err[0],
-        'm_4_val': val[1],
-        'm_4_err': err[1],
-        'Delta E_val': val[2],
-        'Delta E_err': err[2],
-        'a_0_val': val[3],
-        'a_0_err': err[3],
-        'amp_2_val': val[4],
-        'amp_2_err': err[4],
-        'amp_4_val': val[5],
-        'amp_4_err': err[5],
-        'offset_4_val': val[6],
-        'offset_4_err': err[6],
-        'a0*m2_val': val[7],
-        'a0*m2_err': err[7],
-        'm2**2_val': val[8],
-        'm2**2_err': err[8],
-        'corr__m_2_val': corr_fit_param[0],
-        'corr__m_2_err': corr_fit_err[0],
-        'corr__m_4_val': corr_fit_param[1],
-        'corr__m_4_err': corr_fit_err[1],
-        'corr__Delta E_val': corr_fit_param[2],
-        'corr__Delta E_err': corr_fit_err[2],
-        'corr__a_0_val': corr_fit_param[3],
-        'corr__a_0_err': corr_fit_err[3],
-        'corr__amp_2_val': corr_fit_param[4],
-        'corr__amp_2_err': corr_fit_err[4],
-        'corr__amp_4_val': corr_fit_param[5],
-        'corr__amp_4_err': corr_fit_err[5],
-        'corr__offset_4_val': corr_fit_param[6],
-        'corr__offset_4_err': corr_fit_err[6],
-        'corr__a0*m2_val': corr_fit_param[7],
-        'corr__a0*m2_err': corr_fit_err[7],
-        'corr__m2**2_val': corr_fit_param[8],
-        'corr__m2**2_err': corr_fit_err[8],
-        'corr__chi_sq_2_val': corr_fit_param[9],
-        'corr__chi_sq_2_err': corr_fit_err[9],
-        'corr__chi_sq_4_val': corr_fit_param[10],
-        'corr__chi_sq_4_err': corr_fit_err[10],
-        'corr__p_value_2_val': corr_fit_param[11],
-        'corr__p_value_2_err': corr_fit_err[11],
-        'corr__p_value_4_val': corr_fit_param[12],
-        'corr__p_value_4_err': corr_fit_err[12],
-        'm_pi/f_pi_val': m_pi_f_pi_val,
-        'm_pi/f_pi_err': m_pi_f_pi_err,
-        'L': parameters['L'],
-        'T': parameters['T'],
-        'a0*m_pi_paper_val': a0_mpi_paper_val,
-        'a0*m_pi_paper_err': a0_mpi_paper_err,
-    })
+def fit_stage(combined, resampled, central, covariance, compare_covariance,
+              joint, ratio, c4_model, states, t_min):
+    '''
+    Performs the fits of all replicas with every selected method.
+
+    The scattering length in the results is a preliminary one, it is replaced
+    in :func:`scatlen_stage`.
+
+    :returns: Results of each replica for each method, see :data:`COLUMNS`
+    :rtype: dict
+    '''
+    T, L = combined['T'], combined['L']
+    combined = combined['combined']
+    indices = resampled['indices']
+
+    # All bootstrap replicas are started from the fit to the full ensemble.
+    p0_2, p0_4 = central['p_2'], central['p_4']
+
+    replicas = {}
+
+    replicas[''] = correlators.bootstrap.transform_replicas(
+        mass_difference_decorator(T, L, p0_2=p0_2, p0_4=p0_4,
+                                  c4_model=c4_model),
+        combined, indices)
+
+    replicas['corr'] = correlated_bootstrap(
+        combined, T, L, p0_2, p0_4, covariance, indices, c4_model=c4_model)
+
+    if compare_covariance:
+        other = 'fixed' if covariance == 'replica' else 'replica'
+        other_replicas = correlated_bootstrap(
+            combined, T, L, p0_2, p0_4, other, indices, c4_model=c4_model)
+        val, err, failed = replica_statistics(replicas['corr'])
+        other_val, other_err, other_failed = \
+            replica_statistics(other_replicas)
+        for i, label in [(0, 'm_2'), (1, 'm_4'), (2, 'Delta E'), (3, 'a_0')]:
+            LOGGER.info('%s: %s %g ± %g, %s %g ± %g, shift %.3g σ.', label,
+                        covariance, val[i], err[i], other, other_val[i],
+                        other_err[i], (other_val[i] - val[i]) / err[i])
+
+    if joint:
+        p0_joint = [p0_2[0], p0_2[1], p0_4[0] - 2 * p0_2[0], p0_4[1],
+                    p0_4[2] if c4_model == 'offset' else 0]
+        replicas['joint'] = joint_bootstrap(combined, T, L, p0_joint,
+                                            covariance, indices)
+
+    if ratio:
+        replicas['ratio'] = ratio_bootstrap(combined, T, L, indices)
+
+    if states is not None:
+        replicas['states'] = excited_states_bootstrap(
+            combined, T, L, indices, states, omit_pre=t_min)
+
+    return replicas
+
+
+def scatlen_stage(combined, fitted, formula):
+    '''
+    Computes the scattering length of every replica with the given formula.
+    '''
+    L = combined['L']
+
+    replicas = {}
+    for method, results in fitted.items():
+        names = COLUMNS[method]
+        results = np.array(results, dtype=float)
+        m2 = results[:, names.index('m_2')]
+        if 'm_4' in names:
+            m4 = results[:, names.index('m_4')]
+        else:
+            m4 = 2 * m2 + results[:, names.index('Delta E')]
+        a0 = correlators.scatlen.compute_a0(m2, m4, L, formula=formula)
+        results[:, names.index('a_0')] = a0
+        results[:, names.index('a0*m2')] = a0 * m2
+        replicas[method] = results
+
+    val, err, failed = replica_statistics(replicas[''])
+    for method in ['ratio', 'states']:
+        if method in replicas:
+            i = COLUMNS[method].index('Delta E')
+            other_val, other_err, other_failed = \
+                replica_statistics(replicas[method])
+            LOGGER.info('Delta E: fits %g ± %g, %s %g ± %g.', val[2], err[2],
+                        method, other_val[i], other_err[i])
+
+    return replicas
+
+
+def figures_stage(loaded, combined, resampled, central, c4_model):
+    '''
+    Collects the data for the plots of the correlators and their effective
+    masses.
+
+    The averages of the bootstrap replicas from :func:`resample_stage` are
+    shown together with the fits from :func:`central_stage`.
+
+    :returns: Data of each figure for :func:`correlators.render.save`
+    :rtype: dict
+    '''
+    name = loaded['parameters']['path'].replace('/', '__')
+    T = combined['T']
+    stack2, stack4 = [np.real(np.array(sets))
+                      for sets in zip(*combined['combined'])]
+    indices = resampled['indices']
+    averages2 = np.mean(stack2[indices], axis=1)
+    averages4 = np.mean(stack4[indices], axis=1)
+
+    # The shifted model describes the shifted difference of the data.
+    if c4_model == 'offset':
+        model4, fitted4 = 'cosh_offset', averages4
+    else:
+        model4 = 'sinh'
+        fitted4 = correlators.transform.shifted_difference(averages4)
+
+    return {
+        name + '_c2_folded': correlators.plot.correlator_figure(
+            averages2, 'cosh', T, central['p_2']),
+        name + '_c4_folded': correlators.plot.correlator_figure(
+            fitted4, model4, T, central['p_4']),
+        name + '_c2_m_eff': correlators.plot.effective_mass_figure(
+            averages2, T),
+        name + '_c4_m_eff': correlators.plot.effective_mass_figure(
+            averages4, T),
+    }
+
+
+STAGES = [
+    correlators.pipeline.stage(
+        'load', load_stage, [], ['path', 'manifest'],
+        ['correlators.loader', 'correlators.kernels']),
+    correlators.pipeline.stage(
+        'combine', combine_stage, ['load'],
+        ['block_size', 'max_configurations'],
+        ['correlators.autocorrelation', 'correlators.bootstrap']),
+    correlators.pipeline.stage(
+        'resample', resample_stage, ['combine'], ['seed', 'sample_count'],
+        ['correlators.bootstrap']),
+    correlators.pipeline.stage(
+        'central', central_stage, ['combine'], ['c4_model'],
+        ['correlators.analysis', 'correlators.bootstrap', 'correlators.fit',
+         'correlators.kernels', 'correlators.transform']),
+    correlators.pipeline.stage(
+        'fit', fit_stage, ['combine', 'resample', 'central'],
+        ['covariance', 'compare_covariance', 'joint', 'ratio', 'c4_model',
+         'states', 't_min'],
+        ['correlators.analysis', 'correlators.bootstrap', 'correlators.corrfit',
+         'correlators.fit', 'correlators.kernels', 'correlators.transform']),
+    correlators.pipeline.stage(
+        'scatlen', scatlen_stage, ['combine', 'fit'], ['formula'],
+        ['correlators.scatlen', 'correlators.zeta']),
+    correlators.pipeline.stage(
+        'figures', figures_stage,
+        ['load', 'combine', 'resample', 'central'], ['c4_model'],
+        ['correlators.plot', 'correlators.transform']),
+]
+'Stages of the analysis of one folder.'
+
+
+def autocorrelation_analysis(combined, omit_pre=13):
+    '''
+    Determines the integrated autocorrelation times of the correlators.
+
+    The times of the correlators are computed for all time slices in the fit
+    window and the largest one is reported. The plateau average of the
+    effective mass is analyzed as a derived observable with
+    :func:`correlators.autocorrelation.derived_series`.
+
+    :returns: Integrated autocorrelation time and its error for each
+        observable, the recommended block size
+    :rtype: tuple(dict, int)
+    '''
+    sets2, sets4 = zip(*combined)
+
+    def plateau(average):
+        m_eff = correlators.transform.effective_mass_cosh_block(average)
+        return np.nanmean(m_eff[omit_pre - 1:])
+
+    tau_int = {}
+    for name, sets in [('c2', sets2), ('c4', sets4)]:
+        series = np.real(np.array(sets))
+        tau, tau_err, window = \
+            correlators.autocorrelation.integrated_autocorrelation_time(
+                series[:, omit_pre:])
+        i = np.argmax(tau)
+        tau_int[name] = tau[i], tau_err[i]
 
-    correlators.plot.plot_correlator(two_points, name+'_c2', T)
-    correlators.plot.plot_correlator(four_points, name+'_c4', T, offset=True)
-    correlators.plot.plot_effective_mass(two_points, name+'_c2')
-    correlators.plot.plot_effective_mass(four_points, name+'_c4')
+        derived = correlators.autocorrelation.derived_series(series, plateau)
+        tau, tau_err, window = \
+            correlators.autocorrelation.integrated_autocorrelation_time(
+                derived)
+        tau_int['m_eff_' + name[1:]] = tau, tau_err
 
-    return parameters['ensemble'], series
+    for name, (tau, tau_err) in sorted(tau_int.items()):
+        LOGGER.info('Integrated autocorrelation time of %s: %g ± %g.', name,
+                    tau, tau_err)
 
+    recommended = correlators.autocorrelation.recommended_block_size(
+        [tau for tau, tau_err in tau_int.values()])
 
-def mass_difference_decorator(T, L, fig=None):
+    return tau_int, recommended
+
+
+def four_point_model(T, c4_model):
+    '''
+    Returns the model and the data transform for the four-point function.
+
+    With ``offset`` the data is fitted directly with
+    :func:`correlators.fit.cosh_fit_offset_decorator`. With ``shifted`` the
+    data is replaced by :func:`correlators.transform.shifted_difference` and
+    fitted with :func:`correlators.fit.sinh_fit_decorator`, which has one
+    parameter less.
+
+    :returns: Model and transform that takes correlators with the time as the
+        last axis
+    '''
+    if c4_model == 'offset':
+        return correlators.fit.cosh_fit_offset_decorator(T), np.asarray
+    elif c4_model == 'shifted':
+        return correlators.fit.sinh_fit_decorator(T), \
+            correlators.transform.shifted_difference
+    else:
+        raise ValueError('Unknown four-point model `{}`.'.format(c4_model))
+
+
+def four_point_offset(c4_val, T, p4, omit_pre=13):
+    r'''
+    Returns the offset of the four-point function.
+
+    If the offset has not been fitted, it is estimated as the average
+    deviation of the data from the fitted :math:`\cosh` in the fit window.
+    '''
+    if len(p4) > 2:
+        return p4[2]
+
+    time = np.arange(len(c4_val))
+    cosh_fit = correlators.fit.cosh_fit_decorator(T)
+    return np.mean((c4_val - cosh_fit(time, p4[0], p4[1]))[omit_pre:])
+
+
+def central_fit(combined, T, c4_model='offset'):
+    '''
+    Fits both correlators on the full ensemble.
+
+    The initial parameters are estimated from the effective mass plateau with
+    :func:`correlators.fit.guess_cosh_parameters`. The resulting parameters
+    are meant as starting point for the fits on the bootstrap replicas.
+
+    :returns: Parameters of the two- and the four-point function
+    :rtype: tuple(list, list)
+    '''
+    params = correlators.bootstrap.average_combined_array(combined)
+    (c2_val, c2_err), (c4_val, c4_err) = params
+
+    time = np.array(range(len(c2_val)))
+
+    fit2 = correlators.fit.cosh_fit_decorator(T)
+    p2 = correlators.fit.fit(
+        fit2, time, c2_val, c2_err, omit_pre=13,
+        p0=correlators.fit.guess_cosh_parameters(c2_val, T, omit_pre=13))
+    fit4, transform4 = four_point_model(T, c4_model)
+    sets4 = transform4([c4 for c2, c4 in combined])
+    p0_4 = correlators.fit.guess_cosh_parameters(c4_val, T, omit_pre=13,
+                                                 offset=c4_model == 'offset')
+    p4 = correlators.fit.fit(
+        fit4, time[:sets4.shape[1]], np.mean(sets4, axis=0),
+        np.std(sets4, axis=0), omit_pre=13, p0=p0_4)
+
+    return list(p2), list(p4)
+
+
+def mass_difference_decorator(T, L, fig=None, p0_2=None, p0_4=None,
+                              formula='expansion', c4_model='offset'):
+    '''
+    Creates the transform for the uncorrelated fits.
+
+    If no initial parameters are given, they are estimated for every replica
+    with :func:`correlators.fit.guess_cosh_parameters`.
+    '''
     def mass_difference(sets):
         params = correlators.bootstrap.average_combined_array(sets)
         # Unpack all the arguments from the list.
@@ -200,12 +631,29 @@ def mass_difference_decorator(T, L, fig=None):
         time = np.array(range(len(c2_val)))
 
         # Perform the fits.
+        if p0_2 is None:
+            start_2 = correlators.fit.guess_cosh_parameters(c2_val, T,
+                                                            omit_pre=13)
+        else:
+            start_2 = p0_2
+        if p0_4 is None:
+            start_4 = correlators.fit.guess_cosh_parameters(
+                c4_val, T, omit_pre=13, offset=c4_model == 'offset')
+        else:
+            start_4 = p0_4
+
         fit2 = correlators.fit.cosh_fit_decorator(T)
         p2 = correlators.fit.fit(fit2, time, c2_val, c2_err,
-                                 omit_pre=13, p0=[0.222, c2_val[0]])
-        fit4 = correlators.fit.cosh_fit_offset_decorator(T)
-        p4 = correlators.fit.fit(fit4, time, c4_val,
-                                 c4_err, omit_pre=13, p0=[0.45, c2_val[0], 0])
+                                 omit_pre=13, p0=start_2)
+        fit4, transform4 = four_point_model(T, c4_model)
+        if c4_model == 'offset':
+            used_c4_val, used_c4_err = c4_val, c4_err
+        else:
+            sets4 = transform4([c4 for c2, c4 in sets])
+            used_c4_val = np.mean(sets4, axis=0)
+            used_c4_err = np.std(sets4, axis=0)
+        p4 = correlators.fit.fit(fit4, time[:len(used_c4_val)], used_c4_val,
+                                 used_c4_err, omit_pre=13, p0=start_4)
 
         m2 = p2[0]
         m4 = p4[0]
@@ -213,18 +661,300 @@ def mass_difference_decorator(T, L, fig=None):
         amp2 = p2[1]
         amp4 = p4[1]
 
-        offset = p4[2]
+        offset = four_point_offset(c4_val, T, p4)
 
         delta_m = m4 - 2 * m2
 
-        a0 = correlators.scatlen.compute_a0(m2, m4, L, fig)
+        a0 = correlators.scatlen.compute_a0(m2, m4, L, fig, formula=formula)
 
         return m2, m4, delta_m, a0, amp2, amp4, offset, a0*m2, m2**2
 
     return mass_difference
 
 
-def mass_difference_correlated_decorator(T, L, p0_2, p0_4, fig=None):
+def weighted_plateau(m_eff, weights):
+    '''
+    Averages the effective mass over the time with the given weights.
+
+    Time slices without an effective mass are left out. If none is left, the
+    result is NaN.
+
+    :param np.array m_eff: Effective masses with the time as the last axis
+    :param np.array weights: Weight of each time slice
+    '''
+    used = np.where(np.isfinite(m_eff), weights, 0)
+    with np.errstate(all='ignore'):
+        return np.nansum(m_eff * used, axis=-1) / np.sum(used, axis=-1)
+
+
+def ratio_bootstrap(combined, T, L, indices, formula='expansion'):
+    r'''
+    Determines the energy shift with the ratio method.
+
+    The averages of all bootstrap replicas are computed at once. For each
+    replica the mass is the plateau of the periodic effective mass of the
+    two-point function, weighted with the inverse variance of each time slice,
+    see :func:`weighted_plateau`. The ratio from
+    :func:`correlators.transform.ratio_periodic` is then fitted with
+    :func:`correlators.fit.ratio_fit_decorator`, which is a single fit with
+    :math:`\Delta E` as a parameter. All replicas are started from the fit to
+    the full ensemble. Replicas without any effective mass in the window have
+    failed, their results are NaN.
+
+    :param np.array indices: Replicas from
+        :func:`correlators.bootstrap.generate_indices`
+    :returns: Mass, :math:`\Delta E`, :math:`a_0`, the amplitude of the ratio
+        and :math:`a_0 m_2` for each replica
+    :rtype: np.array
+    '''
+    sets2, sets4 = zip(*combined)
+    stack = np.array([sets2, sets4]).transpose(1, 0, 2)
+
+    start = time.time()
+
+    averages = np.mean(stack[indices], axis=1)
+    c2, c4 = averages[:, 0], averages[:, 1]
+
+    # Plateau of the effective mass, weighted with the inverse variance. Time
+    # slices where the correlator does not fall have no effective mass, the
+    # variance is taken over the replicas that have one.
+    m_eff = correlators.transform.effective_mass_periodic(c2, T)[:, 13:]
+    counts = np.sum(np.isfinite(m_eff), axis=0)
+    weights = np.zeros(m_eff.shape[1])
+    weights[counts > 1] = 1 / np.nanvar(m_eff[:, counts > 1], axis=0)
+    m2 = weighted_plateau(m_eff, weights)
+
+    ratios = correlators.transform.ratio_periodic(c2, c4)
+    ratio_err = np.std(ratios, axis=0)
+    times = np.arange(ratios.shape[1])
+
+    # Fit to the full ensemble.
+    c2_val = np.mean(sets2, axis=0)
+    c4_val = np.mean(sets4, axis=0)
+    m2_val = weighted_plateau(correlators.transform.effective_mass_periodic(
+        c2_val, T)[13:], weights)
+    ratio_val = correlators.transform.ratio_periodic(c2_val, c4_val)
+    p0 = [np.median(ratio_val[13:]),
+          np.median(np.log(ratio_val[13:-1] / ratio_val[14:]))]
+    p0 = correlators.fit.fit(correlators.fit.ratio_fit_decorator(T, m2_val),
+                             times, ratio_val, ratio_err, omit_pre=13, p0=p0)
+
+    params = np.array([
+        correlators.fit.fit(correlators.fit.ratio_fit_decorator(T, m),
+                            times, ratio, ratio_err, omit_pre=13, p0=p0)
+        if np.isfinite(m) else [np.nan, np.nan]
+        for m, ratio in zip(m2, ratios)
+    ])
+    amp, delta_e = params[:, 0], params[:, 1]
+
+    a0 = correlators.scatlen.compute_a0(m2, 2 * m2 + delta_e, L,
+                                        formula=formula)
+
+    LOGGER.info('Ratio method took %.2f s.', time.time() - start)
+
+    return np.column_stack([m2, delta_e, a0, amp, a0 * m2])
+
+
+def excited_states_bootstrap(combined, T, L, indices, states=2, omit_pre=5,
+                             formula='expansion'):
+    r'''
+    Determines the energy shift with multi-state fits from an earlier time.
+
+    Both correlators are fitted with
+    :func:`correlators.fit.multi_cosh_fit_decorator`, the four-point function
+    with an offset. The excited states describe the early time slices, so the
+    fit window can start at a smaller ``omit_pre``. The averages of all
+    bootstrap replicas are fitted at once with
+    :func:`correlators.fit.fit_batch`, weighted with the bootstrap errors and
+    started from the fit to the full ensemble. Replicas where a fit fails are
+    NaN.
+
+    :param np.array indices: Replicas from
+        :func:`correlators.bootstrap.generate_indices`
+    :param int states: Number of states in the models
+    :param int omit_pre: First time slice in the fit window
+    :returns: Masses, :math:`\Delta E`, :math:`a_0`, the ground state
+        amplitudes, the offset, :math:`a_0 m_2` and the two :math:`\chi^2` for
+        each replica
+    :rtype: np.array
+    '''
+    sets2, sets4 = zip(*combined)
+    stack = np.array([sets2, sets4]).transpose(1, 0, 2)
+
+    start = time.time()
+
+    averages = np.mean(stack[indices], axis=1)
+    time_slices = np.arange(stack.shape[2])
+
+    fits = []
+    for index, offset in [(0, False), (1, True)]:
+        model = correlators.fit.multi_cosh_fit_decorator(T, states, offset)
+        replicas = averages[:, index]
+        val = np.mean(stack[:, index], axis=0)
+        err = np.std(replicas, axis=0)
+        p0 = correlators.fit.guess_multi_cosh_parameters(
+            val, T, states, omit_pre=omit_pre, offset=offset)
+        p0 = correlators.fit.fit_batch(model, time_slices, val, err,
+                                       omit_pre=omit_pre, p0=p0)[0][0]
+        fits.append(correlators.fit.fit_batch(model, time_slices, replicas,
+                                              err, omit_pre=omit_pre, p0=p0))
+
+    (p2, chi_sq_2), (p4, chi_sq_4) = fits
+    m2, amp2 = p2[:, 0], p2[:, 1]
+    m4, amp4, offset = p4[:, 0], p4[:, 1], p4[:, -1]
+
+    a0 = correlators.scatlen.compute_a0(m2, m4, L, formula=formula)
+
+    LOGGER.info('Multi-state fits took %.2f s.', time.time() - start)
+
+    return np.column_stack([m2, m4, m4 - 2 * m2, a0, amp2, amp4, offset,
+                            a0 * m2, chi_sq_2, chi_sq_4])
+
+
+def correlated_bootstrap(combined, T, L, p0_2, p0_4, covariance='replica',
+                         indices=None, formula='expansion', c4_model='offset'):
+    '''
+    Bootstraps the correlated fits with the given covariance mode.
+
+    In the ``fixed`` mode the correlation matrices of both correlators are
+    computed and inverted once on the original ensemble. In the ``replica``
+    mode the correlation matrices of all replicas are computed at once from
+    the counts of the configurations, see
+    :func:`correlators.corrfit.replica_inverse_correlation_matrices`.
+    Replicas with a singular matrix have failed, their results are NaN. The
+    time spent is logged such that the modes can be compared.
+
+    :param np.array indices: Replicas from
+        :func:`correlators.bootstrap.generate_indices`
+    :returns: Results of each replica
+    :rtype: np.array
+    '''
+    if covariance not in ('fixed', 'replica'):
+        raise ValueError('Unknown covariance mode `{}`.'.format(covariance))
+
+    sets2, sets4 = zip(*combined)
+    fit4, transform4 = four_point_model(T, c4_model)
+
+    start = time.time()
+    if covariance == 'fixed':
+        inv_cm_2 = correlators.corrfit.inverse_correlation_matrix(
+            sets2, omit_pre=13)
+        inv_cm_4 = correlators.corrfit.inverse_correlation_matrix(
+            transform4(sets4), omit_pre=13)
+        replicas = correlators.bootstrap.transform_replicas(
+            mass_difference_correlated_decorator(T, L, p0_2, p0_4,
+                                                 inv_cm_2=inv_cm_2,
+                                                 inv_cm_4=inv_cm_4,
+                                                 formula=formula,
+                                                 c4_model=c4_model),
+            combined,
+            indices,
+        )
+    else:
+        counts = correlators.bootstrap.indices_to_counts(indices,
+                                                         len(combined))
+        inv_cms_2 = correlators.corrfit.replica_inverse_correlation_matrices(
+            sets2, counts, omit_pre=13)
+        inv_cms_4 = correlators.corrfit.replica_inverse_correlation_matrices(
+            transform4(sets4), counts, omit_pre=13)
+        replicas = []
+        for row, inv_cm_2, inv_cm_4 in zip(indices, inv_cms_2, inv_cms_4):
+            if inv_cm_2 is None or inv_cm_4 is None:
+                replicas.append((np.nan,) * len(COLUMNS['corr']))
+                continue
+            transform = mass_difference_correlated_decorator(
+                T, L, p0_2, p0_4, inv_cm_2=inv_cm_2, inv_cm_4=inv_cm_4,
+                formula=formula, c4_model=c4_model)
+            replicas.append(transform([combined[i] for i in row]))
+        replicas = np.array(replicas)
+    LOGGER.info('Correlated bootstrap with %s covariance took %.2f s.',
+                covariance, time.time() - start)
+
+    return replicas
+
+
+def joint_bootstrap(combined, T, L, p0, covariance='replica', indices=None,
+                    formula='expansion'):
+    '''
+    Bootstraps the simultaneous correlated fit of both correlators.
+
+    The covariance modes are the same as in :func:`correlated_bootstrap`.
+
+    :returns: Results of each replica
+    :rtype: np.array
+    '''
+    if covariance == 'fixed':
+        sets2, sets4 = zip(*combined)
+        inv_cm = correlators.corrfit.joint_inverse_correlation_matrix(
+            [sets2, sets4], omit_pre=13)
+    elif covariance == 'replica':
+        inv_cm = None
+    else:
+        raise ValueError('Unknown covariance mode `{}`.'.format(covariance))
+
+    start = time.time()
+    replicas = correlators.bootstrap.transform_replicas(
+        mass_difference_joint_decorator(T, L, p0, inv_cm=inv_cm,
+                                        formula=formula),
+        combined,
+        indices,
+    )
+    LOGGER.info('Joint bootstrap with %s covariance took %.2f s.',
+                covariance, time.time() - start)
+
+    return replicas
+
+
+def mass_difference_joint_decorator(T, L, p0, fig=None, inv_cm=None,
+                                    formula='expansion'):
+    r'''
+    Creates the transform for the simultaneous fit of both correlators.
+
+    The energy shift :math:`\Delta E` is a parameter of the fit, the mass of
+    the four-point function follows from it. Replicas whose correlation matrix
+    cannot be inverted give NaN, like in
+    :func:`mass_difference_correlated_decorator`.
+    '''
+    def mass_difference_joint(sets):
+        sets2, sets4 = zip(*sets)
+
+        sets2 = np.array(sets2)
+        sets4 = np.array(sets4)
+
+        # Generate a single time, they are all the same.
+        time = np.array(range(len(sets2[0])))
+
+        split = len(time) - 13
+        fit = correlators.fit.joint_cosh_fit_decorator(T, split)
+        try:
+            p, chi_sq, p_value = correlators.corrfit.fit_joint(
+                fit, time, [sets2, sets4], omit_pre=13, p0=p0, inv_cm=inv_cm)
+        except np.linalg.LinAlgError:
+            return (np.nan,) * len(COLUMNS['joint'])
+
+        m2, amp2, delta_m, amp4, offset = p
+        m4 = 2 * m2 + delta_m
+
+        a0 = correlators.scatlen.compute_a0(m2, m4, L, fig, formula=formula)
+
+        return m2, m4, delta_m, a0, amp2, amp4, offset, a0*m2, m2**2, \
+                chi_sq, p_value
+
+    return mass_difference_joint
+
+
+def mass_difference_correlated_decorator(T, L, p0_2, p0_4, fig=None,
+                                         inv_cm_2=None, inv_cm_4=None,
+                                         formula='expansion',
+                                         c4_model='offset'):
+    '''
+    Creates the transform for the correlated fits.
+
+    The inverse correlation matrices are optional. If they are given, they are
+    used for every replica instead of recomputing them from the sample. If the
+    correlation matrix of a replica cannot be inverted, all its results are
+    NaN.
+    '''
     def mass_difference_correlated(sets):
         sets2, sets4 = zip(*sets)
 
@@ -234,14 +964,19 @@ def mass_difference_correlated_decorator(T, L, p0_2, p0_4, fig=None):
         # Generate a single time, they are all the same.
         time = np.array(range(len(sets2[0])))
 
-        # Perform the fits.
+        # Perform the fits. Without a given inverse the correlation matrix of
+        # the replica may be singular, the replica then counts as failed.
         fit2 = correlators.fit.cosh_fit_decorator(T)
-        p2, chi_sq_2, p_value_2 = correlators.corrfit.fit(
-            fit2, time, sets2, omit_pre=13, p0=p0_2)
-        fit4 = correlators.fit.cosh_fit_offset_decorator(T)
-        p4, chi_sq_4, p_value_4 = correlators.corrfit.fit(
-            fit4, time, sets4, omit_pre=13, p0=p0_4)
-
+        fit4, transform4 = four_point_model(T, c4_model)
+        used_sets4 = transform4(sets4)
+        try:
+            p2, chi_sq_2, p_value_2 = correlators.corrfit.fit(
+                fit2, time, sets2, omit_pre=13, p0=p0_2, inv_cm=inv_cm_2)
+            p4, chi_sq_4, p_value_4 = correlators.corrfit.fit(
+                fit4, time[:used_sets4.shape[1]], used_sets4, omit_pre=13,
+                p0=p0_4, inv_cm=inv_cm_4)
+        except np.linalg.LinAlgError:
+            return (np.nan,) * len(COLUMNS['corr'])
 
         m2 = p2[0]
         m4 = p4[0]
@@ -249,11 +984,11 @@ def mass_difference_correlated_decorator(T, L, p0_2, p0_4, fig=None):
         amp2 = p2[1]
         amp4 = p4[1]
 
-        offset = p4[2]
+        offset = four_point_offset(np.mean(sets4, axis=0), T, p4)
 
         delta_m = m4 - 2 * m2
 
-        a0 = correlators.scatlen.compute_a0(m2, m4, L, fig)
+        a0 = correlators.scatlen.compute_a0(m2, m4, L, fig, formula=formula)
 
         return m2, m4, delta_m, a0, amp2, amp4, offset, a0*m2, m2**2, \
                 chi_sq_2, chi_sq_4, p_value_2, p_value_4
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+r'''
+Autocorrelation analysis with the Gamma method.
+
+The measurements :math:`a_i` are assumed to be ordered like the Monte Carlo
+chain, which is the order of the ``confNNNN`` numbers that
+:func:`correlators.loader.folder_loader` keeps. The autocorrelation function
+
+.. math::
+
+    \Gamma(w) = \frac{1}{N - w} \sum_{i=1}^{N-w} [a_i - \bar a]
+    [a_{i+w} - \bar a]
+
+is computed with a zero padded FFT for all observables at once. The
+integrated autocorrelation time
+
+.. math::
+
+    \tau_\text{int}(W) = \frac12 + \sum_{w=1}^W \frac{\Gamma(w)}{\Gamma(0)}
+
+is summed up to the window :math:`W` chosen with the automatic procedure of
+U. Wolff, Comput. Phys. Commun. 156 (2004) 143. The variance of the mean is
+larger by :math:`2 \tau_\text{int}` than for independent measurements.
+'''
+
+from __future__ import division, absolute_import, print_function, \
+    unicode_literals
+
+import math
+
+import numpy as np
+
+
+def autocorrelation_function(series):
+    '''
+    Computes the autocorrelation function of all observables at once.
+
+    :param np.array series: Measurements, the first axis is the Monte Carlo
+        time, further axes are observables like the time slices
+    :returns: :math:`\\Gamma(w)` for :math:`w = 0, \\ldots, N-1` with the same
+        shape as ``series``
+    :rtype: np.array
+    '''
+    series = np.real(np.asarray(series, dtype=float))
+    n = series.shape[0]
+    deviation = series - np.mean(series, axis=0)
+
+    # Padding to 2 N avoids the wrap around of the cyclic correlation.
+    transformed = np.fft.rfft(deviation, n=2 * n, axis=0)
+    correlation = np.fft.irfft(np.abs(transformed)**2, n=2 * n, axis=0)[:n]
+
+    normalization = (n - np.arange(n)).reshape((n,) + (1,) * (series.ndim - 1))
+    return correlation / normalization
+
+
+def integrated_autocorrelation_time(series, s=1.5):
+    r'''
+    Computes the integrated autocorrelation time with automatic windowing.
+
+    The window :math:`W` is the first one where
+
+    .. math::
+
+        g(W) = e^{-W/\tau(W)} - \frac{\tau(W)}{\sqrt{WN}} \,, \qquad
+        \tau(W) = \frac{s}{\ln\left(\frac{2\tau_\text{int}(W) + 1}
+        {2\tau_\text{int}(W) - 1}\right)}
+
+    becomes negative. The result is corrected for the bias of the window.
+
+    :param np.array series: Measurements, the first axis is the Monte Carlo
+        time
+    :param float s: Ratio :math:`S = \tau / \tau_\text{int}` that is assumed
+        for the slowest mode
+    :returns: Integrated autocorrelation time, its error and the window for
+        each observable
+    :rtype: tuple(np.array, np.array, np.array)
+    '''
+    gamma = autocorrelation_function(series)
+    n = gamma.shape[0]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rho = gamma / gamma[0]
+        tau_int = 0.5 + np.cumsum(rho[1:], axis=0)
+        w = np.arange(1, n).reshape((n - 1,) + (1,) * (gamma.ndim - 1))
+        tau = np.where(tau_int > 0.5,
+                       s / np.log((2 * tau_int + 1) / (2 * tau_int - 1)),
+                       1e-8)
+        g = np.exp(-w / tau) - tau / np.sqrt(w * n)
+
+    negative = g < 0
+    window = np.where(np.any(negative, axis=0),
+                      np.argmax(negative, axis=0) + 1, n - 1)
+
+    flat = tau_int.reshape(n - 1, -1)
+    tau_window = flat[np.ravel(window) - 1, np.arange(flat.shape[1])]
+    tau_window = tau_window.reshape(np.shape(window)) \
+        * (1 + (2 * window + 1) / n)
+    tau_err = tau_window * np.sqrt(np.maximum(4 / n * (window + 0.5
+                                                       - tau_window), 0))
+
+    return tau_window, tau_err, window
+
+
+def derived_series(series, function, epsilon=1e-6):
+    r'''
+    Projects the measurements onto a derived observable.
+
+    For an observable :math:`F(\bar a)` the Gamma method uses the linearized
+    fluctuations
+
+    .. math::
+
+        F_i = F(\bar a) + \sum_\alpha \frac{\partial F}{\partial \bar a_\alpha}
+        [a_{i\alpha} - \bar a_\alpha] \,,
+
+    whose autocorrelation is the one of :math:`F`. The derivatives are
+    computed with central differences.
+
+    :param np.array series: Measurements with shape ``(N, k)``
+    :param function: Function from the averaged observables to a scalar or
+        one dimensional array, like
+        :func:`correlators.transform.effective_mass_cosh_block`
+    :param float epsilon: Relative step for the derivatives
+    :returns: Projected measurements with shape ``(N,)`` or ``(N, m)``
+    :rtype: np.array
+    '''
+    series = np.real(np.asarray(series, dtype=float))
+    mean = np.mean(series, axis=0)
+    central = np.asarray(function(mean), dtype=float)
+
+    columns = []
+    for alpha in range(len(mean)):
+        step = epsilon * max(abs(mean[alpha]), 1e-300)
+        up = mean.copy()
+        down = mean.copy()
+        up[alpha] += step
+        down[alpha] -= step
+        columns.append((np.asarray(function(up)) - np.asarray(function(down)))
+                       / (2 * step))
+    gradient = np.array(columns)
+
+    return central + np.dot(series - mean, gradient)
+
+
+def recommended_block_size(tau_int, factor=2):
+    r'''
+    Recommends a block size for binning or block resampling.
+
+    Blocks of :math:`b \geq 2 \tau_\text{int}` consecutive configurations are
+    approximately independent. The largest time of all observables is used.
+
+    :param np.array tau_int: Integrated autocorrelation times
+    :param float factor: Block size in units of :math:`\tau_\text{int}`
+    :returns: Block size
+    :rtype: int
+    '''
+    tau_max = np.nanmax(np.asarray(tau_int, dtype=float))
+    if not np.isfinite(tau_max):
+        return 1
+    return max(1, int(math.ceil(factor * tau_max)))
@@ -35,7 +35,55 @@ def average_and_std_arrays(arrays):
     return val, err
 
 
-def bootstrap_pre_transform(transform, sets, sample_count=250, seed=None):
+def average_and_std_jackknife(arrays):
+    r'''
+    Computes the value and the jackknife error from leave-one-out results.
+
+    With :math:`N` results :math:`\theta_k` the error is given by
+
+    .. math::
+
+        \sigma^2 = \frac{N-1}{N} \sum_{k=1}^N [\theta_k - \bar\theta]^2 \,.
+    '''
+    total = np.column_stack(arrays)
+    N = total.shape[1]
+
+    val = np.real(np.mean(total, axis=1))
+    err = np.real(np.sqrt(N - 1) * np.std(total, axis=1))
+
+    return val, err
+
+
+def block(sets, block_size):
+    '''
+    Averages blocks of consecutive sets.
+
+    Resampling the block averages instead of the sets keeps the
+    autocorrelation within the blocks, see
+    :func:`correlators.autocorrelation.recommended_block_size`. Incomplete
+    blocks at the end are dropped.
+
+    :param list sets: Measurements in Monte Carlo order
+    :param int block_size: Number of consecutive sets in each block
+    :returns: Block averages
+    :rtype: list
+    '''
+    if block_size == 1:
+        return sets
+
+    stack = np.real(np.asarray(sets))
+    n_blocks = len(stack) // block_size
+    if n_blocks < 2:
+        raise ValueError('Block size {} leaves less than two blocks of {} '
+                         'sets.'.format(block_size, len(stack)))
+
+    stack = stack[:n_blocks * block_size]
+    blocks = stack.reshape((n_blocks, block_size) + stack.shape[1:])
+    return list(np.mean(blocks, axis=1))
+
+
+def bootstrap_pre_transform(transform, sets, sample_count=250, seed=None,
+                            block_size=1):
     '''
     Bootstraps the sets and transforms them.
 
@@ -44,20 +92,66 @@ def bootstrap_pre_transform(transform, sets, sample_count=250, seed=None):
     The return value of the function is assumed to be a one dimensional NumPy
     array. The return value of this function is one array with the values and
     another with the errors.
-    '''
-    random.seed(seed)
 
-    results = []
-    for sample_id in xrange(sample_count):
-        sample = generate_sample(sets)
-        transformed = transform(sample)
-        results.append(transformed)
+    :param int block_size: Resample averages of this many consecutive sets,
+        see :func:`block`
+    '''
+    sets = block(sets, block_size)
+    indices = generate_indices(len(sets), sample_count, seed)
+    results = transform_replicas(transform, sets, indices)
 
     val, err = average_and_std_arrays(results)
 
     return val, err
 
 
+def generate_indices(n, sample_count=250, seed=None):
+    '''
+    Draws the bootstrap replicas as indices of the original elements.
+
+    The replicas are the same as the ones from :func:`generate_sample` after
+    seeding the random generator with the same seed.
+
+    :param int n: Number of elements
+    :returns: Indices with shape ``(sample_count, n)``
+    :rtype: np.array
+    '''
+    random.seed(seed)
+    return np.array([[random.randrange(n) for i in range(n)]
+                     for sample_id in range(sample_count)], dtype=int)
+
+
+def transform_replicas(transform, sets, indices):
+    '''
+    Applies the transform to every replica.
+
+    :param indices: Replicas from :func:`generate_indices`
+    :returns: Results with one row per replica
+    :rtype: np.array
+    '''
+    return np.array([transform([sets[i] for i in row]) for row in indices])
+
+
+def bootstrap_averages(sets, sample_count=250, seed=None, block_size=1):
+    '''
+    Computes the averages of all bootstrap replicas at once.
+
+    The replicas are drawn as counts with :func:`generate_counts`. The averages
+    then follow from a single matrix multiplication with the stacked sets.
+
+    :param list sets: Measurements, the first index labels the configuration
+    :param int block_size: Resample averages of this many consecutive sets,
+        see :func:`block`
+    :returns: Averages with one row per replica
+    :rtype: np.array
+    '''
+    stack = np.real(np.asarray(block(sets, block_size)))
+    n = len(stack)
+    counts = generate_counts(n, sample_count, seed)
+    averages = np.dot(counts, stack.reshape(n, -1)) / n
+    return averages.reshape((sample_count,) + stack.shape[1:])
+
+
 def generate_sample(elements):
     '''
     Generates a sample from the given list.
@@ -66,12 +160,50 @@ def generate_sample(elements):
     of elements given.
     '''
     result = []
-    for i in xrange(len(elements)):
+    for i in range(len(elements)):
         result.append(random.choice(elements))
 
     return result
 
 
+def generate_counts(n, sample_count=250, seed=None):
+    '''
+    Generates bootstrap replicas as counts of the original elements.
+
+    Each row corresponds to one replica and contains how often each of the
+    ``n`` elements has been drawn. The rows sum up to ``n``. This can be used
+    with :func:`correlators.corrfit.weighted_correlation_matrix` without
+    materializing the resampled lists.
+
+    :param int n: Number of elements
+    :param int sample_count: Number of replicas
+    :param seed: Seed for the random generator
+    :returns: Counts with shape ``(sample_count, n)``
+    :rtype: np.array
+    '''
+    rng = np.random.RandomState(seed)
+    draws = rng.randint(0, n, size=(sample_count, n))
+    return indices_to_counts(draws, n)
+
+
+def indices_to_counts(indices, n):
+    '''
+    Converts replicas given as indices into counts of the original elements.
+
+    :param np.array indices: Replicas from :func:`generate_indices`
+    :param int n: Number of elements
+    :returns: Counts with one row per replica, see :func:`generate_counts`
+    :rtype: np.array
+    '''
+    indices = np.asarray(indices)
+    sample_count = len(indices)
+    offsets = n * np.arange(sample_count)[:, np.newaxis]
+    counts = np.bincount((indices + offsets).ravel(),
+                         minlength=sample_count * n)
+
+    return counts.reshape(sample_count, n)
+
+
 def average_combined_array(combined):
     '''
     Given a list of tuples or arrays of the kind “configuration → n-point →
@@ -0,0 +1,265 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+'''
+Content addressed cache for fit results on disk.
+
+The key of a fit is a hash of the input arrays, the identity of the model
+function including the values it closes over (like :math:`T`), the fit window
+and the initial parameters. The source code of the fitting modules and the
+selected backend of :mod:`correlators.kernels` are part of the key as well,
+so changes to the models or the solvers do not return old results. Each
+result is stored in its own file. When the
+total size exceeds the limit, the least recently used files are deleted.
+
+The cache is disabled until :func:`configure` is called.
+'''
+
+from __future__ import division, absolute_import, print_function, \
+    unicode_literals
+
+import errno
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+import correlators.kernels
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'mu-correlators')
+'Default location for all the caches of this program.'
+
+FIT_MODULES = ['fit.py', 'corrfit.py', 'kernels.py']
+'Source files of this package whose code determines the fit results.'
+
+_directory = None
+_max_bytes = None
+_size = None
+_code_digest = None
+
+
+def configure(directory, max_bytes=500 * 1024**2):
+    '''
+    Enables the fit cache.
+
+    :param str directory: Directory for the cache files, ``None`` disables the
+        cache
+    :param int max_bytes: Size limit of the cache files
+    '''
+    global _directory, _max_bytes, _size
+
+    if directory is not None:
+        _makedirs(directory)
+
+    _directory = directory
+    _max_bytes = max_bytes
+    _size = None
+
+
+def is_enabled():
+    return _directory is not None
+
+
+def get_configuration():
+    '''
+    Returns the arguments of the last call of :func:`configure`.
+
+    :returns: Directory, ``None`` if the cache is disabled, and size limit
+    :rtype: tuple
+    '''
+    return _directory, _max_bytes
+
+
+def _makedirs(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def code_digest():
+    '''
+    Hashes the source files in :data:`FIT_MODULES` once per process.
+    '''
+    global _code_digest
+
+    if _code_digest is None:
+        sha = hashlib.sha1()
+        package = os.path.dirname(os.path.abspath(__file__))
+        for filename in FIT_MODULES:
+            with open(os.path.join(package, filename), 'rb') as f:
+                sha.update(f.read())
+        _code_digest = sha.hexdigest()
+
+    return _code_digest
+
+
+def _model_identity(func):
+    '''
+    Describes a model function including the values it closes over.
+
+    The functions generated by :func:`correlators.fit.cosh_fit_decorator` and
+    similar all have the same name, they only differ in the captured
+    :math:`T`. Therefore the closure is part of the identity. Functions in the
+    closure are described recursively.
+    '''
+    parts = [getattr(func, '__module__', ''), getattr(func, '__name__', '')]
+
+    closure = getattr(func, '__closure__', None) or []
+    for cell in closure:
+        content = cell.cell_contents
+        if callable(content):
+            parts.append(_model_identity(content))
+        else:
+            parts.append(repr(content))
+
+    return '(' + ', '.join(parts) + ')'
+
+
+def _update_hash(sha, value):
+    if value is None:
+        sha.update(b'None')
+    elif isinstance(value, (list, tuple)) and \
+            not all(np.isscalar(element) for element in value):
+        sha.update(b'[')
+        for element in value:
+            _update_hash(sha, element)
+        sha.update(b']')
+    else:
+        array = np.ascontiguousarray(value)
+        sha.update(repr((array.dtype.str, array.shape)).encode())
+        sha.update(array.tobytes())
+
+
+def key(kind, func, arrays, parameters):
+    '''
+    Computes the key of a fit.
+
+    :param str kind: Kind of fit, for instance the function doing it
+    :param func: Model function
+    :param list arrays: Input data, each may be an array or ``None``
+    :param list parameters: Further parameters like fit window and initial
+        parameters
+    :returns: Hexadecimal hash
+    :rtype: str
+    '''
+    sha = hashlib.sha1()
+    sha.update(kind.encode())
+    sha.update(code_digest().encode())
+    sha.update(correlators.kernels.get_backend().encode())
+    sha.update(_model_identity(func).encode())
+    for parameter in parameters:
+        _update_hash(sha, parameter)
+    for array in arrays:
+        _update_hash(sha, array)
+    return sha.hexdigest()
+
+
+def _entries():
+    entries = []
+    for filename in os.listdir(_directory):
+        if not filename.endswith('.pickle'):
+            continue
+        path = os.path.join(_directory, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def _evict():
+    '''
+    Deletes the least recently used entries until the cache fits in 90 % of
+    the limit.
+    '''
+    global _size
+
+    entries = sorted(_entries())
+    _size = sum(size for mtime, size, path in entries)
+
+    for mtime, size, path in entries:
+        if _size <= 0.9 * _max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        _size -= size
+
+
+def get(digest):
+    '''
+    Retrieves an entry and marks it as recently used.
+
+    :returns: Stored value or ``None`` if there is none
+    '''
+    path = os.path.join(_directory, digest + '.pickle')
+    try:
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+    return value
+
+
+def put(digest, value):
+    '''
+    Stores an entry.
+
+    The file is written under a temporary name and then renamed such that
+    concurrent readers never see partial files.
+    '''
+    global _size
+
+    if _size is None:
+        _evict()
+
+    handle, temp = tempfile.mkstemp(dir=_directory, suffix='.tmp')
+    with os.fdopen(handle, 'wb') as f:
+        pickle.dump(value, f, protocol=2)
+    size = os.path.getsize(temp)
+    os.rename(temp, os.path.join(_directory, digest + '.pickle'))
+
+    _size += size
+    if _size > _max_bytes:
+        _evict()
+
+
+def memoize(kind, compute, func, arrays, parameters):
+    '''
+    Returns the cached result of a fit or computes and stores it.
+
+    If the cache is disabled, ``compute`` is just called.
+
+    :param compute: Function without arguments that performs the fit
+    '''
+    if _directory is None:
+        return compute()
+
+    digest = key(kind, func, arrays, parameters)
+
+    value = get(digest)
+    if value is None:
+        value = compute()
+        put(digest, value)
+
+    return value
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+'''
+Checkpoints of the results of each folder.
+
+The results of a folder are stored as soon as its analysis has finished. The
+key contains the manifest of the folder, that is name, size and modification
+time of each file, the analysis options and the source code of this package.
+A rerun therefore only analyzes the folders that have failed or whose data,
+options or code has changed. The options in :data:`IGNORED_OPTIONS` do not
+change the results and are not part of the key.
+'''
+
+from __future__ import division, absolute_import, print_function, \
+    unicode_literals
+
+import hashlib
+import logging
+import os
+import pickle
+import socket
+import tempfile
+import time
+
+import correlators.cache
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = os.path.join(correlators.cache.DEFAULT_DIRECTORY,
+                                 'checkpoints')
+'Default location of the checkpoints.'
+
+IGNORED_OPTIONS = ['artifact_dir', 'invalidate', 'plot_dir']
+'Analysis options that only control how the results are obtained or saved.'
+
+_code_digest = None
+
+
+def manifest(root):
+    '''
+    Lists name, size and modification time of all files in the folder.
+
+    :rtype: list
+    '''
+    entries = []
+    for filename in sorted(os.listdir(root)):
+        stat = os.stat(os.path.join(root, filename))
+        entries.append((filename, stat.st_size, int(stat.st_mtime * 1e6)))
+    return entries
+
+
+def code_digest():
+    '''
+    Hashes the source files of this package once per process.
+    '''
+    global _code_digest
+
+    if _code_digest is None:
+        sha = hashlib.sha1()
+        package = os.path.dirname(os.path.abspath(__file__))
+        for filename in sorted(os.listdir(package)):
+            if filename.endswith('.py'):
+                with open(os.path.join(package, filename), 'rb') as f:
+                    sha.update(f.read())
+        _code_digest = sha.hexdigest()
+
+    return _code_digest
+
+
+def key(root, analysis_options):
+    '''
+    Computes the key of the checkpoint of a folder.
+
+    :param str root: Folder with the data
+    :param dict analysis_options: Options for
+        :func:`correlators.analysis.handle_path`
+    :returns: Hexadecimal hash
+    :rtype: str
+    '''
+    sha = hashlib.sha1()
+    sha.update(os.path.abspath(root).encode())
+    sha.update(repr(manifest(root)).encode())
+    sha.update(repr(sorted(
+        (name, value) for name, value in analysis_options.items()
+        if name not in IGNORED_OPTIONS)).encode())
+    sha.update(code_digest().encode())
+    return sha.hexdigest()
+
+
+def exists(directory, digest):
+    '''
+    Tells whether there is a checkpoint without loading it.
+    '''
+    return os.path.exists(os.path.join(directory, digest + '.pickle'))
+
+
+def load(directory, digest):
+    '''
+    Loads a checkpoint.
+
+    :returns: Ensemble, results and the data of the figures or ``None`` if
+        there is no checkpoint
+    '''
+    path = os.path.join(directory, digest + '.pickle')
+    try:
+        with open(path, 'rb') as f:
+            checkpoint = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+    return checkpoint['ensemble'], checkpoint['results'], \
+        checkpoint['figures']
+
+
+def store(directory, digest, root, ensemble, results, figures, metadata):
+    '''
+    Stores a checkpoint atomically.
+
+    :param dict figures: Data of the figures, such that they can be saved
+        again when the checkpoint is used
+    :param dict metadata: Further information like the options and the
+        duration, the host and the time are added
+    '''
+    correlators.cache._makedirs(directory)
+
+    checkpoint = {
+        'root': root,
+        'ensemble': ensemble,
+        'results': results,
+        'figures': figures,
+        'metadata': dict(metadata, host=socket.gethostname(),
+                         time=time.time()),
+    }
+
+    handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'wb') as f:
+        pickle.dump(checkpoint, f, protocol=2)
+    os.rename(temp, os.path.join(directory, digest + '.pickle'))
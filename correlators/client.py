@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+'''
+Command line client for :mod:`correlators.daemon`.
+
+This only imports the standard library, so it starts quickly::
+
+    python -m correlators --serve /tmp/correlators.sock &
+    python -m correlators.client /tmp/correlators.sock path/to/ensemble \\
+        --correlator c4 --offset --omit-pre 10
+'''
+
+from __future__ import division, absolute_import, print_function, \
+    unicode_literals
+
+import argparse
+import json
+import socket
+
+
+def request(socket_path, message):
+    '''
+    Sends one request to the daemon.
+
+    :param dict message: Command and its arguments, see
+        :func:`correlators.daemon.handle`
+    :returns: Result of the request
+    :raises RuntimeError: If the daemon reports an error
+    '''
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+        connection.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        stream = connection.makefile('rb')
+        answer = json.loads(stream.readline().decode('utf-8'))
+        stream.close()
+    finally:
+        connection.close()
+
+    if not answer['ok']:
+        raise RuntimeError(answer['error'])
+
+    return answer['result']
+
+
+def main():
+    options = _parse_args()
+
+    if options.status:
+        result = request(options.socket, {'command': 'status'})
+        for ensemble in result['ensembles']:
+            print('{:8.1f} MB  {} replica sets  {}'.format(
+                ensemble['bytes'] / 1024**2, ensemble['replicas'],
+                ensemble['path']))
+        print('{:8.1f} MB of {:.1f} MB'.format(result['bytes'] / 1024**2,
+                                                result['max_bytes'] / 1024**2))
+        return
+
+    if options.shutdown:
+        request(options.socket, {'command': 'shutdown'})
+        return
+
+    if options.path is None:
+        raise RuntimeError('A path is needed unless --status or --shutdown '
+                           'is given.')
+
+    result = request(options.socket, {
+        'command': 'analyze',
+        'path': options.path,
+        'correlator': options.correlator,
+        'states': options.states,
+        'offset': options.offset,
+        'omit_pre': options.omit_pre,
+        'omit_post': options.omit_post,
+        'sample_count': options.sample_count,
+        'seed': options.seed,
+        'block_size': options.block_size,
+        'covariance': options.covariance,
+    })
+
+    print('{} {}, seed {}'.format(result['ensemble'], options.correlator,
+                                  result['seed']))
+    for name, val, err in zip(result['names'], result['val'], result['err']):
+        print('{:8s} {:.6g} ± {:.2g}'.format(name, val, err))
+    print('{:8s} {:.4g}'.format('chi_sq', result['chi_sq']))
+    if result['failed'] > 0:
+        print('{} of {} replicas failed'.format(result['failed'],
+                                                options.sample_count))
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Sends an analysis request '
+                                     'to a running daemon.')
+    parser.add_argument('socket', help='Socket of the daemon.')
+    parser.add_argument('path', nargs='?', help='Folder of the ensemble.')
+    parser.add_argument('--correlator', choices=['c2', 'c4'], default='c2',
+                        help='Default: %(default)s')
+    parser.add_argument('--states', type=int, default=1, metavar='N',
+                        help='Number of states in the model. Default: '
+                        '%(default)s')
+    parser.add_argument('--offset', action='store_true',
+                        help='Add a constant offset to the model.')
+    parser.add_argument('--omit-pre', type=int, default=13, metavar='N',
+                        help='Time slices to omit at the beginning. Default: '
+                        '%(default)s')
+    parser.add_argument('--omit-post', type=int, default=0, metavar='N',
+                        help='Time slices to omit at the end. Default: '
+                        '%(default)s')
+    parser.add_argument('--sample-count', type=int, default=250, metavar='N',
+                        help='Number of bootstrap replicas. Default: '
+                        '%(default)s')
+    parser.add_argument('--seed', type=int,
+                        help='Seed for the bootstrap replicas, the replicas '
+                        'of each seed stay in memory.')
+    parser.add_argument('--block-size', type=int, default=1, metavar='N',
+                        help='Default: %(default)s')
+    parser.add_argument('--covariance', choices=['uncorrelated', 'fixed'],
+                        default='uncorrelated',
+                        help='Default: %(default)s')
+    parser.add_argument('--status', action='store_true',
+                        help='List the ensembles in memory.')
+    parser.add_argument('--shutdown', action='store_true',
+                        help='Stop the daemon.')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
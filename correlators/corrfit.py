@@ -11,12 +11,11 @@ Fitting correlated data with least squares.
 from __future__ import division, absolute_import, print_function, \
     unicode_literals
 
-import matplotlib.pyplot as pl
 import numpy as np
-import scipy.optimize as op
-import scipy.stats
 
+import correlators.cache
 import correlators.fit
+import correlators.kernels
 
 
 def correlation_matrix(sets):
@@ -96,6 +95,230 @@ def correlation_matrix(sets):
     return matrix, average
 
 
+def weighted_correlation_matrix(stack, weights):
+    r'''
+    Computes the correlation matrix of bootstrap replicas given as weights.
+
+    A bootstrap replica draws every configuration :math:`k` some number of
+    times :math:`w_k`. Instead of materializing the resampled list, the
+    replica is given as the vector of these counts over the original
+    measurements. With :math:`N = \sum_k w_k` the correlation matrix is
+
+    .. math::
+
+        C_{ij} = \frac{1}{N[N-1]} \sum_{k}
+        w_k [x_{ik} - \bar x_{iN}] [x_{jk} - \bar x_{jN}] \,,
+
+    which is the same as :func:`correlation_matrix` would give for the
+    resampled list.
+
+    The weights may also be a matrix with one replica per row. Then the
+    outer products of all measurements are formed once and the correlation
+    matrices of all replicas follow from a single matrix multiplication with
+    the weights.
+
+    :param np.array stack: Original measurements, the first index labels the
+        configuration, the second one the time
+    :param np.array weights: Counts of each configuration, either one vector
+        or one row per replica
+    :returns: Correlation matrix and average vector, with an additional
+        leading replica index if ``weights`` is a matrix
+    :rtype: tuple(np.array, np.array)
+    '''
+    stack = np.asarray(stack, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    single = weights.ndim == 1
+    weights = np.atleast_2d(weights)
+
+    n_conf, n_time = stack.shape
+    N = np.sum(weights, axis=1)
+
+    # The correlation matrix does not depend on a constant shift of the data.
+    # Centering with the full sample average avoids cancellations in the
+    # difference of second moment and squared average below.
+    center = np.mean(stack, axis=0)
+    centered = stack - center
+
+    average = np.dot(weights, centered) / N[:, np.newaxis]
+
+    outer = centered[:, :, np.newaxis] * centered[:, np.newaxis, :]
+    second = np.dot(weights, outer.reshape(n_conf, n_time**2))
+    second = second.reshape(-1, n_time, n_time)
+
+    matrix = second - N[:, np.newaxis, np.newaxis] \
+        * average[:, :, np.newaxis] * average[:, np.newaxis, :]
+    matrix /= (N * (N - 1))[:, np.newaxis, np.newaxis]
+
+    average += center
+
+    if single:
+        return matrix[0], average[0]
+    else:
+        return matrix, average
+
+
+def invert_correlation_matrix(matrix):
+    r'''
+    Inverts the correlation matrix using its Cholesky factorization.
+
+    The correlation matrix is symmetric and positive definite, so it can be
+    factorized as :math:`C = L L^\mathrm T`. The inverse is then obtained by
+    solving against the identity with that factor.
+
+    :param np.array matrix: Correlation matrix
+    :returns: Inverse correlation matrix
+    :rtype: np.matrix
+    :raises np.linalg.LinAlgError: If the matrix is not positive definite
+    '''
+    import scipy.linalg
+
+    factor = scipy.linalg.cho_factor(matrix)
+    identity = np.identity(len(matrix))
+    return np.asmatrix(scipy.linalg.cho_solve(factor, identity))
+
+
+def inverse_correlation_matrix(y, omit_pre=0, omit_post=0):
+    '''
+    Computes the inverse correlation matrix of the fit window only once.
+
+    This is meant for the fixed covariance mode where the correlation matrix is
+    estimated on the original ensemble and then used for every bootstrap
+    replica. The cut is the same as the one done in :func:`fit`, so the result
+    can be passed to it directly.
+
+    :param np.array y: All measurements of the time series
+    :param int omit_pre: Number of elements to omit at the beginning
+    :param int omit_post: Number of elements to omit at the end
+    :returns: Inverse correlation matrix of the fit window
+    :rtype: np.matrix
+    '''
+    y = np.array(y)
+    x = np.arange(y.shape[1])
+    used_x, used_y, used_yerr = correlators.fit._cut(x, y.T, None, omit_pre,
+                                                     omit_post)
+    cm, av = correlation_matrix(used_y.T)
+    return invert_correlation_matrix(cm)
+
+
+def replica_inverse_correlation_matrices(y, counts, omit_pre=0, omit_post=0):
+    '''
+    Computes the inverse correlation matrices of the fit window of replicas.
+
+    The correlation matrices of all replicas are computed at once with
+    :func:`weighted_correlation_matrix`, the resampled measurements are not
+    needed. The cut is the same as in :func:`inverse_correlation_matrix`.
+
+    :param np.array y: All measurements of the time series
+    :param np.array counts: Counts of each measurement, one row per replica,
+        see :func:`correlators.bootstrap.indices_to_counts`
+    :returns: Inverse correlation matrix of each replica, ``None`` where the
+        matrix is singular
+    :rtype: list
+    '''
+    y = np.array(y)
+    x = np.arange(y.shape[1])
+    used_x, used_y, used_yerr = correlators.fit._cut(x, y.T, None, omit_pre,
+                                                     omit_post)
+    matrices, averages = weighted_correlation_matrix(used_y.T, counts)
+
+    inverses = []
+    for matrix in matrices:
+        try:
+            inverses.append(invert_correlation_matrix(matrix))
+        except np.linalg.LinAlgError:
+            inverses.append(None)
+
+    return inverses
+
+
+def leave_one_out_inverse_correlation_matrices(sets):
+    r'''
+    Generates the inverse correlation matrices of all leave-one-out samples.
+
+    Leaving out the measurement :math:`x_k` changes the scatter matrix
+    :math:`S = \sum_l [x_l - \bar x] [x_l - \bar x]^\mathrm T` by a rank one
+    term only:
+
+    .. math::
+
+        S^{(k)} = S - \frac{N}{N-1} d_k d_k^\mathrm T \,,
+        \qquad d_k = x_k - \bar x \,.
+
+    The full scatter matrix is inverted once. The inverse for every
+    leave-one-out sample then follows from the Sherman-Morrison formula
+
+    .. math::
+
+        [S^{(k)}]^{-1} = S^{-1}
+        + \frac{c\, S^{-1} d_k d_k^\mathrm T S^{-1}}
+        {1 - c\, d_k^\mathrm T S^{-1} d_k} \,,
+        \qquad c = \frac{N}{N-1} \,,
+
+    which costs :math:`O(T^2)` instead of :math:`O(T^3)` for a fresh
+    factorization. The correlation matrix of the sample with :math:`N-1`
+    measurements is :math:`S^{(k)} / ([N-1][N-2])`, see
+    :func:`correlation_matrix`.
+
+    :param np.array sets: All measurements of the time series
+    :returns: Iterator over tuples of inverse correlation matrix and average
+        vector, one for each left out measurement
+    :raises np.linalg.LinAlgError: If a leave-one-out correlation matrix is
+        singular
+    '''
+    x = np.asarray(sets, dtype=float)
+    N = len(x)
+
+    average = np.mean(x, axis=0)
+    deviations = x - average
+
+    scatter = np.dot(deviations.T, deviations)
+    inv_scatter = np.asarray(invert_correlation_matrix(scatter))
+
+    c = N / (N - 1)
+    norm = (N - 1) * (N - 2)
+
+    for x_k, d_k in zip(x, deviations):
+        u = np.dot(inv_scatter, d_k)
+        denominator = 1 - c * np.dot(d_k, u)
+        if denominator <= 0:
+            raise np.linalg.LinAlgError(
+                'Leave-one-out correlation matrix is singular.')
+
+        inv_scatter_k = inv_scatter + c / denominator * np.outer(u, u)
+        average_k = (N * average - x_k) / (N - 1)
+
+        yield np.asmatrix(norm * inv_scatter_k), average_k
+
+
+def _cut_joint(x, ys, omit_pre, omit_post):
+    '''
+    Cuts every correlator to the window and puts them next to each other.
+    '''
+    used_xs = []
+    used_ys = []
+    for y in ys:
+        y = np.array(y)
+        used_x, used_y, used_yerr = correlators.fit._cut(x, y.T, None,
+                                                         omit_pre, omit_post)
+        used_xs.append(used_x)
+        used_ys.append(used_y.T)
+
+    return np.concatenate(used_xs), np.hstack(used_ys)
+
+
+def joint_inverse_correlation_matrix(ys, omit_pre=0, omit_post=0):
+    '''
+    Computes the inverse block correlation matrix for a joint fit once.
+
+    This is the analogon of :func:`inverse_correlation_matrix` for
+    :func:`fit_joint`.
+    '''
+    x = np.arange(np.shape(ys[0])[1])
+    used_x, used_y = _cut_joint(x, ys, omit_pre, omit_post)
+    cm, av = correlation_matrix(used_y)
+    return invert_correlation_matrix(cm)
+
+
 def rel_change(old, new):
     return np.abs(old - new) / old
 
@@ -121,9 +344,8 @@ def correlated_chi_square(average, fit_estimate, inv_correlation_matrix):
     :returns: :math:`\chi^2` value
     :rtype: float
     '''
-    vec = np.asmatrix(average - fit_estimate)
-    chi_sq = vec * inv_correlation_matrix * vec.T
-    return chi_sq[0, 0]
+    return correlators.kernels.chi_square(average, fit_estimate,
+                                         inv_correlation_matrix)
 
 
 def generate_chi_sq_minimizer(average, inv_correlation_matrix, fit_estimator, t):
@@ -134,19 +356,68 @@ def generate_chi_sq_minimizer(average, inv_correlation_matrix, fit_estimator, t)
     return chi_sq_minimizer
 
 
-def curve_fit_correlated(function, xdata, ydata, p0):
-    cm, av = correlation_matrix(ydata)
-    try:
-        inv_cm = cm.getI()
-    except np.linalg.linalg.LinAlgError as e:
-        print('----')
-        print('This occured while retrieving the inverse of:')
-        print(cm)
-        raise
+def generate_chi_sq_gradient(average, inv_correlation_matrix, fit_estimator, t):
+    r'''
+    Creates the gradient of the correlated :math:`\chi^2` with the analytic
+    Jacobian of the model,
 
-    chi_sq_minimizer = generate_chi_sq_minimizer(av, inv_cm, function, xdata)
+    .. math::
+
+        \nabla \chi^2 = -2 J^\mathrm T C^{-1} [\bar y - f] \,.
+    '''
+    inv_correlation_matrix = np.asarray(inv_correlation_matrix)
 
-    res = op.minimize(chi_sq_minimizer, p0, method='Powell')
+    def chi_sq_gradient(parameters):
+        residual = average - fit_estimator(t, *parameters)
+        jacobian = fit_estimator.jacobian(t, *parameters)
+        return -2 * np.dot(jacobian.T, np.dot(inv_correlation_matrix,
+                                              residual))
+    return chi_sq_gradient
+
+
+def curve_fit_correlated(function, xdata, ydata, p0, inv_cm=None):
+    '''
+    Fits the function to the average of the time series.
+
+    If no inverse correlation matrix is given, the correlation matrix is
+    computed from ``ydata`` and inverted. Otherwise the given one is used and
+    only the average is computed from ``ydata``.
+    '''
+    if inv_cm is None:
+        cm, av = correlation_matrix(ydata)
+        try:
+            inv_cm = invert_correlation_matrix(cm)
+        except np.linalg.LinAlgError as e:
+            print('----')
+            print('This occured while retrieving the inverse of:')
+            print(cm)
+            raise
+    else:
+        av = np.mean(ydata, axis=0)
+
+    return minimize_chi_sq(function, xdata, av, inv_cm, p0)
+
+
+def minimize_chi_sq(function, xdata, average, inv_cm, p0):
+    r'''
+    Minimizes the correlated :math:`\chi^2` for the given average.
+
+    If the model has a ``jacobian`` attribute, the gradient is used with the
+    BFGS method. Otherwise Powell's method is used, which needs no
+    derivatives.
+
+    :returns: Fit parameters and :math:`\chi^2` at the minimum
+    '''
+    import scipy.optimize as op
+
+    chi_sq_minimizer = generate_chi_sq_minimizer(average, inv_cm, function,
+                                                 xdata)
+
+    if hasattr(function, 'jacobian'):
+        gradient = generate_chi_sq_gradient(average, inv_cm, function, xdata)
+        res = op.minimize(chi_sq_minimizer, p0, jac=gradient, method='BFGS')
+    else:
+        res = op.minimize(chi_sq_minimizer, p0, method='Powell')
 
     if not res.success:
         print(res.message)
@@ -156,14 +427,33 @@ def curve_fit_correlated(function, xdata, ydata, p0):
     return res.x, chi_sq
 
 
-def fit(func, x, y, omit_pre=0, omit_post=0, p0=None):
+def _p_value(chi_sq, dof):
+    import scipy.stats
+
+    return 1 - scipy.stats.chi2.cdf(chi_sq, dof)
+
+
+def fit(func, x, y, omit_pre=0, omit_post=0, p0=None, inv_cm=None):
+    '''
+    Performs a correlated fit on the given window.
+
+    :param np.array inv_cm: Inverse correlation matrix of the fit window, see
+        :func:`inverse_correlation_matrix`. If it is not given, it is computed
+        from ``y``.
+
+    The result is taken from :mod:`correlators.cache` if it is enabled.
+    '''
     used_x, used_y, used_yerr = correlators.fit._cut(x, y.T, None, omit_pre, omit_post)
     used_y = used_y.T
 
 
-    popt, chi_sq = curve_fit_correlated(func, used_x, used_y, p0=p0)
+    popt, chi_sq = correlators.cache.memoize(
+        'corrfit.fit',
+        lambda: curve_fit_correlated(func, used_x, used_y, p0=p0,
+                                     inv_cm=inv_cm),
+        func, [used_x, used_y, inv_cm], [omit_pre, omit_post, p0])
 
-    p_value = 1 - scipy.stats.chi2.cdf(chi_sq, len(used_x) - 1 - len(popt))
+    p_value = _p_value(chi_sq, len(used_x) - 1 - len(popt))
 
 
     if any([rel_change(a, b) > 0.1 for a, b in zip(p0, popt)]):
@@ -184,6 +474,62 @@ def fit(func, x, y, omit_pre=0, omit_post=0, p0=None):
     return popt, chi_sq, p_value
 
 
+def fit_joint(func, x, ys, omit_pre=0, omit_post=0, p0=None, inv_cm=None):
+    '''
+    Performs a simultaneous correlated fit of several correlators.
+
+    Each correlator in ``ys`` is cut to the same window and the windows are put
+    next to each other. The correlation matrix is then the block matrix that
+    includes the correlation between the correlators. There is a single
+    factorization and a single minimization.
+
+    :param func: Model for the joined windows, for instance
+        :func:`correlators.fit.joint_cosh_fit_decorator`
+    :param list ys: Measurements of each correlator
+    :param np.array inv_cm: Inverse block correlation matrix, see
+        :func:`joint_inverse_correlation_matrix`
+
+    The result is taken from :mod:`correlators.cache` if it is enabled.
+    '''
+    used_x, used_y = _cut_joint(x, ys, omit_pre, omit_post)
+
+    popt, chi_sq = correlators.cache.memoize(
+        'corrfit.fit_joint',
+        lambda: curve_fit_correlated(func, used_x, used_y, p0=p0,
+                                     inv_cm=inv_cm),
+        func, [used_x, used_y, inv_cm], [omit_pre, omit_post, p0])
+
+    p_value = _p_value(chi_sq, len(used_x) - 1 - len(popt))
+
+    return popt, chi_sq, p_value
+
+
+def fit_jackknife(func, x, y, omit_pre=0, omit_post=0, p0=None):
+    r'''
+    Performs the correlated fit on every leave-one-out sample.
+
+    The inverse correlation matrices are obtained with rank one updates from
+    the full sample, see :func:`leave_one_out_inverse_correlation_matrices`.
+    Use :func:`correlators.bootstrap.average_and_std_jackknife` to get the
+    value and error from the results.
+
+    :returns: Fit parameters with one row per sample and the :math:`\chi^2`
+        values
+    :rtype: tuple(np.array, np.array)
+    '''
+    used_x, used_y, used_yerr = correlators.fit._cut(x, y.T, None, omit_pre, omit_post)
+    used_y = used_y.T
+
+    popts = []
+    chi_sqs = []
+    for inv_cm, average in leave_one_out_inverse_correlation_matrices(used_y):
+        popt, chi_sq = minimize_chi_sq(func, used_x, average, inv_cm, p0)
+        popts.append(popt)
+        chi_sqs.append(chi_sq)
+
+    return np.array(popts), np.array(chi_sqs)
+
+
 def main():
     sets = [
         [10, 8.4, 7.3, 5.1],
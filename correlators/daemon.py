@@ -0,0 +1,290 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+'''
+Long-running process that keeps ensembles in memory.
+
+The daemon listens on a Unix socket. Every request is one line of JSON with a
+``command``, the answer is one line of JSON as well, see :func:`handle`. The
+folded and blocked correlators of each folder and the averages of its
+bootstrap replicas stay in memory, so repeated fits with different models or
+windows do not load anything again. If the arrays take more than the given
+number of bytes, the least recently used ensembles are dropped.
+
+Requests are handled one after the other. :mod:`correlators.client` sends
+requests from the command line.
+'''
+
+from __future__ import division, absolute_import, print_function, \
+    unicode_literals
+
+import collections
+import json
+import logging
+import os
+import random
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import numpy as np
+
+import correlators.bootstrap
+import correlators.corrfit
+import correlators.fit
+import correlators.loader
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 1024**3
+'Default memory limit for the arrays of the ensembles.'
+
+_ensembles = collections.OrderedDict()
+_max_bytes = DEFAULT_MAX_BYTES
+
+
+def _size(entry):
+    return entry['stacks'][0].nbytes + entry['stacks'][1].nbytes + sum(
+        averages.nbytes for pair in entry['replicas'].values()
+        for averages in pair)
+
+
+def memory_usage():
+    '''
+    Returns the number of bytes of all arrays in memory.
+    '''
+    return sum(_size(entry) for entry in _ensembles.values())
+
+
+def _evict(current):
+    '''
+    Drops the least recently used ensembles until the limit is met.
+
+    The current ensemble is kept, only its older replica sets are dropped if
+    it exceeds the limit on its own.
+    '''
+    while memory_usage() > _max_bytes and len(_ensembles) > 1:
+        key, entry = _ensembles.popitem(last=False)
+        LOGGER.info('Dropping ensemble `%s`.', key[0])
+
+    replicas = current['replicas']
+    while memory_usage() > _max_bytes and len(replicas) > 1:
+        replicas.popitem(last=False)
+
+
+def get_ensemble(path, block_size=1):
+    '''
+    Returns the correlators of a folder, loading them if needed.
+
+    :returns: Entry with the stacked correlators ``stacks``, ``T``, ``L`` and
+        the replica sets in ``replicas``
+    :rtype: dict
+    '''
+    key = (os.path.abspath(path), block_size)
+    if key in _ensembles:
+        entry = _ensembles.pop(key)
+    else:
+        LOGGER.info('Loading ensemble `%s`.', path)
+        two_points, four_points, parameters = \
+            correlators.loader.folder_loader(path)
+        combined = correlators.bootstrap.block(
+            list(zip(two_points, four_points)), block_size)
+        entry = {
+            'stacks': [np.real(np.array(sets)) for sets in zip(*combined)],
+            'T': int(parameters['T']),
+            'L': int(parameters['L']),
+            'ensemble': parameters['ensemble'],
+            'replicas': collections.OrderedDict(),
+        }
+
+    _ensembles[key] = entry
+    _evict(entry)
+    return entry
+
+
+def draw_replicas(entry, sample_count=250, seed=None):
+    '''
+    Computes the averages of the bootstrap replicas of both correlators.
+
+    :returns: Averages with shape ``(sample_count, T/2+1)`` for the two- and
+        the four-point function
+    :rtype: tuple(np.array, np.array)
+    '''
+    indices = correlators.bootstrap.generate_indices(
+        len(entry['stacks'][0]), sample_count, seed)
+    return tuple(np.mean(stack[indices], axis=1) for stack in entry['stacks'])
+
+
+def get_replicas(entry, sample_count=250, seed=None):
+    '''
+    Returns the replicas from :func:`draw_replicas`, keeping them in memory.
+    '''
+    key = (sample_count, seed)
+    replicas = entry['replicas']
+    if key in replicas:
+        pair = replicas.pop(key)
+    else:
+        pair = draw_replicas(entry, sample_count, seed)
+
+    replicas[key] = pair
+    _evict(entry)
+    return pair
+
+
+def analyze(path, correlator='c2', states=1, offset=False, omit_pre=13,
+            omit_post=0, sample_count=250, seed=None, block_size=1,
+            covariance='uncorrelated'):
+    '''
+    Fits a model to the bootstrap replicas of one correlator.
+
+    The model is :func:`correlators.fit.multi_cosh_fit_decorator`, all
+    replicas are fitted at once with :func:`correlators.fit.fit_batch`.
+
+    :param str correlator: ``c2`` or ``c4``
+    :param int seed: Seed for the replicas, a random one is drawn if it is not
+        given. The replicas of each given seed are kept in memory, the ones
+        of a random seed are not reused and therefore not kept.
+    :param str covariance: ``uncorrelated`` to weight with the errors or
+        ``fixed`` for a correlated fit with the correlation matrix of the
+        original ensemble
+    :returns: Names, central values and errors of the parameters, the average
+        :math:`\\chi^2`, the number of replicas where the fit has failed and
+        the seed
+    :rtype: dict
+    '''
+    if correlator not in ('c2', 'c4'):
+        raise ValueError('Unknown correlator `{}`.'.format(correlator))
+    if covariance not in ('uncorrelated', 'fixed'):
+        raise ValueError('Unknown covariance mode `{}`.'.format(covariance))
+
+    entry = get_ensemble(path, block_size)
+    if seed is None:
+        # The global generator is seeded by the bootstrap.
+        seed = random.SystemRandom().randint(0, 2**31 - 1)
+        pair = draw_replicas(entry, sample_count, seed)
+    else:
+        pair = get_replicas(entry, sample_count, seed)
+
+    index = 0 if correlator == 'c2' else 1
+    stack = entry['stacks'][index]
+    averages = pair[index]
+
+    T = entry['T']
+    val = np.mean(stack, axis=0)
+    err = np.std(averages, axis=0)
+    time = np.arange(len(val))
+
+    inv_cm = None
+    if covariance == 'fixed':
+        inv_cm = correlators.corrfit.inverse_correlation_matrix(
+            stack, omit_pre, omit_post)
+
+    func = correlators.fit.multi_cosh_fit_decorator(T, states, offset)
+    p0 = correlators.fit.guess_multi_cosh_parameters(
+        val, T, states, omit_pre, omit_post, offset)
+    central, central_chi_sq = correlators.fit.fit_batch(
+        func, time, val, err, omit_pre, omit_post, p0, inv_cm)
+    params, chi_sq = correlators.fit.fit_batch(
+        func, time, averages, err, omit_pre, omit_post, central[0], inv_cm)
+
+    names = []
+    for k in range(1, states + 1):
+        names += ['m_{}'.format(k), 'a_{}'.format(k)]
+    if offset:
+        names.append('offset')
+
+    succeeded = np.isfinite(chi_sq)
+
+    return {
+        'ensemble': entry['ensemble'],
+        'names': names,
+        'central': central[0].tolist(),
+        'val': np.mean(params[succeeded], axis=0).tolist(),
+        'err': np.std(params[succeeded], axis=0).tolist(),
+        'chi_sq': float(np.mean(chi_sq[succeeded])),
+        'failed': int(np.sum(~succeeded)),
+        'seed': seed,
+    }
+
+
+def status():
+    '''
+    Lists the ensembles in memory from the least to the most recently used.
+    '''
+    return {
+        'ensembles': [{'path': key[0], 'block_size': key[1],
+                       'replicas': len(entry['replicas']),
+                       'bytes': _size(entry)}
+                      for key, entry in _ensembles.items()],
+        'bytes': memory_usage(),
+        'max_bytes': _max_bytes,
+    }
+
+
+def handle(message):
+    '''
+    Answers one request.
+
+    The commands are ``analyze`` with the arguments of :func:`analyze`,
+    ``status`` and ``shutdown``.
+
+    :param dict message: Request with the command and its arguments
+    :returns: Answer with ``ok`` and either ``result`` or ``error``
+    :rtype: dict
+    '''
+    arguments = dict(message)
+    command = arguments.pop('command', None)
+    try:
+        if command == 'analyze':
+            result = analyze(**arguments)
+        elif command == 'status':
+            result = status()
+        elif command == 'shutdown':
+            result = None
+        else:
+            raise ValueError('Unknown command `{}`.'.format(command))
+    except Exception as e:
+        LOGGER.exception('Request %s failed.', message)
+        return {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+
+    return {'ok': True, 'result': result}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            message = json.loads(line.decode('utf-8'))
+            answer = handle(message)
+            self.wfile.write((json.dumps(answer) + '\n').encode('utf-8'))
+            self.wfile.flush()
+            if message.get('command') == 'shutdown':
+                self.server.running = False
+
+
+def serve(socket_path, max_bytes=DEFAULT_MAX_BYTES):
+    '''
+    Answers requests on the Unix socket until ``shutdown`` is requested.
+
+    :param int max_bytes: Memory limit for the arrays of the ensembles
+    '''
+    global _max_bytes
+    _max_bytes = max_bytes
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = socketserver.UnixStreamServer(socket_path, _Handler)
+    server.running = True
+    LOGGER.info('Listening on `%s`.', socket_path)
+    try:
+        while server.running:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.remove(socket_path)
@@ -8,8 +8,10 @@ from __future__ import division, absolute_import, print_function, \
     unicode_literals
 
 import numpy as np
-import scipy.optimize as op
-import scipy.stats
+
+import correlators.cache
+import correlators.kernels
+import correlators.transform
 
 
 def _cut(x, y, yerr, omit_pre, omit_post):
@@ -32,11 +34,239 @@ def _cut(x, y, yerr, omit_pre, omit_post):
     return used_x, used_y, used_yerr
 
 
+def guess_cosh_parameters(y, shift, omit_pre=0, omit_post=0, offset=False):
+    r'''
+    Estimates initial parameters for :func:`cosh_fit_decorator`.
+
+    The mass is taken as the median of the effective mass from
+    :func:`correlators.transform.effective_mass_cosh` within the fit window,
+    that is its plateau value. With this mass, every point in the window gives
+    an estimate of the logarithm of the amplitude,
+
+    .. math::
+
+        \ln a = \ln C(t) - \ln\left(e^{-mt} + e^{-m[n-t]}\right) \,,
+
+    and the median of those is used. If the effective mass is not defined
+    anywhere in the window, the plateau is taken from all time slices.
+
+    :param np.array y: Averaged correlator
+    :param int shift: Value of :math:`x` where :math:`f(x) = f(0)`
+    :param bool offset: Append a zero offset for
+        :func:`cosh_fit_offset_decorator`
+    :returns: Initial parameters
+    :rtype: list
+    '''
+    y = np.asarray(y)
+    x = np.arange(len(y))
+
+    # The effective mass is not defined at the first and the last point.
+    m_eff = np.concatenate([
+        [np.nan], correlators.transform.effective_mass_cosh([y]), [np.nan]
+    ])
+
+    used_x, used_m_eff, used_yerr = _cut(x, m_eff, None, omit_pre, omit_post)
+    finite = np.isfinite(used_m_eff)
+    if np.any(finite):
+        m = np.median(used_m_eff[finite])
+    else:
+        m = np.median(m_eff[np.isfinite(m_eff)])
+
+    used_y = y[used_x]
+    log_a = np.log(used_y) - np.log(np.exp(-m*used_x) + np.exp(-m*(shift-used_x)))
+    a = np.exp(np.median(log_a[np.isfinite(log_a)]))
+
+    if offset:
+        return [m, a, 0]
+    else:
+        return [m, a]
+
+
+def guess_multi_cosh_parameters(y, shift, states, omit_pre=0, omit_post=0,
+                                offset=False):
+    '''
+    Estimates initial parameters for :func:`multi_cosh_fit_decorator`.
+
+    The ground state is estimated with :func:`guess_cosh_parameters` on the
+    second half of the data where the excited states have decayed. The
+    :math:`k`-th excited state starts at :math:`(k+1)` times the ground state
+    mass with the same amplitude.
+
+    :param np.array y: Averaged correlator
+    :param int shift: Value of :math:`x` where :math:`f(x) = f(0)`
+    :param int states: Number of states
+    :param bool offset: Append a zero offset
+    :returns: Initial parameters
+    :rtype: list
+    '''
+    m, a = guess_cosh_parameters(y, shift, omit_pre=max(omit_pre, len(y) // 2),
+                                 omit_post=omit_post)
+
+    p0 = []
+    for k in range(states):
+        p0 += [(k + 1) * m, a]
+
+    if offset:
+        p0.append(0)
+
+    return p0
+
+
 def fit(func, x, y, yerr=None, omit_pre=0, omit_post=0, p0=None):
-    used_x, used_y, used_yerr = _cut(x, y, yerr, omit_pre, omit_post)
-    popt, pconv = op.curve_fit(func, used_x, used_y, p0=p0, sigma=used_yerr)
+    '''
+    Performs an uncorrelated fit on the given window.
 
-    return popt
+    If the model has a ``jacobian`` attribute like the ones from
+    :func:`multi_cosh_fit_decorator`, it is passed to the fit routine.
+
+    The result is taken from :mod:`correlators.cache` if it is enabled.
+    '''
+    def compute():
+        import scipy.optimize as op
+
+        used_x, used_y, used_yerr = _cut(x, y, yerr, omit_pre, omit_post)
+        options = {}
+        if hasattr(func, 'jacobian'):
+            options['jac'] = func.jacobian
+        popt, pconv = op.curve_fit(func, used_x, used_y, p0=p0,
+                                   sigma=used_yerr, **options)
+        return popt
+
+    return correlators.cache.memoize('fit.fit', compute, func, [x, y, yerr],
+                                     [omit_pre, omit_post, p0])
+
+
+def fit_batch(func, x, ys, yerr=None, omit_pre=0, omit_post=0, p0=None,
+              inv_cm=None, max_iterations=200, tolerance=1e-10):
+    r'''
+    Fits many data sets at once with the Levenberg-Marquardt algorithm.
+
+    All data sets share the weights, so this is meant for the bootstrap
+    replicas with the errors or the correlation matrix of the original
+    ensemble. The residuals are whitened with :math:`W`, which is
+    :math:`\operatorname{diag}(1/\sigma)` for the uncorrelated fit and the
+    Cholesky factor of the inverse correlation matrix :math:`C^{-1} = W
+    W^\mathrm T` for the correlated one. Then every iteration solves
+
+    .. math::
+
+        [J^\mathrm T J + \lambda D] \delta = J^\mathrm T r \,,
+        \qquad D = \operatorname{diag}(J^\mathrm T J)
+        + \epsilon \max \operatorname{diag}(J^\mathrm T J)
+
+    for all data sets with one batched call. The damping :math:`\lambda` is
+    adjusted for each data set separately. The floor :math:`\epsilon` keeps
+    the system regular if a column of the Jacobian vanishes, for instance when
+    a model has more states than the data supports and an amplitude goes to
+    zero. Steps to parameters where the model is not finite are rejected.
+    Data sets where the model or its Jacobian is not finite at the accepted
+    parameters have failed, their parameters and :math:`\chi^2` are NaN.
+
+    The model has to accept parameters with shape ``(n, 1)`` and needs a
+    ``jacobian`` attribute, like the models from
+    :func:`multi_cosh_fit_decorator`.
+
+    :param np.array ys: Data sets with shape ``(n, len(x))``
+    :param np.array yerr: Errors of the data points, used if ``inv_cm`` is
+        not given
+    :param np.array p0: Initial parameters, either one set for all data sets
+        or one per data set
+    :param np.array inv_cm: Inverse correlation matrix within the window
+    :returns: Parameters with shape ``(n, len(p0))`` and :math:`\chi^2` of each
+        data set, NaN for the failed ones
+    :rtype: tuple(np.array, np.array)
+    '''
+    ys = np.atleast_2d(ys)
+    used_x, used_ys, used_yerr = _cut(np.asarray(x), ys.T, yerr, omit_pre,
+                                      omit_post)
+    used_ys = used_ys.T
+
+    if inv_cm is not None:
+        whitening = np.linalg.cholesky(np.asarray(inv_cm))
+    elif used_yerr is not None:
+        whitening = np.diag(1 / np.asarray(used_yerr))
+    else:
+        whitening = np.eye(len(used_x))
+
+    n = used_ys.shape[0]
+    p0 = np.asarray(p0, dtype=float)
+    params = np.array(np.broadcast_to(p0, (n, p0.shape[-1])))
+
+    def residuals(params):
+        columns = [params[:, i, np.newaxis] for i in range(params.shape[1])]
+        with np.errstate(all='ignore'):
+            r = np.dot(used_ys - func(used_x, *columns), whitening)
+            chi_sq = np.sum(r**2, axis=1)
+        return r, chi_sq, columns
+
+    identity = np.eye(params.shape[1])
+    r, chi_sq, columns = residuals(params)
+    damping = np.full(n, 1e-3)
+    failed = ~np.isfinite(chi_sq)
+    converged = failed.copy()
+
+    for iteration in range(max_iterations):
+        with np.errstate(all='ignore'):
+            jacobian = np.einsum('itp,ts->isp',
+                                 func.jacobian(used_x, *columns), whitening)
+            alpha = np.einsum('isp,isq->ipq', jacobian, jacobian)
+            beta = np.einsum('isp,is->ip', jacobian, r)
+
+        failed |= ~np.all(np.isfinite(alpha), axis=(1, 2)) \
+            | ~np.all(np.isfinite(beta), axis=1)
+        converged |= failed
+        active = ~converged
+        if not np.any(active):
+            break
+
+        diagonal = np.einsum('ipp->ip', alpha[active])
+        scale = diagonal + 1e-9 * np.max(diagonal, axis=1)[:, np.newaxis]
+        damped = alpha[active] + damping[active, np.newaxis, np.newaxis] \
+            * (scale[:, :, np.newaxis] * identity)
+        step = np.zeros(params.shape)
+        step[active] = _solve_batch(damped, beta[active])
+
+        trial = params + step
+        trial_r, trial_chi_sq, trial_columns = residuals(trial)
+
+        accepted = (trial_chi_sq <= chi_sq) & active \
+            & np.all(np.isfinite(trial), axis=1)
+        converged |= accepted & (chi_sq - trial_chi_sq
+                                 <= tolerance * (1 + chi_sq))
+        converged |= damping > 1e10
+
+        params[accepted] = trial[accepted]
+        r[accepted] = trial_r[accepted]
+        chi_sq[accepted] = trial_chi_sq[accepted]
+        columns = [params[:, i, np.newaxis] for i in range(params.shape[1])]
+        damping = np.where(accepted, damping / 10, damping * 10)
+
+        if np.all(converged):
+            break
+
+    params[failed] = np.nan
+    chi_sq[failed] = np.nan
+
+    return params, chi_sq
+
+
+def _solve_batch(matrices, vectors):
+    '''
+    Solves a batch of linear systems.
+
+    If one of the systems is singular, the others are solved one by one and
+    the solution of the singular ones is NaN.
+    '''
+    try:
+        return np.linalg.solve(matrices, vectors[:, :, np.newaxis])[:, :, 0]
+    except np.linalg.LinAlgError:
+        solutions = np.full(vectors.shape, np.nan)
+        for i, (matrix, vector) in enumerate(zip(matrices, vectors)):
+            try:
+                solutions[i] = np.linalg.solve(matrix, vector)
+            except np.linalg.LinAlgError:
+                pass
+        return solutions
 
 
 def fit_and_plot(axes, func, x, y, yerr=None, omit_pre=0, omit_post=0, p0=None,
@@ -44,19 +274,43 @@ def fit_and_plot(axes, func, x, y, yerr=None, omit_pre=0, omit_post=0, p0=None,
     used_x, used_y, used_yerr = _cut(x, y, yerr, omit_pre, omit_post)
     popt = fit(func, used_x, used_y, used_yerr, p0=p0)
 
+    plot_fit(axes, func, x, y, yerr, popt, omit_pre, omit_post, fit_param,
+             data_param, used_param)
+
+    import scipy.stats
+
+    dof = len(used_y) - len(popt) - 1
+    chisq, p = scipy.stats.chisquare(used_y, func(used_x, *popt),
+                                     ddof=len(popt))
+
+    print('χ2:', chisq)
+    print('χ2/DOF:', chisq/dof)
+    print('p:', p)
+
+    return popt
+
+
+def plot_fit(axes, func, x, y, yerr, popt, omit_pre=0, omit_post=0,
+             fit_param={}, data_param={}, used_param={}):
+    '''
+    Plots data together with a model for the given parameters and the
+    residuals in the fit range.
+    '''
+    used_x, used_y, used_yerr = _cut(x, y, yerr, omit_pre, omit_post)
+
     fx = np.linspace(np.min(x), np.max(x), 1000)
     fy = func(fx, *popt)
 
     param = {}
-    param = dict(param.items() + fit_param.items())
+    param.update(fit_param)
     axes.plot(fx, fy, **param)
 
     param = {'marker': '+', 'linestyle': 'none'}
-    param = dict(param.items() + data_param.items())
+    param.update(data_param)
     axes.errorbar(x, y, yerr=yerr, **param)
 
     param = {'marker': '+', 'linestyle': 'none'}
-    param = dict(param.items() + used_param.items())
+    param.update(used_param)
     axes.errorbar(used_x, used_y, yerr=used_yerr, **param)
 
     axes_res = axes.twinx()
@@ -67,16 +321,6 @@ def fit_and_plot(axes, func, x, y, yerr=None, omit_pre=0, omit_post=0, p0=None,
     axes_res.plot([np.min(used_x), np.max(used_x)], [0, 0], color='red',
                   alpha=0.2)
 
-    dof = len(used_y) - len(popt) - 1
-    chisq, p = scipy.stats.chisquare(used_y, func(used_x, *popt),
-                                     ddof=len(popt))
-
-    print('χ2:', chisq)
-    print('χ2/DOF:', chisq/dof)
-    print('p:', p)
-
-    return popt
-
 
 def cosh_fit_decorator(shift):
     def cosh_fit(x, m, a):
@@ -92,10 +336,7 @@ def cosh_fit_decorator(shift):
         :param float a: Amplitude exponential
         :param int shift: Value of :math:`x` where :math:`f(x) = f(0)`
         '''
-        y = shift - x
-        first = a * np.exp(-x*m)
-        second = a * np.exp(-y*m)
-        return first + second
+        return correlators.kernels.cosh(x, m, a, shift)
 
     return cosh_fit
 
@@ -122,6 +363,136 @@ def cosh_fit_offset_decorator(shift):
     return cosh_fit_offset
 
 
+def multi_cosh_fit_decorator(shift, states, offset=False):
+    def multi_cosh_fit(x, *params):
+        r'''
+        Model with several states.
+
+        .. math::
+
+            \operatorname{fit}(x; m_1, a_1, \ldots, m_N, a_N, \mathrm{offset})
+            = \sum_{k=1}^N a_k \left(e^{-m_k x} + e^{-m_k[n - x]}\right)
+            + \mathrm{offset}
+
+        The parameters may be arrays of shape ``(n, 1)``, then the model is
+        evaluated for ``n`` parameter sets at once. The derivatives with
+        respect to the parameters are available as the ``jacobian``
+        attribute.
+
+        :param np.array x: Input values
+        :param float params: Masses and amplitudes of each state, then the
+            offset if there is one
+        :param int shift: Value of :math:`x` where :math:`f(x) = f(0)`
+        :param int states: Number of states :math:`N`
+        :param bool offset: Whether the model has a constant offset
+        '''
+        result = np.zeros(np.shape(x))
+        for k in range(states):
+            m, a = params[2*k], params[2*k+1]
+            result = result + a * (np.exp(-m * x) + np.exp(-m * (shift - x)))
+        if offset:
+            result = result + params[2*states]
+        return result
+
+    def multi_cosh_jacobian(x, *params):
+        '''
+        Derivatives of the model with respect to the parameters.
+
+        :returns: Array with the parameters as the last axis
+        '''
+        columns = []
+        for k in range(states):
+            m, a = params[2*k], params[2*k+1]
+            early = np.exp(-m * x)
+            late = np.exp(-m * (shift - x))
+            columns.append(- a * (x * early + (shift - x) * late))
+            columns.append(early + late)
+        if offset:
+            columns.append(np.ones(np.shape(x)))
+        return np.stack(np.broadcast_arrays(*columns), axis=-1)
+
+    multi_cosh_fit.jacobian = multi_cosh_jacobian
+
+    return multi_cosh_fit
+
+
+def sinh_fit_decorator(shift, dt=1):
+    cosh_fit = cosh_fit_decorator(shift)
+
+    def sinh_fit(x, m, a):
+        r'''
+        Model for the shifted difference of a :math:`\cosh` correlator.
+
+        This describes :func:`correlators.transform.shifted_difference` of
+        :func:`cosh_fit_decorator` with the same parameters. A constant offset
+        does not appear:
+
+        .. math::
+
+            \operatorname{fit}(x; m, a) = 4 a e^{-mn/2}
+            \sinh(m \Delta t/2) \sinh(m [n/2 - x - \Delta t/2])
+
+        :param np.array x: Input values
+        :param float m: Effective mass
+        :param float a: Amplitude exponential
+        :param int shift: Value of :math:`x` where :math:`f(x) = f(0)`
+        :param int dt: Shift :math:`\Delta t`
+        '''
+        return cosh_fit(x, m, a) - cosh_fit(x + dt, m, a)
+
+    return sinh_fit
+
+
+def joint_cosh_fit_decorator(shift, split):
+    cosh_fit = cosh_fit_decorator(shift)
+
+    def joint_cosh_fit(x, m, a2, delta_e, a4, offset):
+        r'''
+        Simultaneous model for the two- and four-point correlation function.
+
+        The first ``split`` elements of :math:`x` belong to the two-point
+        function, the remaining ones to the four-point function. The energy of
+        the latter is parametrized as :math:`2 m + \Delta E`.
+
+        :param np.array x: Input values of both correlators after each other
+        :param float m: Effective mass of the two-point function
+        :param float a2: Amplitude of the two-point function
+        :param float delta_e: Energy shift :math:`\Delta E`
+        :param float a4: Amplitude of the four-point function
+        :param float offset: Constant offset of the four-point function
+        '''
+        first = cosh_fit(x[:split], m, a2)
+        second = cosh_fit(x[split:], 2 * m + delta_e, a4) + offset
+        return np.concatenate([first, second])
+
+    return joint_cosh_fit
+
+
+def ratio_fit_decorator(shift, m):
+    def ratio_fit(x, a, delta_e):
+        r'''
+        Model for the ratio from :func:`correlators.transform.ratio_periodic`.
+
+        .. math::
+
+            R(t + 1/2) = a \left[ \cosh(\Delta E\, t')
+            + \sinh(\Delta E\, t') \coth(2 m t') \right] \,,
+            \qquad t' = t + 1/2 - n/2
+
+        :param np.array x: Input values, the first time slice of each
+            difference
+        :param float a: Amplitude
+        :param float delta_e: Energy shift :math:`\Delta E`
+        :param float m: Mass of the single particle
+        :param int shift: Value of :math:`x` where :math:`f(x) = f(0)`
+        '''
+        t = x + 0.5 - shift / 2
+        return a * (np.cosh(delta_e * t)
+                    + np.sinh(delta_e * t) / np.tanh(2 * m * t))
+
+    return ratio_fit
+
+
 def exp_fit(x, m1, a1, offset):
     '''
     :param np.array x: Input values
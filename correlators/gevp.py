@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+r'''
+Generalized eigenvalue problem for correlator matrices.
+
+For a matrix :math:`C_{ij}(t)` of correlators between the operators
+:math:`O_i` and :math:`O_j` the generalized eigenvalue problem
+
+.. math::
+
+    C(t) v_n(t, t_0) = \lambda_n(t, t_0) C(t_0) v_n(t, t_0)
+
+is solved for every time slice. With the Cholesky decomposition
+:math:`C(t_0) = L L^\mathrm T` it becomes the ordinary symmetric problem for
+:math:`L^{-1} C(t) L^{-\mathrm T}`. The eigenvalues are the principal
+correlators, each of them is dominated by a single state and can be fitted with
+:func:`correlators.fit.cosh_fit_decorator`.
+
+All functions work on stacks, the leading axes can be configurations or
+bootstrap replicas. The time is always the last axis.
+'''
+
+from __future__ import division, absolute_import, print_function, \
+    unicode_literals
+
+import numpy as np
+
+import correlators.bootstrap
+
+
+def assemble(elements, n_op):
+    '''
+    Assembles the correlator matrix from lists of its elements.
+
+    :param dict elements: Correlators for each pair ``(i, j)`` of operator
+        indices, each a list over the configurations. If ``(j, i)`` is
+        missing, ``(i, j)`` is used for it.
+    :param int n_op: Number of operators
+    :returns: Stack with shape ``(n_conf, n_op, n_op, T)``
+    :rtype: np.array
+    :raises KeyError: If both ``(i, j)`` and ``(j, i)`` are missing
+    '''
+    rows = []
+    for i in range(n_op):
+        row = []
+        for j in range(n_op):
+            if (i, j) in elements:
+                row.append(np.asarray(elements[(i, j)]))
+            else:
+                row.append(np.asarray(elements[(j, i)]))
+        rows.append(row)
+
+    return np.array(rows).transpose(2, 0, 1, 3)
+
+
+def solve(matrices, t0=1):
+    r'''
+    Solves the generalized eigenvalue problem for all time slices at once.
+
+    The matrices are symmetrized first. The eigenvalues are sorted such that
+    the first one belongs to the ground state as long as the states do not
+    cross. That is descending order for :math:`t > t_0` and ascending order
+    before, where the lightest state has grown the least.
+
+    :param np.array matrices: Averaged correlator matrices with shape
+        ``(..., n_op, n_op, T)``
+    :param int t0: Reference time slice :math:`t_0`
+    :returns: Eigenvalues with shape ``(..., n_op, T)`` and generalized
+        eigenvectors with shape ``(..., T, n_op, n_op)``, the columns belong to
+        the eigenvalues
+    :rtype: tuple(np.array, np.array)
+    :raises np.linalg.LinAlgError: If :math:`C(t_0)` is not positive definite
+    '''
+    matrices = np.asarray(matrices)
+    c = np.rollaxis(matrices, -1, -3)
+    c = (c + np.swapaxes(c, -1, -2)) / 2
+
+    cholesky = np.linalg.cholesky(c[..., t0, :, :])
+    inv_cholesky = np.linalg.inv(cholesky)[..., np.newaxis, :, :]
+
+    reduced = np.matmul(np.matmul(inv_cholesky, c),
+                        np.swapaxes(inv_cholesky, -1, -2))
+    eigenvalues, eigenvectors = np.linalg.eigh(reduced)
+
+    # `eigh` sorts in ascending order, reverse from t0 on.
+    late = np.arange(eigenvalues.shape[-2]) >= t0
+    eigenvalues[..., late, :] = eigenvalues[..., late, ::-1]
+    eigenvectors[..., late, :, :] = eigenvectors[..., late, :, ::-1]
+    eigenvectors = np.matmul(np.swapaxes(inv_cholesky, -1, -2), eigenvectors)
+
+    return np.rollaxis(eigenvalues, -1, -2), eigenvectors
+
+
+def principal_correlators(stack, t0=1, sample_count=250, seed=None):
+    '''
+    Computes the principal correlators of the ensemble and of its bootstrap
+    replicas.
+
+    The averages of all replicas are computed with
+    :func:`correlators.bootstrap.bootstrap_averages` and the eigenvalue
+    problems of all replicas and time slices are solved with one batched call.
+
+    :param np.array stack: Correlator matrices with shape ``(n_conf, n_op,
+        n_op, T)``, see :func:`assemble`
+    :param int t0: Reference time slice :math:`t_0`
+    :returns: Principal correlators of the full ensemble with shape ``(n_op,
+        T)`` and of the replicas with shape ``(sample_count, n_op, T)``
+    :rtype: tuple(np.array, np.array)
+    '''
+    stack = np.asarray(stack)
+    central, vectors = solve(np.mean(stack, axis=0), t0)
+
+    averages = correlators.bootstrap.bootstrap_averages(stack, sample_count,
+                                                        seed)
+    replicas, vectors = solve(averages, t0)
+
+    return central, replicas
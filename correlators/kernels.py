@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+'''
+Kernels for the innermost functions with selectable implementation.
+
+The NumPy implementations are the reference. If Numba_ is installed, compiled
+implementations are available as well. They work with explicit loops and do
+not allocate temporary arrays. The implementation is selected at runtime with
+:func:`set_backend` or with the environment variable ``CORRELATORS_KERNELS``.
+Numba is only imported and the kernels are only compiled when its backend is
+selected.
+
+.. _Numba: http://numba.pydata.org/
+'''
+
+from __future__ import division, absolute_import, print_function, \
+    unicode_literals
+
+import math
+import os
+
+import numpy as np
+
+
+def _cosh_numpy(x, m, a, shift):
+    return a * np.exp(-x*m) + a * np.exp(-(shift-x)*m)
+
+
+def _chi_square_numpy(average, fit_estimate, inv_correlation_matrix):
+    vec = average - fit_estimate
+    return np.dot(vec, np.dot(inv_correlation_matrix, vec))
+
+
+def _fold_numpy(val):
+    n = len(val)
+    second_rev_val = val[n//2+1:][::-1]
+    first_val = val[:n//2+1]
+    first_val[1:-1] += second_rev_val
+    first_val[1:-1] /= 2.
+
+    return first_val
+
+
+def _effective_mass_cosh_numpy(val, dt):
+    frac = (val[..., :-2*dt] + val[..., 2*dt:]) / val[..., dt:-dt] / 2
+    return np.arccosh(frac)
+
+
+KERNELS = {
+    'numpy': {
+        'cosh': _cosh_numpy,
+        'chi_square': _chi_square_numpy,
+        'fold': _fold_numpy,
+        'effective_mass_cosh': _effective_mass_cosh_numpy,
+    },
+}
+'Implementations of the kernels by backend, ``None`` until it is selected.'
+
+
+def _is_installed(name):
+    '''
+    Tells whether a module can be imported without importing it.
+    '''
+    try:
+        import importlib.util
+    except ImportError:
+        import imp
+        try:
+            imp.find_module(name)
+        except ImportError:
+            return False
+        return True
+
+    return importlib.util.find_spec(name) is not None
+
+
+def _numba_kernels():
+    import numba
+
+    @numba.njit(cache=True)
+    def _cosh_numba(x, m, a, shift):
+        result = np.empty(x.shape[0])
+        for i in range(x.shape[0]):
+            result[i] = a * (math.exp(-x[i]*m) + math.exp(-(shift-x[i])*m))
+        return result
+
+    @numba.njit(cache=True)
+    def _chi_square_numba(average, fit_estimate, inv_correlation_matrix):
+        n = average.shape[0]
+        chi_sq = 0.0
+        for i in range(n):
+            row = 0.0
+            for j in range(n):
+                row += inv_correlation_matrix[i, j] \
+                    * (average[j] - fit_estimate[j])
+            chi_sq += (average[i] - fit_estimate[i]) * row
+        return chi_sq
+
+    @numba.njit(cache=True)
+    def _fold_numba(val):
+        n = val.shape[0]
+        for i in range(1, n//2):
+            val[i] = (val[i] + val[n-i]) / 2.
+        return val[:n//2+1]
+
+    @numba.njit(cache=True)
+    def _effective_mass_cosh_numba(val, dt):
+        n = val.shape[0] - 2*dt
+        result = np.empty(n)
+        for i in range(n):
+            frac = (val[i] + val[i+2*dt]) / val[i+dt] / 2
+            if frac >= 1:
+                result[i] = math.acosh(frac)
+            else:
+                result[i] = np.nan
+        return result
+
+    return {
+        'cosh': _cosh_numba,
+        'chi_square': _chi_square_numba,
+        'fold': _fold_numba,
+        'effective_mass_cosh': _effective_mass_cosh_numba,
+    }
+
+
+if _is_installed('numba'):
+    KERNELS['numba'] = None
+
+
+_backend = 'numpy'
+
+
+def set_backend(name):
+    '''
+    Selects the implementation of the kernels.
+
+    :param str name: Name of the backend, one of :data:`KERNELS`
+    :raises ValueError: If the backend is not available
+    '''
+    global _backend
+
+    if name not in KERNELS:
+        raise ValueError('Kernel backend `{}` is not available, choose from '
+                         '{}.'.format(name, ', '.join(sorted(KERNELS))))
+
+    if KERNELS[name] is None:
+        KERNELS[name] = _numba_kernels()
+
+    _backend = name
+
+
+def get_backend():
+    '''
+    Returns the name of the selected backend.
+    '''
+    return _backend
+
+
+def _is_float_array(x):
+    return isinstance(x, np.ndarray) and x.dtype == np.float64 \
+        and x.ndim == 1 and x.flags.c_contiguous
+
+
+def cosh(x, m, a, shift):
+    '''
+    Evaluates :math:`a [e^{-mx} + e^{-m[n-x]}]`.
+
+    The compiled kernel works on one dimensional arrays only, everything else
+    is passed to the NumPy implementation.
+    '''
+    if _backend != 'numpy' and isinstance(x, np.ndarray) and x.ndim == 1:
+        return KERNELS[_backend]['cosh'](x, m, a, shift)
+    return _cosh_numpy(x, m, a, shift)
+
+
+def chi_square(average, fit_estimate, inv_correlation_matrix):
+    '''
+    Evaluates the correlated :math:`\\chi^2` of the residual vector.
+    '''
+    average = np.asarray(average, dtype=float).ravel()
+    fit_estimate = np.asarray(fit_estimate, dtype=float).ravel()
+    inv_correlation_matrix = np.asarray(inv_correlation_matrix)
+    return KERNELS[_backend]['chi_square'](average, fit_estimate,
+                                           inv_correlation_matrix)
+
+
+def fold(val):
+    '''
+    Folds the data in place and returns the first half, see
+    :func:`correlators.loader.fold_data`.
+    '''
+    if _backend != 'numpy' and _is_float_array(val):
+        return KERNELS[_backend]['fold'](val)
+    return _fold_numpy(val)
+
+
+def effective_mass_cosh(val, dt=1):
+    '''
+    Computes the :math:`\\cosh` effective mass along the last axis, see
+    :func:`correlators.transform.effective_mass_cosh`.
+
+    The compiled kernel works on one dimensional arrays only, blocks are
+    passed to the NumPy implementation.
+    '''
+    if _backend != 'numpy' and _is_float_array(val):
+        return KERNELS[_backend]['effective_mass_cosh'](val, dt)
+    return _effective_mass_cosh_numpy(val, dt)
+
+
+if 'CORRELATORS_KERNELS' in os.environ:
+    set_backend(os.environ['CORRELATORS_KERNELS'])
@@ -19,6 +19,8 @@ import logging
 
 import numpy as np
 
+import correlators.kernels
+
 
 TWO_PATTERN = re.compile(r'C2_pi\+-_conf(\d{4}).dat')
 FOUR_PATTERN = re.compile(r'C4_(\d)_conf(\d{4}).dat')
@@ -39,12 +41,39 @@ CONFIGURATION_PATTERN = re.compile(r'''
 
 LOGGER = logging.getLogger(__name__)
 
+_preloaded = {}
+
+
+def preload(path):
+    '''
+    Loads a folder such that the next call of :func:`folder_loader` with it
+    returns immediately.
+
+    This can be called from a background thread.
+    '''
+    _preloaded[path] = folder_loader(path)
+
 
-def folder_loader(path):
+def discard_preloaded(path):
+    '''
+    Releases the preloaded data of a folder if it has not been used.
+    '''
+    _preloaded.pop(path, None)
+
+
+def folder_loader(path, combine=True):
     '''
     Loads all the two-point and four-point correlation functions from the given
     folder.
+
+    :param bool combine: Return the combination :math:`C_4^{(1)} + C_4^{(2)} -
+        2 C_4^{(3)}` of the four-point functions. Otherwise a dict with the
+        lists of the individual contractions is returned, they can be used as
+        elements of a correlator matrix, see :func:`correlators.gevp.assemble`.
     '''
+    if combine and path in _preloaded:
+        return _preloaded.pop(path)
+
     two_points = []
     four_points = {
         1: [],
@@ -84,6 +113,9 @@ def folder_loader(path):
 
         raise RuntimeError('`{}` has unforseen format.'.format(filename))
 
+    if not combine:
+        return two_points, four_points, parameters
+
     four_point = [
         c1 + c2 - 2 * c3
         for c1, c2, c3 in zip(four_points[1], four_points[2], four_points[3])
@@ -103,11 +135,13 @@ def correlator_loader(filename):
     float* numbers, real and imaginary part right after each other.
 
     :param str filename: Path to the binary file
-    :returns: NumPy array with complex numbers
+    :returns: Contiguous NumPy array with the real parts
     :rtype: np.array
     '''
     dtype = np.dtype(np.complex128)
-    data = np.real(np.fromfile(filename, dtype))
+    # The real part is a strided view, the compiled kernels need a
+    # contiguous copy.
+    data = np.ascontiguousarray(np.real(np.fromfile(filename, dtype)))
 
     return data
 
@@ -144,10 +178,4 @@ def fold_data(val):
     :returns: Folded array with :math:`N/2` elements
     :rtype: np.array
     '''
-    n = len(val)
-    second_rev_val = val[n//2+1:][::-1]
-    first_val = val[:n//2+1]
-    first_val[1:-1] += second_rev_val
-    first_val[1:-1] /= 2.
-
-    return first_val
+    return correlators.kernels.fold(val)
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+'''
+Small pipeline of stages with cached artifacts.
+
+A stage is a function that gets the outputs of the stages it depends on and
+some options. If a directory is given, the output of every stage is stored
+there as an artifact. Its key is a hash of
+
+- the name of the stage,
+- the source code of the function and of the modules it uses,
+- the values of its options and
+- the hashes of the contents of the artifacts it depends on.
+
+A stage is only run if there is no artifact with its key. If a stage produces
+the same output as before, the stages depending on it are not run again.
+'''
+
+from __future__ import division, absolute_import, print_function, \
+    unicode_literals
+
+import hashlib
+import importlib
+import inspect
+import logging
+import os
+import pickle
+import tempfile
+import time
+
+import correlators.cache
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = os.path.join(correlators.cache.DEFAULT_DIRECTORY,
+                                 'artifacts')
+'Default location of the artifacts.'
+
+_code_digests = {}
+
+
+def stage(name, function, dependencies=(), parameters=(), modules=()):
+    '''
+    Describes a stage of a pipeline.
+
+    :param str name: Name of the stage
+    :param function: Function that is called with the outputs of the
+        dependencies as positional arguments and the parameters as keyword
+        arguments
+    :param list dependencies: Names of the stages whose outputs are needed
+    :param list parameters: Names of the options that are passed
+    :param list modules: Names of the modules whose code the function uses,
+        changes in them invalidate the artifacts
+    :rtype: dict
+    '''
+    return {
+        'name': name,
+        'function': function,
+        'dependencies': list(dependencies),
+        'parameters': list(parameters),
+        'modules': list(modules),
+    }
+
+
+def dependents(stages, names):
+    '''
+    Finds the stages that depend on the given ones, directly or indirectly.
+
+    :returns: Names of the given stages and their dependents
+    :rtype: set
+    '''
+    result = set(names)
+    for s in stages:
+        if any(dependency in result for dependency in s['dependencies']):
+            result.add(s['name'])
+    return result
+
+
+def _code_digest(s):
+    if s['name'] not in _code_digests:
+        sha = hashlib.sha1()
+        sha.update(inspect.getsource(s['function']).encode())
+        for module in s['modules']:
+            sha.update(inspect.getsource(
+                importlib.import_module(module)).encode())
+        _code_digests[s['name']] = sha.hexdigest()
+
+    return _code_digests[s['name']]
+
+
+def _key(s, parameters, input_digests):
+    sha = hashlib.sha1()
+    sha.update(s['name'].encode())
+    sha.update(_code_digest(s).encode())
+    sha.update(repr(sorted(parameters.items())).encode())
+    for digest in input_digests:
+        sha.update(digest.encode())
+    return sha.hexdigest()
+
+
+def _load(path):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        return hashlib.sha1(data).hexdigest(), pickle.loads(data)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def _store(path, value):
+    data = pickle.dumps(value, protocol=2)
+
+    directory = os.path.dirname(path)
+    correlators.cache._makedirs(directory)
+    handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'wb') as f:
+        f.write(data)
+    os.rename(temp, path)
+
+    return hashlib.sha1(data).hexdigest()
+
+
+def run(stages, options, directory=None, invalidate=()):
+    '''
+    Runs the stages in the given order.
+
+    :param list stages: Stages from :func:`stage`, each one after its
+        dependencies
+    :param dict options: Values for the parameters of all stages
+    :param str directory: Location of the artifacts, with ``None`` every stage
+        is run and nothing is stored
+    :param list invalidate: Names of stages that are run in any case, their
+        dependents are run as well
+    :returns: Output of each stage
+    :rtype: dict
+    :raises ValueError: If a stage is unknown or comes before one of its
+        dependencies
+    '''
+    names = [s['name'] for s in stages]
+    for name in invalidate:
+        if name not in names:
+            raise ValueError('Unknown stage `{}`.'.format(name))
+    forced = dependents(stages, invalidate)
+
+    outputs = {}
+    digests = {}
+    for s in stages:
+        for dependency in s['dependencies']:
+            if dependency not in outputs:
+                raise ValueError('Stage `{}` has to come after `{}`.'.format(
+                    s['name'], dependency))
+
+        arguments = [outputs[dependency] for dependency in s['dependencies']]
+        parameters = dict((name, options[name]) for name in s['parameters'])
+
+        if directory is None:
+            outputs[s['name']] = s['function'](*arguments, **parameters)
+            continue
+
+        key = _key(s, parameters,
+                   [digests[dependency] for dependency in s['dependencies']])
+        path = os.path.join(directory, s['name'], key + '.pickle')
+
+        loaded = None if s['name'] in forced else _load(path)
+        if loaded is None:
+            start = time.time()
+            value = s['function'](*arguments, **parameters)
+            digest = _store(path, value)
+            LOGGER.info('Stage `%s` took %.2f s.', s['name'],
+                        time.time() - start)
+        else:
+            digest, value = loaded
+            LOGGER.info('Stage `%s` is up to date.', s['name'])
+
+        outputs[s['name']] = value
+        digests[s['name']] = digest
+
+    return outputs
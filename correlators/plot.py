@@ -6,6 +6,12 @@
 
 """
 Plots of data sets.
+
+The figures are described by plain data, central values, errors and fit
+parameters, which is computed during the analysis with
+:func:`correlator_figure` and :func:`effective_mass_figure`. Drawing them with
+:func:`render` does not need the configurations and does not perform any fits.
+Matplotlib is only imported for drawing.
 """
 
 from __future__ import division, absolute_import, print_function, \
@@ -13,22 +19,78 @@ from __future__ import division, absolute_import, print_function, \
 
 import logging
 
-import matplotlib.backends.backend_agg
-import matplotlib.figure
 import numpy as np
 
-import correlators.bootstrap
 import correlators.fit
 import correlators.transform
 
 
 LOGGER = logging.getLogger(__name__)
 
-
-def plot_correlator(sets, name, shift, offset=False):
-    folded_val, folded_err = correlators.bootstrap.bootstrap_pre_transform(
-        correlators.bootstrap.average_arrays, sets
-    )
+MODELS = {
+    'cosh': correlators.fit.cosh_fit_decorator,
+    'cosh_offset': correlators.fit.cosh_fit_offset_decorator,
+    'sinh': correlators.fit.sinh_fit_decorator,
+}
+'Model decorators from :mod:`correlators.fit` by name.'
+
+
+def correlator_figure(averages, model, shift, params, omit_pre=13):
+    '''
+    Describes the plot of a correlator with its fit.
+
+    :param np.array averages: Averages of the bootstrap replicas, one row per
+        replica
+    :param str model: Key of :data:`MODELS`
+    :param int shift: Time extent that is passed to the model
+    :param list params: Fit parameters
+    :rtype: dict
+    '''
+    return {
+        'kind': 'correlator',
+        'val': np.mean(averages, axis=0),
+        'err': np.std(averages, axis=0),
+        'model': model,
+        'shift': shift,
+        'params': list(params),
+        'omit_pre': omit_pre,
+    }
+
+
+def effective_mass_figure(averages, shift=None):
+    '''
+    Describes the plot of the effective masses of the bootstrap replicas.
+
+    The effective masses of all replicas are computed in one pass from the
+    block of replica averages. If the time extent ``shift`` is given, the
+    exact periodic effective mass from
+    :func:`correlators.transform.effective_mass_periodic` is shown as well.
+
+    :rtype: dict
+    '''
+    m_eff = correlators.transform.effective_mass_cosh_block(averages)
+    figure = {
+        'kind': 'effective_mass',
+        'val': np.mean(m_eff, axis=0),
+        'err': np.std(m_eff, axis=0),
+        'periodic': None,
+    }
+
+    if shift is not None:
+        m_eff_periodic = correlators.transform.effective_mass_periodic(
+            averages, shift)
+        figure['periodic'] = (np.mean(m_eff_periodic, axis=0),
+                              np.std(m_eff_periodic, axis=0))
+
+    return figure
+
+
+def plot_correlator(figure, filename):
+    import matplotlib.backends.backend_agg
+    import matplotlib.figure
+
+    folded_val = figure['val']
+    folded_err = figure['err']
 
     time_folded = np.array(range(len(folded_val)))
 
@@ -42,21 +104,11 @@ def plot_correlator(sets, name, shift, offset=False):
     used_param = {'color': 'blue'}
     data_param = {'color': 'black'}
 
-    if offset:
-        fit_func = correlators.fit.cosh_fit_offset_decorator(shift)
-        p0 = [0.45, folded_val[0], 0]
-    else:
-        fit_func = correlators.fit.cosh_fit_decorator(shift)
-        p0 = [0.22, folded_val[0]]
-
-    try:
-        p = correlators.fit.fit_and_plot(ax2, fit_func, time_folded, folded_val,
-                                         folded_err, omit_pre=13, p0=p0,
-                                         fit_param=fit_param, used_param=used_param,
-                                         data_param=data_param)
-        print('Fit parameters folded (mass, amplitude, offset:', p)
-    except ValueError as e:
-        LOGGER.error('ValueError: %s', str(e))
+    fit_func = MODELS[figure['model']](figure['shift'])
+    correlators.fit.plot_fit(ax2, fit_func, time_folded, folded_val,
+                             folded_err, figure['params'],
+                             omit_pre=figure['omit_pre'], fit_param=fit_param,
+                             used_param=used_param, data_param=data_param)
 
     ax2.set_yscale('log')
     ax2.margins(0.05, tight=False)
@@ -66,13 +118,15 @@ def plot_correlator(sets, name, shift, offset=False):
     ax2.grid(True)
 
     canvas = matplotlib.backends.backend_agg.FigureCanvasAgg(fig_f)
-    canvas.print_figure('{}_folded.pdf'.format(name))
+    canvas.print_figure(filename)
 
 
-def plot_effective_mass(sets, name):
-    m_eff_val1, m_eff_err1 = correlators.bootstrap.bootstrap_pre_transform(
-        correlators.transform.effective_mass_cosh, sets
-    )
+def plot_effective_mass(figure, filename):
+    import matplotlib.backends.backend_agg
+    import matplotlib.figure
+
+    m_eff_val1 = figure['val']
+    m_eff_err1 = figure['err']
     time = np.arange(len(m_eff_val1)+2)
     time_cut = time[1:-1]
 
@@ -90,6 +144,14 @@ def plot_effective_mass(sets, name):
 
     ax2.errorbar(time_cut[8:], m_eff_val1[8:], yerr=m_eff_err1[8:],
                  linestyle='none', marker='+')
+
+    if figure['periodic'] is not None:
+        m_eff_periodic_val, m_eff_periodic_err = figure['periodic']
+        time_periodic = time[:-1] + 0.5
+        ax2.errorbar(time_periodic[8:], m_eff_periodic_val[8:],
+                     yerr=m_eff_periodic_err[8:], linestyle='none',
+                     marker='x', label='periodic')
+        ax2.legend(loc='best')
     # ax2.errorbar([max(time_cut[8:])], [0.22293], [0.00035], marker='+')
     ax2.set_xlabel(r'$t/a$')
     ax2.set_ylabel(r'$m_\mathrm{eff}(t)$')
@@ -97,4 +159,18 @@ def plot_effective_mass(sets, name):
     ax2.margins(0.05, 0.05)
 
     canvas = matplotlib.backends.backend_agg.FigureCanvasAgg(fig)
-    canvas.print_figure('{}_m_eff.pdf'.format(name))
+    canvas.print_figure(filename)
+
+
+RENDERERS = {
+    'correlator': plot_correlator,
+    'effective_mass': plot_effective_mass,
+}
+'Functions that draw a figure of the given kind into a file.'
+
+
+def render(figure, filename):
+    '''
+    Draws the figure described by the data into the file.
+    '''
+    RENDERERS[figure['kind']](figure, filename)
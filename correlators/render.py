@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+'''
+Rendering of the figures separate from the analysis.
+
+The analysis saves the data of every figure with :func:`save` into the
+``data`` folder of the plot directory. :func:`render_directory` later draws
+the figures next to it, in parallel processes. A figure is only drawn again if
+its data or the plotting code has changed since it was last drawn.
+'''
+
+from __future__ import division, absolute_import, print_function, \
+    unicode_literals
+
+import hashlib
+import inspect
+import logging
+import multiprocessing
+import os
+import pickle
+import tempfile
+
+import correlators.cache
+import correlators.fit
+import correlators.plot
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = 'plots'
+'Default location of the figures.'
+
+
+def _atomic_write(path, data):
+    directory = os.path.dirname(path)
+    correlators.cache._makedirs(directory)
+    handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'wb') as f:
+        f.write(data)
+    os.rename(temp, path)
+
+
+def save(directory, figures):
+    '''
+    Saves the data of the figures.
+
+    :param dict figures: Data of each figure by the name of its file without
+        extension
+    '''
+    for name, figure in sorted(figures.items()):
+        _atomic_write(os.path.join(directory, 'data', name + '.pickle'),
+                      pickle.dumps(figure, protocol=2))
+
+
+def _code_digest():
+    sha = hashlib.sha1()
+    for module in [correlators.plot, correlators.fit]:
+        sha.update(inspect.getsource(module).encode())
+    return sha.hexdigest()
+
+
+def _render_one(arguments):
+    directory, name, digest = arguments
+
+    with open(os.path.join(directory, 'data', name + '.pickle'), 'rb') as f:
+        figure = pickle.load(f)
+
+    correlators.plot.render(figure, os.path.join(directory, name + '.pdf'))
+    _atomic_write(os.path.join(directory, 'data', name + '.sha1'),
+                  digest.encode())
+
+    return name
+
+
+def _digest(directory, name, code_digest):
+    sha = hashlib.sha1(code_digest.encode())
+    with open(os.path.join(directory, 'data', name + '.pickle'), 'rb') as f:
+        sha.update(f.read())
+    return sha.hexdigest()
+
+
+def _up_to_date(directory, name, digest):
+    try:
+        with open(os.path.join(directory, 'data', name + '.sha1'), 'rb') as f:
+            stamp = f.read().decode()
+    except (IOError, OSError):
+        return False
+
+    return stamp == digest and \
+        os.path.exists(os.path.join(directory, name + '.pdf'))
+
+
+def render_directory(directory, jobs=1, force=False):
+    '''
+    Draws the figures whose data has changed.
+
+    :param int jobs: Number of processes that draw in parallel
+    :param bool force: Draw all figures
+    :returns: Names of the figures that have been drawn
+    :rtype: list
+    '''
+    data = os.path.join(directory, 'data')
+    if not os.path.isdir(data):
+        return []
+
+    names = [filename[:-len('.pickle')]
+             for filename in sorted(os.listdir(data))
+             if filename.endswith('.pickle')]
+
+    code_digest = _code_digest()
+    todo = []
+    for name in names:
+        digest = _digest(directory, name, code_digest)
+        if force or not _up_to_date(directory, name, digest):
+            todo.append((directory, name, digest))
+
+    LOGGER.info('Drawing %d figures, %d are up to date.', len(todo),
+                len(names) - len(todo))
+
+    if jobs == 1 or len(todo) <= 1:
+        return [_render_one(arguments) for arguments in todo]
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return pool.map(_render_one, todo)
+    finally:
+        pool.close()
+        pool.join()
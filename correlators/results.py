@@ -0,0 +1,239 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+'''
+Append-only store for the results with one binary file per column.
+
+Every row holds the results of one folder. Numeric values are stored as
+little endian 8-byte floats, everything else as one line of text per row. A
+column that appears later is filled with ``NaN`` or empty strings for the
+earlier rows, values missing in a row are filled the same way. If a label is
+appended more than once, the last row wins.
+
+The file ``schema.json`` lists the columns, their sizes in bytes and the number
+of complete rows. It is replaced atomically after the columns of a row have
+been appended. Data of an interrupted append is therefore ignored when loading
+and overwritten by the next append.
+'''
+
+from __future__ import division, absolute_import, print_function, \
+    unicode_literals
+
+import collections
+import json
+import numbers
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import correlators.cache
+
+
+FLOAT = np.dtype('<f8')
+INDEX = '__index__'
+
+
+def _read_schema(directory):
+    with open(os.path.join(directory, 'schema.json')) as f:
+        return json.load(f)
+
+
+def _write_schema(directory, schema):
+    handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'w') as f:
+        json.dump(schema, f, indent=1, sort_keys=True)
+    os.rename(temp, os.path.join(directory, 'schema.json'))
+
+
+def create(directory):
+    '''
+    Creates an empty store, an existing one is deleted.
+    '''
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    correlators.cache._makedirs(directory)
+    schema = {'rows': 0, 'columns': []}
+    _add_column(directory, schema, INDEX, 'str')
+    _write_schema(directory, schema)
+
+
+def _column_path(directory, column):
+    extension = '.f8' if column['type'] == 'f8' else '.txt'
+    return os.path.join(directory, column['file'] + extension)
+
+
+def _encode(column, value):
+    if column['type'] == 'f8':
+        if value is None or not _is_numeric(value):
+            value = np.nan
+        return np.array([value], dtype=FLOAT).tobytes()
+    else:
+        text = '' if value is None else '{}'.format(value)
+        return (text.replace('\n', ' ') + '\n').encode('utf-8')
+
+
+def _write_column(directory, column, data):
+    '''
+    Writes the data after the committed part of the column.
+    '''
+    path = _column_path(directory, column)
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        f.seek(column['size'])
+        f.truncate()
+        f.write(data)
+    column['size'] += len(data)
+
+
+def _add_column(directory, schema, name, type_):
+    column = {
+        'name': name,
+        'type': type_,
+        'file': 'c{:05d}'.format(len(schema['columns'])),
+        'size': 0,
+    }
+    schema['columns'].append(column)
+
+    # Fill the rows that have been written before.
+    _write_column(directory, column,
+                  _encode(column, None) * schema['rows'])
+
+    return column
+
+
+def _is_numeric(value):
+    return isinstance(value, (numbers.Number, np.number)) \
+        and not isinstance(value, (bool, np.bool_))
+
+
+def exists(directory):
+    '''
+    Tells whether there is a store in the directory.
+    '''
+    return os.path.exists(os.path.join(directory, 'schema.json'))
+
+
+def append(directory, name, series):
+    '''
+    Appends the results of one folder.
+
+    :param str name: Label of the row, for instance the ensemble
+    :param pd.Series series: Results
+    '''
+    schema = _read_schema(directory)
+    columns = dict((column['name'], column) for column in schema['columns'])
+
+    values = dict(series.items())
+    values[INDEX] = name
+
+    for key in series.index:
+        if key not in columns:
+            type_ = 'f8' if _is_numeric(values[key]) else 'str'
+            columns[key] = _add_column(directory, schema, key, type_)
+
+    for column in schema['columns']:
+        _write_column(directory, column,
+                      _encode(column, values.get(column['name'])))
+
+    schema['rows'] += 1
+    _write_schema(directory, schema)
+
+
+def load(directory, columns=None):
+    '''
+    Loads the store.
+
+    :param list columns: Names of the columns to load, all by default
+    :returns: One row per folder, the index are the labels
+    :rtype: pd.DataFrame
+    '''
+    import pandas as pd
+
+    schema = _read_schema(directory)
+    rows = schema['rows']
+
+    data = {}
+    for column in schema['columns']:
+        if columns is not None and column['name'] not in columns \
+           and column['name'] != INDEX:
+            continue
+        with open(_column_path(directory, column), 'rb') as f:
+            raw = f.read(column['size'])
+        if column['type'] == 'f8':
+            data[column['name']] = np.frombuffer(raw, dtype=FLOAT).copy()
+        else:
+            data[column['name']] = raw.decode('utf-8').split('\n')[:rows]
+
+    index = data.pop(INDEX)
+    names = [column['name'] for column in schema['columns']
+             if column['name'] in data]
+    table = pd.DataFrame(data, index=index, columns=names)
+    return table[~table.index.duplicated(keep='last')]
+
+
+def frame(rows):
+    '''
+    Builds the table from the results of the folders at once.
+
+    :param list rows: Label and :class:`pd.Series` of each folder
+    :returns: One row per label, the last results of a label win
+    :rtype: pd.DataFrame
+    '''
+    import pandas as pd
+
+    latest = collections.OrderedDict()
+    for name, series in rows:
+        latest.pop(name, None)
+        latest[name] = series
+
+    if len(latest) == 0:
+        return pd.DataFrame()
+
+    return pd.DataFrame(list(latest.values()), index=list(latest.keys()))
+
+
+def export_csv(directory, filename):
+    '''
+    Writes the store as a CSV file.
+    '''
+    load(directory).to_csv(filename)
+
+
+def deviation(approximate, reference, quantities=None):
+    '''
+    Compares results with those of a reference run.
+
+    Only the ensembles and the quantities with a ``_val`` column that both
+    tables have are compared, quantities without an error in the reference
+    are left out.
+
+    :param list quantities: Only compare these quantities, given without the
+        ``_val`` suffix, ``None`` for all
+
+    :returns: Difference of the central values in units of the reference
+        error, one row per ensemble and one column per quantity
+    :rtype: pd.DataFrame
+    '''
+    import pandas as pd
+
+    index = [name for name in approximate.index if name in reference.index]
+    names = [column[:-len('_val')] for column in approximate.columns
+             if column.endswith('_val') and column in reference.columns
+             and column[:-len('_val')] + '_err' in reference.columns]
+    if quantities is not None:
+        names = [name for name in names if name in quantities]
+
+    columns = collections.OrderedDict()
+    for name in names:
+        val = approximate.loc[index, name + '_val'].astype(float)
+        reference_val = reference.loc[index, name + '_val'].astype(float)
+        reference_err = reference.loc[index, name + '_err'].astype(float)
+        if not (reference_err > 0).any():
+            continue
+        columns[name] = (val - reference_val) / reference_err
+
+    return pd.DataFrame(columns, index=index)
@@ -6,27 +6,163 @@
 
 from __future__ import division, absolute_import, print_function, unicode_literals
 
+import logging
+
 import numpy as np
-import matplotlib.pyplot as pl
-import scipy.optimize as op
+
+import correlators.zeta
+
+
+LOGGER = logging.getLogger(__name__)
+
+C1 = -2.837297
+C2 = 6.375183
 
 
 def a0_intercept_generator(m, w, l):
     def a0_intercept(a0):
-        c1 = -2.837297
-        c2 = 6.375183
-
         return 2 * m - w - 4 * np.pi * a0 / (m * l**3) * (
-            1 + c1 * a0 / l + c2 * a0**2 / l**2
+            1 + C1 * a0 / l + C2 * a0**2 / l**2
         )
 
     return a0_intercept
 
-def compute_a0(m, w, l, fig=None, x=np.linspace(-5, 5, 100)):
-    a0_intercept = a0_intercept_generator(m, w, l)
-    a0 = op.newton(a0_intercept, 0)
 
-    if fig is not None:
+def solve_a0(m, w, l):
+    r'''
+    Solves the finite volume relation for the scattering length in closed form.
+
+    The relation in :func:`a0_intercept_generator` is a cubic polynomial in
+    :math:`a_0`. Normalized, it reads
+
+    .. math::
+
+        a_0^3 + \frac{c_1 L}{c_2} a_0^2 + \frac{L^2}{c_2} a_0
+        + \frac{[w - 2m] m L^5}{4 \pi c_2} = 0 \,.
+
+    It is solved with Cardano's formula for all elements at once. If the cubic
+    has three real roots, the one closest to the leading order solution
+    :math:`a_0 = - [w - 2m] m L^3 / [4\pi]` is the physical one. With the
+    actual values of :math:`c_1` and :math:`c_2` the cubic is monotonic, so
+    there always is exactly one real root.
+
+    Elements with a non-positive or non-finite mass, energy or length do not
+    have a physical root. They are flagged and the result is NaN there.
+
+    :param np.array m: Mass of the single particle
+    :param np.array w: Energy of the two particle state
+    :param np.array l: Spatial extent of the lattice
+    :returns: Scattering lengths and flags whether a physical root exists
+    :rtype: tuple(np.array, np.array)
+    '''
+    m, w, l = np.broadcast_arrays(*[np.asarray(v, dtype=float)
+                                    for v in (m, w, l)])
+
+    valid = np.isfinite(m) & np.isfinite(w) & np.isfinite(l) \
+        & (m > 0) & (l > 0)
+
+    with np.errstate(all='ignore'):
+        b = C1 * l / C2
+        c = l**2 / C2
+        d = (w - 2 * m) * m * l**5 / (4 * np.pi * C2)
+
+        leading_order = - (w - 2 * m) * m * l**3 / (4 * np.pi)
+
+        # Depressed cubic y^3 + p y + q = 0 with a0 = y - b/3.
+        p = c - b**2 / 3
+        q = 2 * b**3 / 27 - b * c / 3 + d
+        discriminant = (q / 2)**2 + (p / 3)**3
+
+        # One real root. The cube root with the larger magnitude is taken such
+        # that there is no cancellation.
+        sign = np.where(q >= 0, 1.0, -1.0)
+        u = np.cbrt(- q / 2 - sign * np.sqrt(np.abs(discriminant)))
+        single = np.where(u != 0, u - p / (3 * u), 0.0)
+
+        # Three real roots in trigonometric form.
+        radius = 2 * np.sqrt(np.abs(p) / 3)
+        angle = np.arccos(np.clip(3 * q / (p * radius), -1, 1)) / 3
+        triple = np.array([
+            radius * np.cos(angle - 2 * np.pi * k / 3)
+            for k in range(3)
+        ])
+        closest = np.argmin(np.abs(triple - b / 3 - leading_order), axis=0)
+        triple = np.choose(closest, triple)
+
+        a0 = np.where(discriminant >= 0, single, triple) - b / 3
+
+    valid &= np.isfinite(a0)
+    a0 = np.where(valid, a0, np.nan)
+
+    return a0, valid
+
+
+def solve_a0_luescher(m, w, l, settings=correlators.zeta.DEFAULT_SETTINGS):
+    r'''
+    Computes the scattering length from the full Lüscher relation.
+
+    The scattering momentum follows from :math:`w = 2 \sqrt{m^2 + p^2}`.
+    With :math:`q = pL / [2\pi]` the relation reads
+
+    .. math::
+
+        p \cot \delta_0(p) = \frac{2}{\sqrt\pi L} Z_{00}(1; q^2) \,.
+
+    To leading order in the effective range expansion,
+    :math:`p \cot \delta_0 = 1/a_0`. The sign convention is the same as in
+    :func:`solve_a0`, both agree for large volumes.
+
+    The zeta function is interpolated from a table, see
+    :func:`correlators.zeta.z00`, so this is cheap for all replicas at once.
+
+    :returns: Scattering lengths and flags whether a physical solution exists
+    :rtype: tuple(np.array, np.array)
+    '''
+    m, w, l = np.broadcast_arrays(*[np.asarray(v, dtype=float)
+                                    for v in (m, w, l)])
+
+    valid = np.isfinite(m) & np.isfinite(w) & np.isfinite(l) \
+        & (m > 0) & (l > 0)
+
+    with np.errstate(all='ignore'):
+        p_sq = (w / 2)**2 - m**2
+        q_sq = np.where(valid, p_sq * (l / (2 * np.pi))**2, np.nan)
+        z = correlators.zeta.z00(q_sq, settings)
+        a0 = np.sqrt(np.pi) * l / (2 * z)
+
+    valid &= np.isfinite(a0)
+    a0 = np.where(valid, a0, np.nan)
+
+    return a0, valid
+
+
+def compute_a0(m, w, l, fig=None, x=np.linspace(-5, 5, 100),
+               formula='expansion'):
+    '''
+    Computes the scattering length.
+
+    This works with scalars as well as with arrays of replicas. Flagged
+    elements are NaN.
+
+    :param str formula: Either ``expansion`` for the truncated expansion, see
+        :func:`solve_a0`, or ``luescher`` for the full relation, see
+        :func:`solve_a0_luescher`
+    '''
+    if formula == 'expansion':
+        a0, valid = solve_a0(m, w, l)
+    elif formula == 'luescher':
+        a0, valid = solve_a0_luescher(m, w, l)
+    else:
+        raise ValueError('Unknown formula `{}`.'.format(formula))
+    if not np.all(valid):
+        LOGGER.warning('No physical root for %d of %d elements.',
+                       np.sum(~valid), valid.size)
+
+    if a0.ndim == 0:
+        a0 = a0[()]
+
+    if fig is not None and formula == 'expansion':
+        a0_intercept = a0_intercept_generator(m, w, l)
         y = a0_intercept(x)
         fig.plot(x, y, color='blue', alpha=0.5)
         fig.plot([a0], [a0_intercept(a0)], linestyle='none', marker='.', color='black')
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+'''
+Distribution of the folders over several independent processes.
+
+The processes only need a shared directory. Every folder gets a key from its
+position in :func:`correlators.traversal.find_leaves` and its path. The
+results of each folder are written as a separate file into the directory and
+are combined with :func:`merge` in the end.
+
+The folders can either be split statically with :func:`in_shard` or taken
+from a queue. In the latter case a process claims a folder by creating the
+claim file exclusively, which is atomic on POSIX file systems and also on NFS
+version 3 and later. If a process dies, the claim file of its folder stays; it
+has to be deleted to process the folder again.
+'''
+
+from __future__ import division, absolute_import, print_function, \
+    unicode_literals
+
+import errno
+import hashlib
+import logging
+import os
+import pickle
+import socket
+import tempfile
+
+import correlators.cache
+import correlators.results
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def parse_shard(text):
+    '''
+    Parses a shard specification like ``2/8``.
+
+    :returns: Index of the shard, starting at zero, and number of shards
+    :rtype: tuple(int, int)
+    :raises ValueError: If the text is malformed or the index out of range
+    '''
+    index, count = [int(part) for part in text.split('/')]
+    if not 0 <= index < count:
+        raise ValueError('Shard index {} is not in [0, {}).'.format(index,
+                                                                    count))
+    return index, count
+
+
+def in_shard(position, shard):
+    '''
+    Tells whether the folder at the given position belongs to the shard.
+
+    :param tuple shard: Index and number of shards or ``None`` for all
+    '''
+    if shard is None:
+        return True
+    index, count = shard
+    return position % count == index
+
+
+def leaf_key(position, root):
+    '''
+    Computes the name of the files for a folder.
+
+    The position comes first such that sorting the keys restores the order of
+    the traversal.
+    '''
+    digest = hashlib.sha1(os.path.abspath(root).encode()).hexdigest()[:12]
+    return '{:05d}_{}'.format(position, digest)
+
+
+def claim(directory, key):
+    '''
+    Tries to claim a folder for this process.
+
+    :returns: Whether the claim has succeeded
+    :rtype: bool
+    '''
+    claims = os.path.join(directory, 'claims')
+    correlators.cache._makedirs(claims)
+
+    try:
+        handle = os.open(os.path.join(claims, key),
+                         os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            return False
+        raise
+
+    with os.fdopen(handle, 'w') as f:
+        f.write('{}:{}\n'.format(socket.gethostname(), os.getpid()))
+
+    return True
+
+
+def write_partial(directory, key, root, ensemble, series):
+    '''
+    Stores the results of one folder.
+
+    The file is written under a temporary name and then renamed, so the merge
+    never sees partial files.
+    '''
+    partials = os.path.join(directory, 'partials')
+    correlators.cache._makedirs(partials)
+
+    handle, temp = tempfile.mkstemp(dir=partials, suffix='.tmp')
+    with os.fdopen(handle, 'wb') as f:
+        pickle.dump((root, ensemble, series), f, protocol=2)
+    os.rename(temp, os.path.join(partials, key + '.pickle'))
+
+
+def read_partials(directory):
+    '''
+    Loads the results of all folders in the order of the traversal.
+
+    :returns: Key, folder, ensemble and results for each folder
+    :rtype: list
+    '''
+    partials = os.path.join(directory, 'partials')
+    entries = []
+    for filename in sorted(os.listdir(partials)):
+        if not filename.endswith('.pickle'):
+            continue
+        with open(os.path.join(partials, filename), 'rb') as f:
+            root, ensemble, series = pickle.load(f)
+        entries.append((filename[:-len('.pickle')], root, ensemble, series))
+
+    return entries
+
+
+def merge(directory, store=None):
+    '''
+    Combines the results of all folders into one table.
+
+    Folders that have been claimed but have no results are logged, their
+    processes probably died.
+
+    :param str store: Also append the results to this store from
+        :func:`correlators.results.create`
+    :returns: Results with one row per ensemble, like
+        :func:`correlators.traversal.handle_path`
+    :rtype: pd.DataFrame
+    '''
+    rows = []
+    keys = set()
+    for key, root, ensemble, series in read_partials(directory):
+        rows.append((ensemble, series))
+        if store is not None:
+            correlators.results.append(store, ensemble, series)
+        keys.add(key)
+
+    claims = os.path.join(directory, 'claims')
+    if os.path.isdir(claims):
+        for key in sorted(set(os.listdir(claims)) - keys):
+            LOGGER.warning('Folder `%s` has been claimed but has no results.',
+                           key)
+
+    LOGGER.info('Merged the results of %d folders.', len(keys))
+
+    return correlators.results.frame(rows)
@@ -10,6 +10,7 @@ from __future__ import division, absolute_import, print_function, \
 import numpy as np
 
 import correlators.bootstrap
+import correlators.kernels
 
 
 def effective_mass(data, delta_t=1):
@@ -23,12 +24,15 @@ def effective_mass(data, delta_t=1):
         m_\text{eff} := - \frac{1}{\Delta t}
         \ln\left(\frac{C(t + \Delta t)}{C(t)}\right)
 
+    The time is the last axis, so a block with one replica per row gives all
+    the curves at once.
+
     :param np.array data: Time series of correlation functions, :math:`C(t)`
     :param int delta_t: Number of elements to use as :math:`\Delta t`
     :returns: Effective mass
-    :rtype: float
+    :rtype: np.array
     '''
-    m = - np.log(data[delta_t:] / data[:-delta_t]) / delta_t
+    m = - np.log(data[..., delta_t:] / data[..., :-delta_t]) / delta_t
     return m
 
 
@@ -39,6 +43,140 @@ def effective_mass_cosh(sets, dt=1):
         \operatorname{arcosh} \left(\frac{C(t-1)+C(t+1)}{2C(t)}\right)
     '''
     val = correlators.bootstrap.average_arrays(sets)
-    frac = (val[:-2*dt] + val[2*dt:]) / val[dt:-dt] / 2
-    m_eff = np.arccosh(frac)
+    m_eff = correlators.kernels.effective_mass_cosh(val, dt)
     return m_eff
+
+
+def effective_mass_cosh_block(block, dt=1):
+    r'''
+    Computes the :math:`\cosh` effective mass of every row of a block.
+
+    In contrast to :func:`effective_mass_cosh` the rows are not averaged. Each
+    row is taken as one averaged correlator, for instance the averages of the
+    bootstrap replicas from
+    :func:`correlators.bootstrap.bootstrap_averages`.
+
+    :param np.array block: Correlators with shape ``(n_replicas, T)``
+    :returns: Effective masses with shape ``(n_replicas, T - 2 dt)``
+    :rtype: np.array
+    '''
+    return correlators.kernels.effective_mass_cosh(np.asarray(block), dt)
+
+
+def _log_cosh(x):
+    x = np.abs(x)
+    return x + np.log1p(np.exp(-2 * x)) - np.log(2)
+
+
+def effective_mass_periodic(block, shift, dt=1, tolerance=1e-12,
+                            max_iterations=50):
+    r'''
+    Computes the exact effective mass of a periodic correlator.
+
+    For a correlator :math:`C(t) \propto \cosh(m [T/2 - t])` on a lattice
+    with finite time extent :math:`T`, the effective mass at :math:`t` is the
+    solution of
+
+    .. math::
+
+        \frac{C(t)}{C(t + \Delta t)}
+        = \frac{\cosh(m [T/2 - t])}{\cosh(m [T/2 - t - \Delta t])} \,.
+
+    The logarithm of the right hand side is monotonic in :math:`m`. The
+    equations for all elements are solved at once with Newton's method, steps
+    that leave the current bracket are replaced by bisection. There is no
+    solution where the ratio is not larger than one, the result is NaN there.
+
+    :param np.array block: Folded correlators with time as the last axis, the
+        leading axes can be replicas
+    :param int shift: Time extent :math:`T`, as in
+        :func:`correlators.fit.cosh_fit_decorator`
+    :param int dt: Distance :math:`\Delta t` of the time slices
+    :returns: Effective masses, the time axis has ``dt`` elements less
+    :rtype: np.array
+    '''
+    block = np.asarray(block, dtype=float)
+    n = block.shape[-1]
+
+    with np.errstate(all='ignore'):
+        log_ratio = np.log(block[..., :n-dt] / block[..., dt:])
+
+    a = shift / 2 - np.arange(n - dt)
+    b = a - dt
+    a, b, log_ratio = np.broadcast_arrays(a, b, log_ratio)
+
+    valid = np.isfinite(log_ratio) & (log_ratio > 0) & (a > np.abs(b))
+
+    # As log cosh(x) lies between |x| - log 2 and |x|, the root cannot be
+    # larger than this bound.
+    with np.errstate(all='ignore'):
+        bound = (log_ratio + np.log(2)) / (a - np.abs(b))
+    low = np.zeros(a.shape)
+    high = np.where(valid, bound, 1.0)
+    m = np.where(valid, log_ratio / dt, 0.5)
+    m = np.clip(m, low, high)
+
+    for iteration in range(max_iterations):
+        value = _log_cosh(m * a) - _log_cosh(m * b) - log_ratio
+        derivative = a * np.tanh(m * a) - b * np.tanh(m * b)
+
+        low = np.where(value < 0, m, low)
+        high = np.where(value > 0, m, high)
+
+        with np.errstate(all='ignore'):
+            step = m - value / derivative
+        bisection = (step <= low) | (step >= high) | ~np.isfinite(step)
+        new = np.where(bisection, (low + high) / 2, step)
+
+        converged = np.abs(new - m) <= tolerance * np.maximum(np.abs(new), 1)
+        m = new
+        if np.all(converged | ~valid):
+            break
+
+    return np.where(valid, m, np.nan)
+
+
+def shifted_difference(stack, dt=1):
+    r'''
+    Computes the difference of the correlator and its time shifted version.
+
+    .. math::
+
+        \tilde C(t) = C(t) - C(t + \Delta t)
+
+    A constant offset in :math:`C(t)` cancels. The time is the last axis,
+    leading axes can be configurations or replicas. The result is described
+    by :func:`correlators.fit.sinh_fit_decorator`.
+
+    :param np.array stack: Correlators
+    :param int dt: Shift :math:`\Delta t`
+    :returns: Differences, the time axis has ``dt`` elements less
+    :rtype: np.array
+    '''
+    stack = np.asarray(stack)
+    return stack[..., :-dt] - stack[..., dt:]
+
+
+def ratio_periodic(c2, c4):
+    r'''
+    Computes the ratio of the four-point and the squared two-point function.
+
+    For folded correlators on a lattice with finite time extent, the simple
+    ratio :math:`C_4(t) / C_2(t)^2` is spoiled by the constant thermal
+    contribution. Taking differences of adjacent time slices removes it:
+
+    .. math::
+
+        R(t + 1/2) = \frac{C_4(t) - C_4(t+1)}{C_2(t)^2 - C_2(t+1)^2} \,.
+
+    This is described by :func:`correlators.fit.ratio_fit_decorator`. The time
+    is the last axis, leading axes can be replicas.
+
+    :param np.array c2: Folded two-point function
+    :param np.array c4: Folded four-point function
+    :returns: Ratio, the time axis has one element less
+    :rtype: np.array
+    '''
+    c2 = np.asarray(c2)
+    c4 = np.asarray(c4)
+    return (c4[..., :-1] - c4[..., 1:]) / (c2[..., :-1]**2 - c2[..., 1:]**2)
@@ -8,21 +8,43 @@ from __future__ import division, absolute_import, print_function, \
     unicode_literals
 
 import logging
+import multiprocessing
 import os
+import threading
+import time
 
-import pandas as pd
+import threadpoolctl
 
 import correlators.analysis
+import correlators.cache
+import correlators.checkpoint
+import correlators.kernels
+import correlators.loader
+import correlators.render
+import correlators.results
+import correlators.sharding
 
 
 LOGGER = logging.getLogger(__name__)
 
 
-def handle_path(path):
+BLAS_VARIABLES = [
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+]
+'Environment variables that limit the threads of the linear algebra libraries.'
+
+
+def find_leaves(path):
     '''
-    Performs the analysis of every folder below the given path.
+    Yields the folders below the given path that contain data.
+
+    The folders are visited in sorted order, so the order is the same in every
+    run.
     '''
-    all_results = pd.DataFrame()
     for root, dirs, files in os.walk(path):
         # Skip all folders which contain certains strings since they have a
         # different data format.
@@ -37,11 +59,218 @@ def handle_path(path):
                 LOGGER.warning('Empty directory as `%s`.', root)
                 continue
 
-            abspath = os.path.abspath(root)
-            ensemble, results = correlators.analysis.handle_path(root)
-            all_results[ensemble] = results
+            yield root
 
         else:
             dirs.sort()
 
-    return all_results
+
+def limit_threads(threads):
+    '''
+    Limits the number of threads that BLAS and OpenMP use in this process.
+
+    The workers of the pool are forked after NumPy has loaded its BLAS, which
+    has read the environment variables already. The limit is therefore set in
+    the loaded libraries with threadpoolctl_. The environment variables are
+    set as well for libraries that are loaded afterwards.
+
+    .. _threadpoolctl: https://github.com/joblib/threadpoolctl
+    '''
+    for variable in BLAS_VARIABLES:
+        os.environ[variable] = str(threads)
+
+    threadpoolctl.threadpool_limits(threads)
+
+
+def _init_worker(threads, backend, cache_directory, cache_max_bytes):
+    '''
+    Sets up a worker process like the parent process.
+    '''
+    limit_threads(threads)
+    correlators.kernels.set_backend(backend)
+    if cache_directory is not None:
+        correlators.cache.configure(cache_directory, cache_max_bytes)
+
+
+def _has_checkpoint(arguments):
+    '''
+    Tells whether :func:`_handle_leaf` will use a checkpoint for the folder.
+    '''
+    position, root, analysis_options, partial_dir, queue, checkpoint_dir = \
+        arguments
+    if checkpoint_dir is None or analysis_options.get('invalidate'):
+        return False
+
+    digest = correlators.checkpoint.key(root, analysis_options)
+    return correlators.checkpoint.exists(checkpoint_dir, digest)
+
+
+def prefetched(arguments, depth):
+    '''
+    Yields the arguments while the next folders are loaded in the background.
+
+    A thread loads the folders with :func:`correlators.loader.preload`. At
+    most ``depth`` folders are loaded ahead of the one that is analyzed, such
+    that the memory stays bounded. Folders with a checkpoint are skipped, see
+    :func:`_has_checkpoint`. If loading fails in the background, the folder
+    is loaded again when it is analyzed, which reports the error.
+
+    :param list arguments: Arguments for :func:`_handle_leaf`
+    :param int depth: Number of folders to load ahead
+    '''
+    slots = threading.Semaphore(depth + 1)
+    ready = [threading.Event() for argument in arguments]
+
+    def load():
+        for argument, event in zip(arguments, ready):
+            slots.acquire()
+            try:
+                if not _has_checkpoint(argument):
+                    correlators.loader.preload(argument[1])
+            except Exception as e:
+                LOGGER.debug('Prefetching `%s` failed: %s', argument[1], e)
+            event.set()
+
+    thread = threading.Thread(target=load)
+    thread.daemon = True
+    thread.start()
+
+    for argument, event in zip(arguments, ready):
+        event.wait()
+        yield argument
+        correlators.loader.discard_preloaded(argument[1])
+        slots.release()
+
+
+def _handle_leaf(arguments):
+    '''
+    Analyzes one folder, claiming it first in queue mode.
+
+    :returns: Ensemble and results or ``None`` if another process has claimed
+        the folder
+    '''
+    position, root, analysis_options, partial_dir, queue, checkpoint_dir = \
+        arguments
+    key = correlators.sharding.leaf_key(position, root)
+
+    # The figures are saved here, also when the checkpoint is used.
+    analysis_options = dict(analysis_options)
+    plot_dir = analysis_options.pop('plot_dir', None)
+
+    if queue and not correlators.sharding.claim(partial_dir, key):
+        LOGGER.info('Folder `%s` is claimed by another process.', root)
+        return None
+
+    result = None
+    if checkpoint_dir is not None:
+        digest = correlators.checkpoint.key(root, analysis_options)
+        # Invalidated stages have to run, the new results replace the
+        # checkpoint.
+        if not analysis_options.get('invalidate'):
+            result = correlators.checkpoint.load(checkpoint_dir, digest)
+        if result is not None:
+            LOGGER.info('Using the checkpoint of `%s`.', root)
+
+    if result is None:
+        start = time.time()
+        ensemble, results, figures = correlators.analysis.handle_path(
+            root, **analysis_options)
+        if checkpoint_dir is not None:
+            correlators.checkpoint.store(
+                checkpoint_dir, digest, root, ensemble, results, figures,
+                {'options': analysis_options,
+                 'manifest': correlators.checkpoint.manifest(root),
+                 'duration': time.time() - start})
+    else:
+        ensemble, results, figures = result
+
+    if plot_dir is not None:
+        correlators.render.save(plot_dir, figures)
+
+    if partial_dir is not None:
+        correlators.sharding.write_partial(partial_dir, key, root, ensemble,
+                                           results)
+
+    return ensemble, results
+
+
+def handle_path(path, jobs=1, shard=None, partial_dir=None, queue=False,
+                checkpoint_dir=None, prefetch=1, store=None,
+                **analysis_options):
+    '''
+    Performs the analysis of every folder below the given path.
+
+    Additional keyword arguments are passed on to
+    :func:`correlators.analysis.handle_path`, except for ``plot_dir``. The
+    data of the figures is saved there with :func:`correlators.render.save`,
+    also for folders whose checkpoint is used.
+
+    :param int jobs: Number of processes that analyze folders in parallel.
+        The cores are divided between them, each one gets a share of the BLAS
+        threads. The results are collected in the order of
+        :func:`find_leaves`, independent of which process finishes first.
+    :param tuple shard: Only analyze the folders of this shard, see
+        :func:`correlators.sharding.in_shard`
+    :param str partial_dir: Shared directory where the results of each folder
+        are written, to be combined with :func:`correlators.sharding.merge`
+    :param bool queue: Claim the folders in ``partial_dir`` before analyzing
+        them, such that several processes can work through the same tree
+    :param str checkpoint_dir: Store the results of every folder there as soon
+        as it is done and reuse them if nothing has changed, see
+        :mod:`correlators.checkpoint`
+    :param int prefetch: Number of folders that are loaded in the background
+        while a folder is analyzed, see :func:`prefetched`. This is only used
+        with a single process and without the queue.
+    :param str store: Append the results of every folder to this store from
+        :func:`correlators.results.create` as soon as they arrive
+    :returns: Results of the folders analyzed by this process, one row per
+        ensemble
+    :rtype: pd.DataFrame
+    '''
+    if queue and partial_dir is None:
+        raise ValueError('The queue needs a directory for the partial '
+                         'results.')
+
+    arguments = [
+        (position, root, analysis_options, partial_dir, queue, checkpoint_dir)
+        for position, root in enumerate(find_leaves(path))
+        if correlators.sharding.in_shard(position, shard)
+    ]
+
+    rows = []
+
+    def collect(result):
+        if result is not None:
+            rows.append(result)
+            if store is not None:
+                correlators.results.append(store, *result)
+
+    if jobs == 1:
+        if prefetch > 0 and not queue:
+            arguments = prefetched(arguments, prefetch)
+
+        for argument in arguments:
+            collect(_handle_leaf(argument))
+
+        return correlators.results.frame(rows)
+
+    threads = max(1, multiprocessing.cpu_count() // jobs)
+    LOGGER.info('Using %d processes with %d threads each.', jobs, threads)
+
+    pool = multiprocessing.Pool(
+        jobs, _init_worker,
+        (threads, correlators.kernels.get_backend())
+        + correlators.cache.get_configuration())
+    try:
+        for result in pool.imap(_handle_leaf, arguments):
+            collect(result)
+    except BaseException:
+        # Do not wait for the folders that are still queued.
+        pool.terminate()
+        pool.join()
+        raise
+
+    pool.close()
+    pool.join()
+
+    return correlators.results.frame(rows)
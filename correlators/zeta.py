@@ -0,0 +1,242 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+r'''
+Lüscher's zeta function :math:`Z_{00}(1; q^2)` for the center of mass frame.
+
+The function is defined by the analytic continuation of
+
+.. math::
+
+    Z_{00}(s; q^2) = \frac{1}{\sqrt{4\pi}} \sum_{n \in \mathbb Z^3}
+    [n^2 - q^2]^{-s}
+
+to :math:`s = 1`. Splitting the heat kernel representation at :math:`t = 1`
+and using the Poisson summation formula for the small :math:`t` part gives the
+exponentially convergent form
+
+.. math::
+
+    Z_{00}(1; q^2) = \frac{1}{\sqrt{4\pi}} \sum_n
+    \frac{e^{q^2 - n^2}}{n^2 - q^2} - \pi
+    + \frac\pi2 \int_0^1 \mathrm dt\, t^{-3/2}
+    \left[ e^{tq^2} - 1 + \sum_{m \neq 0} e^{tq^2 - \pi^2 m^2/t} \right] \,.
+
+The sums run over shells of equal :math:`n^2` with their multiplicities. The
+integral is done with Gauss-Legendre quadrature after substituting
+:math:`t = s^2`, which removes the singularity at :math:`t = 0`.
+
+The direct evaluation is costly, so :func:`z00` uses a table of the part
+without poles that is interpolated. The table is stored on disk and keyed by
+the accuracy settings.
+'''
+
+from __future__ import division, absolute_import, print_function, \
+    unicode_literals
+
+import hashlib
+import logging
+import math
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+import correlators.cache
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'n_sq_max': 36,
+    'm_sq_max': 9,
+    'quadrature_points': 64,
+    'q_sq_min': -1.5,
+    'q_sq_max': 3.5,
+    'table_points': 5001,
+}
+'Accuracy settings and range of the interpolation table.'
+
+_tables = {}
+
+
+def shell_multiplicities(n_sq_max):
+    r'''
+    Counts the vectors :math:`n \in \mathbb Z^3` on each shell of :math:`n^2`.
+
+    :param int n_sq_max: Largest :math:`n^2` to count
+    :returns: Multiplicities, the index is :math:`n^2`
+    :rtype: np.array
+    '''
+    r = int(math.floor(math.sqrt(n_sq_max)))
+    n = np.arange(-r, r + 1)
+    n_sq = (n[:, None, None]**2 + n[None, :, None]**2 + n[None, None, :]**2)
+    n_sq = n_sq.ravel()
+    return np.bincount(n_sq[n_sq <= n_sq_max], minlength=n_sq_max + 1)
+
+
+def _pole_free_term(k, q_sq):
+    r'''
+    Computes :math:`[e^{q^2 - k} - 1] / [k - q^2]`, which is finite at
+    :math:`q^2 = k`.
+    '''
+    x = q_sq - k
+    with np.errstate(all='ignore'):
+        result = - np.expm1(x) / x
+    return np.where(x == 0, -1.0, result)
+
+
+def _poles(settings):
+    '''
+    Shells whose poles are subtracted in the interpolation table.
+    '''
+    multiplicities = shell_multiplicities(settings['n_sq_max'])
+    low = max(0, int(math.floor(settings['q_sq_min'])) - 1)
+    high = int(math.ceil(settings['q_sq_max'])) + 1
+    return [k for k in range(low, high + 1) if multiplicities[k] > 0]
+
+
+def _pole_terms(q_sq, poles, multiplicities):
+    result = np.zeros_like(q_sq)
+    for k in poles:
+        result += multiplicities[k] / (k - q_sq)
+    return result / math.sqrt(4 * np.pi)
+
+
+def z00_direct(q_sq, settings=DEFAULT_SETTINGS, subtract_poles=()):
+    r'''
+    Evaluates :math:`Z_{00}(1; q^2)` directly for all elements of ``q_sq``.
+
+    :param np.array q_sq: Values of :math:`q^2`
+    :param dict settings: Accuracy settings, see :data:`DEFAULT_SETTINGS`
+    :param list subtract_poles: Shells :math:`k` whose pole
+        :math:`\nu_k / [\sqrt{4\pi} (k - q^2)]` is left out
+    :returns: Values of the zeta function
+    :rtype: np.array
+    '''
+    q_sq = np.asarray(q_sq, dtype=float)
+    flat = q_sq.ravel()
+
+    multiplicities = shell_multiplicities(settings['n_sq_max'])
+    result = np.zeros_like(flat)
+    for k, nu in enumerate(multiplicities):
+        if nu == 0:
+            continue
+        if k in subtract_poles:
+            result += nu * _pole_free_term(k, flat)
+        else:
+            result += nu * np.exp(flat - k) / (k - flat)
+    result /= math.sqrt(4 * np.pi)
+
+    # Integral with t = s^2, such that dt t^{-3/2} = 2 ds / s^2.
+    nodes, weights = np.polynomial.legendre.leggauss(
+        settings['quadrature_points'])
+    s = (nodes + 1) / 2
+    weights = weights / 2
+    t = s**2
+
+    tq_sq = t[:, np.newaxis] * flat[np.newaxis, :]
+    integrand = np.expm1(tq_sq)
+    dual_multiplicities = shell_multiplicities(settings['m_sq_max'])
+    for k, nu in enumerate(dual_multiplicities[1:], start=1):
+        if nu == 0:
+            continue
+        integrand += nu * np.exp(tq_sq - np.pi**2 * k / t[:, np.newaxis])
+    integrand *= 2 / s[:, np.newaxis]**2
+
+    result += np.pi / 2 * np.dot(weights, integrand) - np.pi
+
+    return result.reshape(q_sq.shape)
+
+
+def _settings_key(settings):
+    text = repr(sorted(settings.items()))
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def table(settings=DEFAULT_SETTINGS, directory=None):
+    '''
+    Loads or creates the interpolation table for the given settings.
+
+    The table contains :math:`Z_{00}` with the poles in its range subtracted,
+    which is a smooth function. It is kept in memory and stored on disk in the
+    given directory. The file is written under a temporary name and renamed,
+    such that processes that build the same table at the same time do not
+    read partial files. Damaged files are replaced.
+
+    :param dict settings: Accuracy settings, see :data:`DEFAULT_SETTINGS`
+    :param str directory: Directory for the table files, defaults to a
+        subdirectory of :data:`correlators.cache.DEFAULT_DIRECTORY`
+    :returns: Interpolating function of the smooth part and the subtracted
+        poles
+    '''
+    key = _settings_key(settings)
+    if key in _tables:
+        return _tables[key]
+
+    if directory is None:
+        directory = os.path.join(correlators.cache.DEFAULT_DIRECTORY, 'zeta')
+    filename = os.path.join(directory, 'z00_{}.npz'.format(key))
+
+    poles = _poles(settings)
+
+    try:
+        with np.load(filename) as data:
+            q_sq, smooth = data['q_sq'], data['smooth']
+    except (IOError, OSError, EOFError, KeyError, ValueError,
+            zipfile.BadZipfile):
+        LOGGER.info('Computing zeta function table `%s`.', filename)
+        q_sq = np.linspace(settings['q_sq_min'], settings['q_sq_max'],
+                           settings['table_points'])
+        smooth = z00_direct(q_sq, settings, subtract_poles=poles)
+        try:
+            correlators.cache._makedirs(directory)
+            handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(handle, 'wb') as f:
+                np.savez(f, q_sq=q_sq, smooth=smooth)
+            os.rename(temp, filename)
+        except (IOError, OSError) as e:
+            LOGGER.warning('Could not store zeta function table: %s', e)
+
+    import scipy.interpolate
+
+    interpolation = scipy.interpolate.interp1d(q_sq, smooth, kind='cubic',
+                                               assume_sorted=True)
+    _tables[key] = interpolation, poles
+
+    return _tables[key]
+
+
+def z00(q_sq, settings=DEFAULT_SETTINGS, directory=None):
+    r'''
+    Evaluates :math:`Z_{00}(1; q^2)` for all elements of ``q_sq`` at once.
+
+    Values within the range of the table are interpolated, the others are
+    evaluated directly with :func:`z00_direct`.
+
+    :param np.array q_sq: Values of :math:`q^2`
+    :param dict settings: Accuracy settings, see :data:`DEFAULT_SETTINGS`
+    :param str directory: Directory for the table, see :func:`table`
+    :returns: Values of the zeta function
+    :rtype: np.array
+    '''
+    q_sq = np.asarray(q_sq, dtype=float)
+    interpolation, poles = table(settings, directory)
+    multiplicities = shell_multiplicities(settings['n_sq_max'])
+
+    inside = (q_sq >= settings['q_sq_min']) & (q_sq <= settings['q_sq_max'])
+
+    result = np.empty_like(q_sq)
+    with np.errstate(divide='ignore'):
+        result[inside] = interpolation(q_sq[inside]) \
+            + _pole_terms(q_sq[inside], poles, multiplicities)
+    outside = ~inside & np.isfinite(q_sq)
+    if np.any(outside):
+        result[outside] = z00_direct(q_sq[outside], settings)
+    result[~np.isfinite(q_sq)] = np.nan
+
+    return result
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import unittest
+
+import numpy as np
+
+import correlators.bootstrap
+import correlators.corrfit
+import correlators.fit
+
+
+class TestWeightedCorrelationMatrix(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.stack = 10 * np.exp(-0.3 * np.arange(6)) \
+            * (1 + 0.05 * rng.normal(size=(20, 6)))
+
+    def test_single(self):
+        counts = correlators.bootstrap.generate_counts(20, 1, seed=1)[0]
+        sets = np.repeat(self.stack, counts, axis=0)
+        expected, expected_av = correlators.corrfit.correlation_matrix(sets)
+
+        matrix, average = correlators.corrfit.weighted_correlation_matrix(
+            self.stack, counts)
+
+        self.assertTrue(np.allclose(matrix, expected))
+        self.assertTrue(np.allclose(average, expected_av))
+
+    def test_batch(self):
+        counts = correlators.bootstrap.generate_counts(20, 5, seed=2)
+        matrices, averages = correlators.corrfit.weighted_correlation_matrix(
+            self.stack, counts)
+
+        self.assertEqual(matrices.shape, (5, 6, 6))
+        self.assertEqual(averages.shape, (5, 6))
+
+        for row, matrix, average in zip(counts, matrices, averages):
+            sets = np.repeat(self.stack, row, axis=0)
+            expected, expected_av = correlators.corrfit.correlation_matrix(sets)
+            self.assertTrue(np.allclose(matrix, expected))
+            self.assertTrue(np.allclose(average, expected_av))
+
+    def test_counts(self):
+        counts = correlators.bootstrap.generate_counts(20, 5, seed=3)
+        self.assertTrue(np.all(np.sum(counts, axis=1) == 20))
+
+        indices = correlators.bootstrap.generate_indices(20, 5, seed=3)
+        counts = correlators.bootstrap.indices_to_counts(indices, 20)
+        for row, count in zip(indices, counts):
+            self.assertEqual(list(count), list(np.bincount(row, minlength=20)))
+
+    def test_inverses(self):
+        indices = correlators.bootstrap.generate_indices(20, 4, seed=4)
+        counts = correlators.bootstrap.indices_to_counts(indices, 20)
+
+        inverses = correlators.corrfit.replica_inverse_correlation_matrices(
+            self.stack, counts, omit_pre=2)
+
+        self.assertEqual(len(inverses), 4)
+        for row, inverse in zip(indices, inverses):
+            expected = correlators.corrfit.inverse_correlation_matrix(
+                self.stack[row], omit_pre=2)
+            self.assertTrue(np.allclose(inverse, expected))
+
+        # With fewer configurations than time slices the matrix is singular.
+        inverses = correlators.corrfit.replica_inverse_correlation_matrices(
+            self.stack[:3], [[1, 1, 1]])
+        self.assertEqual(inverses, [None])
+
+
+class TestLeaveOneOut(unittest.TestCase):
+    def test_inverses(self):
+        rng = np.random.RandomState(4)
+        stack = 10 * np.exp(-0.3 * np.arange(5)) \
+            * (1 + 0.05 * rng.normal(size=(15, 5)))
+
+        results = correlators.corrfit.leave_one_out_inverse_correlation_matrices(
+            stack)
+
+        for k, (inv_cm, average) in enumerate(results):
+            sample = np.delete(stack, k, axis=0)
+            cm, expected_av = correlators.corrfit.correlation_matrix(sample)
+            self.assertTrue(np.allclose(inv_cm, np.linalg.inv(cm)))
+            self.assertTrue(np.allclose(average, expected_av))
+
+        self.assertEqual(k, len(stack) - 1)
+
+
+class TestJointFit(unittest.TestCase):
+    def setUp(self):
+        T = 48
+        self.time = np.arange(T // 2 + 1)
+        self.model = correlators.fit.joint_cosh_fit_decorator(
+            T, len(self.time) - 13)
+        self.params = [0.2, 3.0, 0.05, 9.0, 1e-6]
+
+        cosh_fit = correlators.fit.cosh_fit_decorator(T)
+        self.full2 = cosh_fit(self.time, 0.2, 3.0)
+        self.full4 = cosh_fit(self.time, 0.45, 9.0) + 1e-6
+
+        # Both correlators share a fluctuation per configuration, so the
+        # block correlation matrix has off-diagonal blocks.
+        rng = np.random.RandomState(5)
+        common = 1 + 0.01 * rng.normal(size=(80, 1))
+        self.sets2 = self.full2 * common \
+            * (1 + 0.005 * rng.normal(size=(80, 25)))
+        self.sets4 = self.full4 * common**2 \
+            * (1 + 0.005 * rng.normal(size=(80, 25)))
+
+    def test_model(self):
+        joined = self.model(np.concatenate([self.time[13:], self.time[13:]]),
+                            *self.params)
+        self.assertTrue(np.allclose(joined, np.concatenate([
+            self.full2[13:], self.full4[13:]])))
+
+    def test_inverse_block_matrix(self):
+        inv_cm = correlators.corrfit.joint_inverse_correlation_matrix(
+            [self.sets2, self.sets4], omit_pre=13)
+
+        joined = np.hstack([self.sets2[:, 13:], self.sets4[:, 13:]])
+        cm, average = correlators.corrfit.correlation_matrix(joined)
+
+        self.assertEqual(inv_cm.shape, (24, 24))
+        self.assertTrue(np.allclose(np.dot(inv_cm, cm), np.eye(24),
+                                    atol=1e-6))
+        self.assertFalse(np.allclose(cm[:12, 12:], 0))
+
+    def test_fit(self):
+        popt, chi_sq, p_value = correlators.corrfit.fit_joint(
+            self.model, self.time, [self.sets2, self.sets4], omit_pre=13,
+            p0=[0.21, 2.9, 0.04, 8.5, 0])
+
+        self.assertAlmostEqual(popt[0], 0.2, places=3)
+        self.assertAlmostEqual(popt[2], 0.05, places=2)
+        self.assertTrue(0 <= p_value <= 1)
+
+        inv_cm = correlators.corrfit.joint_inverse_correlation_matrix(
+            [self.sets2, self.sets4], omit_pre=13)
+        fixed, fixed_chi_sq, fixed_p_value = correlators.corrfit.fit_joint(
+            self.model, self.time, [self.sets2, self.sets4], omit_pre=13,
+            p0=[0.21, 2.9, 0.04, 8.5, 0], inv_cm=inv_cm)
+
+        self.assertTrue(np.allclose(fixed, popt, rtol=1e-4, atol=1e-8))
+        self.assertAlmostEqual(fixed_chi_sq, chi_sq, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+import correlators.client
+import correlators.daemon
+import correlators.loader
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.original = correlators.loader.folder_loader
+        self.loads = []
+
+        def fake_loader(path, combine=True):
+            self.loads.append(path)
+            T = 48
+            time = np.arange(T // 2 + 1)
+            c2 = 3 * (np.exp(-0.2 * time) + np.exp(-0.2 * (T - time)))
+            c4 = 9 * (np.exp(-0.45 * time) + np.exp(-0.45 * (T - time)))
+            rng = np.random.RandomState(len(self.loads))
+            two_points = [c2 * (1 + 0.01 * rng.randn(len(time)))
+                          for i in range(100)]
+            four_points = [c4 * (1 + 0.01 * rng.randn(len(time)))
+                           for i in range(100)]
+            return two_points, four_points, {'T': '48', 'L': '24',
+                                             'ensemble': 'A40.24'}
+
+        correlators.loader.folder_loader = fake_loader
+        correlators.daemon._ensembles.clear()
+
+    def tearDown(self):
+        correlators.loader.folder_loader = self.original
+        correlators.daemon._ensembles.clear()
+        correlators.daemon._max_bytes = correlators.daemon.DEFAULT_MAX_BYTES
+
+    def test_analyze_reuses_ensemble(self):
+        answer = correlators.daemon.handle({
+            'command': 'analyze', 'path': 'a', 'seed': 1, 'sample_count': 50})
+        self.assertTrue(answer['ok'])
+        result = answer['result']
+        self.assertEqual(result['names'], ['m_1', 'a_1'])
+        self.assertAlmostEqual(result['val'][0], 0.2, places=2)
+
+        answer = correlators.daemon.handle({
+            'command': 'analyze', 'path': 'a', 'seed': 1, 'sample_count': 50,
+            'correlator': 'c4', 'omit_pre': 5, 'covariance': 'fixed'})
+        self.assertTrue(answer['ok'])
+        self.assertAlmostEqual(answer['result']['val'][0], 0.45, places=2)
+        self.assertEqual(self.loads, ['a'])
+
+        status = correlators.daemon.handle({'command': 'status'})['result']
+        self.assertEqual(len(status['ensembles']), 1)
+        self.assertEqual(status['ensembles'][0]['replicas'], 1)
+
+    def test_random_seeds_are_not_kept(self):
+        for i in range(3):
+            answer = correlators.daemon.handle({
+                'command': 'analyze', 'path': 'a', 'sample_count': 20})
+            self.assertTrue(answer['ok'])
+            self.assertIsNotNone(answer['result']['seed'])
+
+        status = correlators.daemon.handle({'command': 'status'})['result']
+        self.assertEqual(status['ensembles'][0]['replicas'], 0)
+
+    def test_errors(self):
+        answer = correlators.daemon.handle({'command': 'analyze', 'path': 'a',
+                                            'correlator': 'c3'})
+        self.assertFalse(answer['ok'])
+        self.assertIn('c3', answer['error'])
+        self.assertFalse(correlators.daemon.handle({'command': 'x'})['ok'])
+
+    def test_lru_eviction(self):
+        entry = correlators.daemon.get_ensemble('a')
+        size = correlators.daemon._size(entry)
+        correlators.daemon._max_bytes = 2 * size
+
+        correlators.daemon.get_ensemble('b')
+        correlators.daemon.get_ensemble('a')
+        correlators.daemon.get_ensemble('c')
+
+        paths = [os.path.basename(key[0])
+                 for key in correlators.daemon._ensembles]
+        self.assertEqual(paths, ['a', 'c'])
+        self.assertLessEqual(correlators.daemon.memory_usage(),
+                             correlators.daemon._max_bytes)
+
+        correlators.daemon.get_ensemble('b')
+        self.assertEqual(self.loads, ['a', 'b', 'c', 'b'])
+
+    def test_socket(self):
+        directory = tempfile.mkdtemp()
+        socket_path = os.path.join(directory, 'socket')
+        thread = threading.Thread(target=correlators.daemon.serve,
+                                  args=(socket_path,))
+        thread.start()
+        try:
+            for i in range(100):
+                if os.path.exists(socket_path):
+                    break
+                time.sleep(0.05)
+
+            result = correlators.client.request(socket_path, {
+                'command': 'analyze', 'path': 'a', 'sample_count': 20})
+            self.assertEqual(result['ensemble'], 'A40.24')
+            with self.assertRaises(RuntimeError):
+                correlators.client.request(socket_path, {'command': 'x'})
+        finally:
+            correlators.client.request(socket_path, {'command': 'shutdown'})
+            thread.join()
+            shutil.rmtree(directory)
+
+        self.assertFalse(os.path.exists(socket_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
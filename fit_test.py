@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import unittest
+
+import numpy as np
+
+import correlators.corrfit
+import correlators.fit
+
+
+class TestGuessCoshParameters(unittest.TestCase):
+    def test_exact(self):
+        time = np.arange(25)
+        y = correlators.fit.cosh_fit_decorator(48)(time, 0.2, 3.0)
+
+        m, a = correlators.fit.guess_cosh_parameters(y, 48, omit_pre=13)
+        self.assertAlmostEqual(m, 0.2)
+        self.assertAlmostEqual(a, 3.0)
+
+        guess = correlators.fit.guess_cosh_parameters(y, 48, omit_pre=13,
+                                                      offset=True)
+        self.assertEqual(len(guess), 3)
+        self.assertEqual(guess[2], 0)
+
+    def test_undefined_in_window(self):
+        # The correlator is concave in the window, so there is no effective
+        # mass there.
+        time = np.arange(25)
+        y = correlators.fit.cosh_fit_decorator(48)(time, 0.2, 3.0)
+        y[15:] = y[15] * np.sqrt(1 + np.arange(10))
+
+        m, a = correlators.fit.guess_cosh_parameters(y, 48, omit_pre=16)
+        self.assertAlmostEqual(m, 0.2)
+        self.assertTrue(np.isfinite(a))
+
+
+class TestMultiCosh(unittest.TestCase):
+    def setUp(self):
+        self.time = np.arange(25)
+        self.model = correlators.fit.multi_cosh_fit_decorator(48, 2,
+                                                              offset=True)
+        self.params = np.array([0.22, 3.0, 0.8, 1.5, 1e-4])
+
+        rng = np.random.RandomState(1)
+        exact = self.model(self.time, *self.params)
+        self.err = 0.003 * exact
+        self.sets = exact + rng.normal(size=(50, 25)) * self.err
+
+    def test_jacobian(self):
+        eps = 1e-7
+        numeric = np.column_stack([
+            (self.model(self.time, *(self.params + eps * unit))
+             - self.model(self.time, *(self.params - eps * unit))) / (2 * eps)
+            for unit in np.eye(len(self.params))
+        ])
+        analytic = self.model.jacobian(self.time, *self.params)
+        self.assertTrue(np.allclose(numeric, analytic, rtol=1e-5, atol=1e-8))
+
+    def test_batch_matches_single_fits(self):
+        params, chi_sq = correlators.fit.fit_batch(
+            self.model, self.time, self.sets, self.err, omit_pre=2,
+            p0=self.params)
+
+        for popt, y in zip(params, self.sets[:5]):
+            single = correlators.fit.fit(self.model, self.time, y, self.err,
+                                         omit_pre=2, p0=self.params)
+            self.assertTrue(np.allclose(popt, single, rtol=1e-4, atol=1e-8))
+
+    def test_correlated_batch_matches_minimizer(self):
+        inv_cm = correlators.corrfit.inverse_correlation_matrix(self.sets,
+                                                                omit_pre=2)
+        popt, chi_sq, p_value = correlators.corrfit.fit(
+            self.model, self.time, self.sets, omit_pre=2, p0=self.params,
+            inv_cm=inv_cm)
+
+        params, chi_sqs = correlators.fit.fit_batch(
+            self.model, self.time, np.mean(self.sets, axis=0), omit_pre=2,
+            p0=self.params, inv_cm=inv_cm)
+
+        self.assertTrue(np.allclose(params[0], popt, rtol=1e-4, atol=1e-8))
+        self.assertAlmostEqual(chi_sqs[0], chi_sq, places=4)
+
+
+class TestBatchFailures(unittest.TestCase):
+    def setUp(self):
+        self.time = np.arange(25)
+        y = correlators.fit.cosh_fit_decorator(48)(self.time, 0.2, 3.0)
+        rng = np.random.RandomState(2)
+        self.err = 0.001 * y
+        self.sets = y * (1 + 0.001 * rng.normal(size=(20, 25)))
+        self.y = y
+
+    def test_more_states_than_data(self):
+        # The data has a single state, the amplitudes of the excited states
+        # go to zero and their columns of the Jacobian vanish.
+        for states, offset in [(2, False), (3, True)]:
+            model = correlators.fit.multi_cosh_fit_decorator(48, states,
+                                                             offset)
+            p0 = correlators.fit.guess_multi_cosh_parameters(
+                self.y, 48, states, omit_pre=3, offset=offset)
+
+            params, chi_sq = correlators.fit.fit_batch(
+                model, self.time, self.sets, self.err, omit_pre=3, p0=p0)
+
+            self.assertTrue(np.all(np.isfinite(chi_sq)))
+            self.assertTrue(np.allclose(params[:, 0], 0.2, atol=1e-2))
+
+    def test_failed_data_sets(self):
+        sets = self.sets.copy()
+        sets[3, 10] = np.nan
+        model = correlators.fit.multi_cosh_fit_decorator(48, 1)
+
+        params, chi_sq = correlators.fit.fit_batch(
+            model, self.time, sets, self.err, omit_pre=3, p0=[0.2, 3.0])
+
+        self.assertTrue(np.all(np.isnan(params[3])))
+        self.assertTrue(np.isnan(chi_sq[3]))
+        others = np.delete(params, 3, axis=0)
+        self.assertTrue(np.allclose(others[:, 0], 0.2, atol=1e-3))
+
+
+if __name__ == '__main__':
+    unittest.main()
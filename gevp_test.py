@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import unittest
+
+import numpy as np
+
+import correlators.fit
+import correlators.gevp
+
+
+class TestGEVP(unittest.TestCase):
+    def setUp(self):
+        self.T = 48
+        self.energies = [0.3, 0.9]
+        self.time = np.arange(self.T // 2 + 1)
+
+        cosh = correlators.fit.cosh_fit_decorator(self.T)
+        overlaps = np.array([[1.0, 0.6], [0.4, -0.8]])
+        states = np.array([cosh(self.time, e, 1) for e in self.energies])
+        self.matrix = np.einsum('in,jn,nt->ijt', overlaps, overlaps, states)
+        self.states = states
+
+        rng = np.random.RandomState(0)
+        noise = 1 + 1e-3 * rng.normal(size=(30, 1, 1, len(self.time)))
+        self.stack = self.matrix[np.newaxis] * noise
+
+    def test_exact_principal_correlators(self):
+        eigenvalues, eigenvectors = correlators.gevp.solve(self.matrix, t0=2)
+
+        for n in range(2):
+            expected = self.states[n] / self.states[n, 2]
+            self.assertTrue(np.allclose(eigenvalues[n], expected))
+
+    def test_assemble_symmetric(self):
+        elements = {
+            (0, 0): self.stack[:, 0, 0],
+            (0, 1): self.stack[:, 0, 1],
+            (1, 1): self.stack[:, 1, 1],
+        }
+        assembled = correlators.gevp.assemble(elements, 2)
+        self.assertEqual(assembled.shape, (30, 2, 2, len(self.time)))
+        self.assertTrue(np.allclose(assembled[:, 1, 0], self.stack[:, 0, 1]))
+
+    def test_replicas_fit(self):
+        central, replicas = correlators.gevp.principal_correlators(
+            self.stack, t0=2, sample_count=20, seed=1)
+        self.assertEqual(replicas.shape, (20, 2, len(self.time)))
+
+        model = correlators.fit.multi_cosh_fit_decorator(self.T, 1)
+        for n, energy in enumerate(self.energies):
+            p0 = correlators.fit.guess_cosh_parameters(central[n], self.T,
+                                                       omit_pre=3)
+            params, chi_sq = correlators.fit.fit_batch(
+                model, self.time, replicas[:, n], omit_pre=3, omit_post=2,
+                p0=p0)
+            self.assertTrue(np.allclose(params[:, 0], energy, atol=1e-2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+'''
+Measures the time to import the modules in a fresh interpreter.
+
+Running this file directly prints the import times, running it as a test
+checks that the compute path does not load the heavy libraries.
+'''
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+
+HEAVY = ['matplotlib', 'pandas', 'scipy', 'numba']
+
+MODULES = ['correlators.traversal', 'correlators.analysis',
+           'correlators.__main__', 'correlators.render']
+
+SNIPPET = '''
+import json, sys, time
+start = time.time()
+import {}
+print(json.dumps([time.time() - start, sorted(sys.modules)]))
+'''
+
+
+def measure(module, repeat=3):
+    '''
+    Imports the module in fresh interpreters.
+
+    :returns: Shortest time in seconds and the modules loaded by the import
+    '''
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.abspath(__file__))]
+        + environment.get('PYTHONPATH', '').split(os.pathsep))
+
+    times = []
+    for i in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', SNIPPET.format(module)], env=environment)
+        seconds, modules = json.loads(output.decode().splitlines()[-1])
+        times.append(seconds)
+
+    return min(times), modules
+
+
+def loaded_heavy(modules):
+    return [name for name in HEAVY if name in modules]
+
+
+class TestImports(unittest.TestCase):
+    def test_no_heavy_modules(self):
+        for module in MODULES:
+            seconds, modules = measure(module, repeat=1)
+            self.assertEqual(loaded_heavy(modules), [], module)
+
+    def test_worker_startup(self):
+        worker, modules = measure('correlators.traversal')
+        plotting, modules = measure('matplotlib.pyplot')
+        self.assertLess(worker, plotting)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['benchmark']:
+        for module in MODULES + HEAVY + ['matplotlib.pyplot']:
+            seconds, modules = measure(module)
+            print('{:25s} {:6.3f} s  {}'.format(
+                module, seconds, ' '.join(loaded_heavy(modules))))
+    else:
+        unittest.main()
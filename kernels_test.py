@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import correlators.corrfit
+import correlators.fit
+import correlators.kernels
+import correlators.loader
+import correlators.transform
+
+
+class TestKernels(unittest.TestCase):
+    '''
+    Compares every available backend with the NumPy reference.
+    '''
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.time = np.arange(25)
+        self.correlator = 3 * (np.exp(-0.2 * self.time)
+                               + np.exp(-0.2 * (48 - self.time))) \
+            * (1 + 0.01 * rng.normal(size=25))
+        sets = self.correlator * (1 + 0.01 * rng.normal(size=(30, 25)))
+        self.sets = list(sets)
+        cm, self.average = correlators.corrfit.correlation_matrix(sets)
+        self.inv_cm = np.linalg.inv(cm)
+
+    def tearDown(self):
+        correlators.kernels.set_backend('numpy')
+
+    def compute(self, backend):
+        correlators.kernels.set_backend(backend)
+        cosh_fit = correlators.fit.cosh_fit_decorator(48)
+        fit_estimate = cosh_fit(self.time, 0.21, 2.9)
+        return [
+            fit_estimate,
+            cosh_fit(self.time.astype(float), 0.21, 2.9),
+            correlators.corrfit.correlated_chi_square(
+                self.average, fit_estimate, self.inv_cm),
+            correlators.loader.fold_data(np.linspace(1., 2., 48)),
+            correlators.transform.effective_mass_cosh(self.sets),
+            correlators.transform.effective_mass_cosh(self.sets, dt=2),
+        ]
+
+    def test_backends(self):
+        expected = self.compute('numpy')
+        for backend in correlators.kernels.KERNELS:
+            for result, reference in zip(self.compute(backend), expected):
+                self.assertTrue(np.allclose(result, reference,
+                                            equal_nan=True))
+
+    @unittest.skipUnless('numba' in correlators.kernels.KERNELS,
+                         'Numba is not installed.')
+    def test_loaded_data(self):
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'C2_pi+-_conf0001.dat')
+        data = np.linspace(1., 2., 48)
+        (data + 0.5j).astype(np.complex128).tofile(filename)
+
+        correlators.kernels.set_backend('numba')
+        kernels = correlators.kernels.KERNELS['numba']
+        original = kernels['fold']
+        calls = []
+
+        def fold(val):
+            calls.append(val)
+            return original(val)
+
+        kernels['fold'] = fold
+        try:
+            loaded = correlators.loader.correlator_loader(filename)
+            folded = correlators.loader.fold_data(loaded)
+        finally:
+            kernels['fold'] = original
+            shutil.rmtree(directory)
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(np.allclose(
+            folded, correlators.kernels._fold_numpy(data.copy())))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            correlators.kernels.set_backend('fortran')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import shutil
+import tempfile
+import unittest
+
+import correlators.pipeline
+
+
+CALLS = []
+
+
+def source(value):
+    CALLS.append('source')
+    return value
+
+
+def parity(number):
+    CALLS.append('parity')
+    return number % 2
+
+
+def report(number, parity, label):
+    CALLS.append('report')
+    return '{} {} {}'.format(label, number, parity)
+
+
+def verdict(parity):
+    CALLS.append('verdict')
+    return 'odd' if parity else 'even'
+
+
+STAGES = [
+    correlators.pipeline.stage('source', source, [], ['value']),
+    correlators.pipeline.stage('parity', parity, ['source']),
+    correlators.pipeline.stage('report', report, ['source', 'parity'],
+                               ['label']),
+    correlators.pipeline.stage('verdict', verdict, ['parity']),
+]
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        del CALLS[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_pipeline(self, invalidate=(), **options):
+        del CALLS[:]
+        return correlators.pipeline.run(STAGES, options, self.directory,
+                                        invalidate)
+
+    def test_reuse(self):
+        outputs = self.run_pipeline(value=3, label='a')
+        self.assertEqual(outputs['report'], 'a 3 1')
+        self.assertEqual(CALLS, ['source', 'parity', 'report', 'verdict'])
+
+        outputs = self.run_pipeline(value=3, label='a')
+        self.assertEqual(outputs['report'], 'a 3 1')
+        self.assertEqual(CALLS, [])
+
+        self.run_pipeline(value=3, label='b')
+        self.assertEqual(CALLS, ['report'])
+
+    def test_invalidate(self):
+        self.run_pipeline(value=3, label='a')
+        self.run_pipeline(value=3, label='a', invalidate=['parity'])
+        self.assertEqual(CALLS, ['parity', 'report', 'verdict'])
+
+        self.assertRaises(ValueError, self.run_pipeline, value=3, label='a',
+                          invalidate=['unknown'])
+
+    def test_content_hash(self):
+        self.run_pipeline(value=3, label='a')
+        # The parity of the new value is the same, so the verdict is reused.
+        outputs = self.run_pipeline(value=5, label='a')
+        self.assertEqual(CALLS, ['source', 'parity', 'report'])
+        self.assertEqual(outputs['verdict'], 'odd')
+
+    def test_without_directory(self):
+        outputs = correlators.pipeline.run(STAGES, {'value': 2, 'label': 'c'})
+        self.assertEqual(outputs['report'], 'c 2 0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import correlators.plot
+import correlators.render
+
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        T = 48
+        time = np.arange(T // 2 + 1)
+        rng = np.random.RandomState(1)
+        central = correlators.plot.MODELS['cosh'](T)(time, 0.2, 3.0)
+        averages = central * (1 + 0.01 * rng.randn(50, len(time)))
+        self.figures = {
+            'c2_folded': correlators.plot.correlator_figure(
+                averages, 'cosh', T, [0.2, 3.0]),
+            'c2_m_eff': correlators.plot.effective_mass_figure(averages, T),
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_skip_unchanged(self):
+        correlators.render.save(self.directory, self.figures)
+        drawn = correlators.render.render_directory(self.directory, jobs=2)
+        self.assertEqual(sorted(drawn), ['c2_folded', 'c2_m_eff'])
+        for name in drawn:
+            self.assertTrue(os.path.exists(
+                os.path.join(self.directory, name + '.pdf')))
+
+        correlators.render.save(self.directory, self.figures)
+        self.assertEqual(correlators.render.render_directory(self.directory),
+                         [])
+
+        self.figures['c2_folded']['params'] = [0.21, 3.0]
+        correlators.render.save(self.directory, self.figures)
+        self.assertEqual(correlators.render.render_directory(self.directory),
+                         ['c2_folded'])
+
+        os.remove(os.path.join(self.directory, 'c2_m_eff.pdf'))
+        self.assertEqual(correlators.render.render_directory(self.directory),
+                         ['c2_m_eff'])
+
+
+if __name__ == '__main__':
+    unittest.main()
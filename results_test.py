@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import correlators.results
+
+
+class TestResults(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = os.path.join(self.directory, 'results')
+        correlators.results.create(self.store)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        first = pd.Series([0.5, 1.25, '24'], index=['a_val', 'a_err', 'L'])
+        second = pd.Series([0.75, 2.0, '32', 3.0],
+                           index=['a_val', 'a_err', 'L', 'ratio__a_val'])
+        correlators.results.append(self.store, 'A40.24', first)
+        correlators.results.append(self.store, 'A40.32', second)
+
+        table = correlators.results.load(self.store)
+
+        self.assertEqual(list(table.index), ['A40.24', 'A40.32'])
+        self.assertEqual(list(table.columns),
+                         ['a_val', 'a_err', 'L', 'ratio__a_val'])
+        self.assertEqual(table['a_val'].dtype, np.float64)
+        self.assertEqual(list(table['L']), ['24', '32'])
+        self.assertTrue(np.isnan(table.loc['A40.24', 'ratio__a_val']))
+        self.assertEqual(table.loc['A40.32', 'ratio__a_val'], 3.0)
+
+        in_memory = correlators.results.frame([('A40.24', first),
+                                               ('A40.32', second)])
+        self.assertEqual(list(in_memory.index), list(table.index))
+        np.testing.assert_array_equal(in_memory['a_err'].astype(float),
+                                      table['a_err'])
+
+        subset = correlators.results.load(self.store, columns=['a_err'])
+        self.assertEqual(list(subset.columns), ['a_err'])
+
+    def test_last_row_wins(self):
+        correlators.results.append(self.store, 'A', pd.Series({'x': 1.0}))
+        correlators.results.append(self.store, 'B', pd.Series({'x': 2.0}))
+        correlators.results.append(self.store, 'A', pd.Series({'x': 3.0}))
+
+        table = correlators.results.load(self.store)
+        self.assertEqual(list(table.index), ['B', 'A'])
+        self.assertEqual(list(table['x']), [2.0, 3.0])
+
+    def test_deviation(self):
+        reference = pd.DataFrame({'a_val': [1.0, 2.0, 3.0],
+                                  'a_err': [0.5, 0.5, 0.5],
+                                  'b_val': [1.0, 1.0, 1.0],
+                                  'b_err': [0.0, 0.0, 0.0]},
+                                 index=['A', 'B', 'C'])
+        approximate = pd.DataFrame({'a_val': [2.0, 1.0, 9.0],
+                                    'a_err': [1.0, 1.0, 1.0],
+                                    'b_val': [2.0, 2.0, 2.0]},
+                                   index=['B', 'A', 'D'])
+
+        deviation = correlators.results.deviation(approximate, reference)
+
+        self.assertEqual(list(deviation.index), ['B', 'A'])
+        self.assertEqual(list(deviation.columns), ['a'])
+        self.assertEqual(list(deviation['a']), [0.0, 0.0])
+
+        approximate.loc['A', 'a_val'] = 0.0
+        deviation = correlators.results.deviation(approximate, reference)
+        self.assertEqual(deviation.loc['A', 'a'], -2.0)
+
+        deviation = correlators.results.deviation(approximate, reference,
+                                                  ['b'])
+        self.assertEqual(list(deviation.columns), [])
+
+    def test_interrupted_append(self):
+        correlators.results.append(self.store, 'A', pd.Series({'x': 1.0}))
+
+        # Columns are written before the number of rows, so an interrupted
+        # append leaves trailing data that has to be ignored.
+        with open(os.path.join(self.store, 'c00001.f8'), 'ab') as f:
+            np.array([2.0]).tofile(f)
+
+        table = correlators.results.load(self.store)
+        self.assertEqual(list(table['x']), [1.0])
+
+        correlators.results.append(self.store, 'B', pd.Series({'x': 4.0}))
+        self.assertEqual(list(correlators.results.load(self.store)['x']),
+                         [1.0, 4.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
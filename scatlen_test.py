@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import scipy.optimize as op
+
+import correlators.scatlen
+import correlators.zeta
+
+
+class TestSolveA0(unittest.TestCase):
+    def test_newton(self):
+        rng = np.random.RandomState(0)
+        m = rng.uniform(0.1, 0.3, 50)
+        w = 2 * m + rng.uniform(-0.005, 0.03, 50)
+        l = rng.choice([20, 24, 32], 50)
+
+        a0, valid = correlators.scatlen.solve_a0(m, w, l)
+
+        self.assertTrue(np.all(valid))
+        for m_i, w_i, l_i, a0_i in zip(m, w, l, a0):
+            expected = op.newton(
+                correlators.scatlen.a0_intercept_generator(m_i, w_i, l_i), 0)
+            self.assertAlmostEqual(a0_i, expected)
+
+    def test_invalid(self):
+        a0, valid = correlators.scatlen.solve_a0([0.2, -0.2, np.nan],
+                                                 [0.41, 0.41, 0.41], 24)
+        self.assertEqual(list(valid), [True, False, False])
+        self.assertTrue(np.isfinite(a0[0]))
+        self.assertTrue(np.all(np.isnan(a0[1:])))
+
+    def test_scalar(self):
+        a0 = correlators.scatlen.compute_a0(0.22, 0.45, 24)
+        self.assertTrue(np.isscalar(a0))
+
+
+class TestZeta(unittest.TestCase):
+    def setUp(self):
+        # The table is built in a temporary directory instead of the cache of
+        # the user. It is kept in memory for the calls of zeta.z00.
+        self.directory = tempfile.mkdtemp()
+        correlators.zeta._tables.clear()
+        correlators.zeta.table(directory=self.directory)
+
+    def tearDown(self):
+        correlators.zeta._tables.clear()
+        shutil.rmtree(self.directory)
+
+    def test_damaged_table(self):
+        settings = dict(correlators.zeta.DEFAULT_SETTINGS, table_points=101)
+        files = set(os.listdir(self.directory))
+        correlators.zeta.table(settings, self.directory)
+        filename, = set(os.listdir(self.directory)) - files
+        path = os.path.join(self.directory, filename)
+        with open(path, 'rb') as f:
+            data = f.read()
+        with np.load(path) as table:
+            smooth = table['smooth']
+
+        for damaged in [data[:len(data) // 2], b'', b'garbage']:
+            with open(path, 'wb') as f:
+                f.write(damaged)
+            correlators.zeta._tables.clear()
+            correlators.zeta.table(settings, self.directory)
+
+            self.assertEqual(set(os.listdir(self.directory)) - files,
+                             set([filename]))
+            with np.load(path) as table:
+                self.assertTrue(np.array_equal(table['smooth'], smooth))
+
+    def test_threshold(self):
+        # Regular part at q^2 = 0 is -8.91363292 / sqrt(4 pi).
+        q_sq = 1e-6
+        z = correlators.zeta.z00_direct(q_sq) + 1 / (np.sqrt(4 * np.pi) * q_sq)
+        self.assertAlmostEqual(z, -8.91363292 / np.sqrt(4 * np.pi), places=4)
+
+    def test_table(self):
+        q_sq = np.linspace(-1.4, 3.4, 97)
+        self.assertTrue(np.allclose(correlators.zeta.z00(q_sq),
+                                    correlators.zeta.z00_direct(q_sq)))
+
+    def test_large_volume(self):
+        m = np.array([0.22, 0.14])
+        w = np.array([0.4405, 0.2804])
+        l = np.array([48, 64])
+        expansion, valid = correlators.scatlen.solve_a0(m, w, l)
+        luescher, valid = correlators.scatlen.solve_a0_luescher(m, w, l)
+        self.assertTrue(np.allclose(expansion, luescher, rtol=1e-2))
+
+
+if __name__ == '__main__':
+    unittest.main()
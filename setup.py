@@ -26,7 +26,11 @@ setup(
         'matplotlib',
         'numpy',
         'scipy',
+        'threadpoolctl',
     ],
+    extras_require={
+        'jit': ['numba'],
+    },
     url="https://github.com/martin-ueding/mu-correlators",
     #download_url="http://martin-ueding.de/download/PROJECT/",
     version="0.1",
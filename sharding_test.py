@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import correlators.sharding
+
+
+# Runs the traversal in queue mode with an analysis that only records which
+# folder it has seen.
+WORKER = '''
+import sys
+import time
+
+import pandas as pd
+
+import correlators.analysis
+import correlators.traversal
+
+
+def fake_analysis(path, **options):
+    time.sleep(0.05)
+    name = path.split('/')[-1]
+    return name, pd.Series({'name': name, 'pid': str(sys.argv[3])}), {}
+
+
+correlators.analysis.handle_path = fake_analysis
+correlators.traversal.handle_path(sys.argv[1], partial_dir=sys.argv[2],
+                                  queue=True)
+'''
+
+
+class TestSharding(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tree = os.path.join(self.directory, 'tree')
+        self.names = ['leaf{:02d}'.format(i) for i in range(12)]
+        for name in self.names:
+            os.makedirs(os.path.join(self.tree, name))
+            with open(os.path.join(self.tree, name, 'data'), 'w') as f:
+                f.write('')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_shard(self):
+        self.assertEqual(correlators.sharding.parse_shard('2/8'), (2, 8))
+        self.assertRaises(ValueError, correlators.sharding.parse_shard, '8/8')
+
+        positions = range(10)
+        shards = [[p for p in positions
+                   if correlators.sharding.in_shard(p, (i, 3))]
+                  for i in range(3)]
+        self.assertEqual(sorted(sum(shards, [])), list(positions))
+
+    def test_claim_once(self):
+        self.assertTrue(correlators.sharding.claim(self.directory, 'a'))
+        self.assertFalse(correlators.sharding.claim(self.directory, 'a'))
+
+    def test_queue_with_processes(self):
+        partial_dir = os.path.join(self.directory, 'partials')
+        environment = dict(os.environ)
+        environment['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(os.path.abspath(__file__))]
+            + environment.get('PYTHONPATH', '').split(os.pathsep))
+
+        processes = [
+            subprocess.Popen([sys.executable, '-c', WORKER, self.tree,
+                              partial_dir, str(i)], env=environment)
+            for i in range(4)
+        ]
+        for process in processes:
+            self.assertEqual(process.wait(), 0)
+
+        merged = correlators.sharding.merge(partial_dir)
+        self.assertEqual(list(merged.index), self.names)
+        self.assertEqual(list(merged['name']), self.names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import unittest
+
+import numpy as np
+
+import correlators.fit
+import correlators.transform
+
+
+class TestEffectiveMass(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        self.time = np.arange(25)
+        self.exact = correlators.fit.cosh_fit_decorator(48)(self.time, 0.2,
+                                                            3.0)
+        self.block = self.exact * (1 + 0.05 * rng.normal(size=(20, 25)))
+
+    def test_block_matches_rows(self):
+        for dt in [1, 2]:
+            m_eff = correlators.transform.effective_mass_cosh_block(
+                self.block, dt)
+            self.assertEqual(m_eff.shape, (20, 25 - 2 * dt))
+            for row, expected in zip(self.block, m_eff):
+                single = correlators.transform.effective_mass_cosh([row], dt)
+                self.assertTrue(np.allclose(single, expected,
+                                            equal_nan=True))
+
+        # The noise makes some of the correlators convex.
+        self.assertTrue(np.any(np.isnan(m_eff)))
+
+    def test_periodic_exact(self):
+        for m in [0.05, 0.2, 1.5]:
+            for dt in [1, 2]:
+                y = correlators.fit.cosh_fit_decorator(48)(self.time, m, 3.0)
+                m_eff = correlators.transform.effective_mass_periodic(
+                    [y, 2 * y], 48, dt)
+                self.assertEqual(m_eff.shape, (2, 25 - dt))
+                finite = np.isfinite(m_eff)
+                self.assertTrue(np.all(finite[:, :24 - dt]))
+                self.assertTrue(np.allclose(m_eff[finite], m, rtol=1e-10))
+
+    def test_periodic_no_solution(self):
+        y = self.exact.copy()
+        y[10] = y[11]
+        y[15] = 0.5 * y[16]
+        y[20] = -y[20]
+
+        m_eff = correlators.transform.effective_mass_periodic(y, 48)
+
+        self.assertTrue(np.all(np.isnan(m_eff[[10, 15, 19, 20]])))
+        self.assertTrue(np.allclose(m_eff[:9], 0.2))
+
+
+class TestRatio(unittest.TestCase):
+    def test_exact(self):
+        T, m, delta_e, a2, a4 = 48, 0.2, 0.05, 3.0, 9.0
+        time = np.arange(25)
+        cosh_fit = correlators.fit.cosh_fit_decorator(T)
+        c2 = cosh_fit(time, m, a2)
+        c4 = cosh_fit(time, 2 * m + delta_e, a4) + 0.3
+
+        ratio = correlators.transform.ratio_periodic([c2, 2 * c2],
+                                                     [c4, 4 * c4])
+
+        # The constant factor of the differences of both correlators.
+        e4 = 2 * m + delta_e
+        a = a4 * np.exp(-e4 * T / 2) * np.sinh(e4 / 2) \
+            / (a2**2 * np.exp(-m * T) * np.sinh(m))
+        ratio_fit = correlators.fit.ratio_fit_decorator(T, m)
+        self.assertEqual(ratio.shape, (2, 24))
+        self.assertTrue(np.allclose(ratio[0], ratio[1]))
+        self.assertTrue(np.allclose(ratio[0], ratio_fit(time[:-1], a,
+                                                        delta_e)))
+
+
+class TestShiftedDifference(unittest.TestCase):
+    def test_offset_cancels(self):
+        time = np.arange(25)
+        cosh_fit = correlators.fit.cosh_fit_offset_decorator(48)
+        sinh_fit = correlators.fit.sinh_fit_decorator(48)
+        stack = np.array([cosh_fit(time, 0.45, 2.0, offset)
+                          for offset in [0, 1e-3, 0.5]])
+
+        shifted = correlators.transform.shifted_difference(stack)
+
+        self.assertEqual(shifted.shape, (3, 24))
+        for row in shifted:
+            self.assertTrue(np.allclose(row, sinh_fit(time[:-1], 0.45, 2.0)))
+
+    def test_sinh_form(self):
+        x = np.arange(10)
+        m, a, dt, T = 0.3, 1.5, 2, 48
+        sinh_fit = correlators.fit.sinh_fit_decorator(T, dt)
+        expected = 4 * a * np.exp(-m * T / 2) * np.sinh(m * dt / 2) \
+            * np.sinh(m * (T / 2 - x - dt / 2))
+        self.assertTrue(np.allclose(sinh_fit(x, m, a), expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
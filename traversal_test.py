@@ -0,0 +1,232 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2015 Martin Ueding <dev@martin-ueding.de>
+# Licensed under The GNU Public License Version 2
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+import pandas as pd
+import threadpoolctl
+
+import correlators.analysis
+import correlators.loader
+import correlators.traversal
+
+
+def fake_analysis(path, **analysis_options):
+    '''
+    Stands in for the analysis of a folder, later folders finish first.
+    '''
+    name = os.path.basename(path)
+    if name == 'failing':
+        raise RuntimeError('Cannot analyze `{}`.'.format(path))
+    time.sleep(analysis_options['durations'][name])
+    return name, pd.Series({'x': float(name[-1])}), {}
+
+
+def blas_analysis(path, **analysis_options):
+    '''
+    Stands in for the analysis of a folder and reports the BLAS threads.
+    '''
+    threads = [library['num_threads']
+               for library in threadpoolctl.threadpool_info()
+               if library['user_api'] == 'blas']
+    return os.path.basename(path), pd.Series({'threads': max(threads)}), {}
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.original = correlators.loader.correlator_loader
+        self.original_analysis = correlators.analysis.handle_path
+        self.loads = []
+
+        def fake_loader(filename):
+            self.loads.append((os.path.dirname(filename),
+                               threading.current_thread().name))
+            return np.ones(48)
+
+        def load_analysis(path, **analysis_options):
+            correlators.loader.folder_loader(path)
+            return os.path.basename(path), pd.Series({'x': 1.0}), {}
+
+        correlators.loader.correlator_loader = fake_loader
+        correlators.analysis.handle_path = load_analysis
+
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint_dir = tempfile.mkdtemp()
+        self.leaves = []
+        for i in range(6):
+            leaf = os.path.join(
+                self.directory, 'A40.24_L24_T48_beta190_mul0040_musig150_'
+                'mudel190_kappa1632550_{}'.format(i))
+            os.makedirs(leaf)
+            for filename in ['C2_pi+-_conf0001.dat', 'C4_1_conf0001.dat',
+                             'C4_2_conf0001.dat', 'C4_3_conf0001.dat']:
+                with open(os.path.join(leaf, filename), 'w') as f:
+                    f.write(filename)
+            self.leaves.append(leaf)
+
+    def tearDown(self):
+        correlators.loader.correlator_loader = self.original
+        correlators.analysis.handle_path = self.original_analysis
+        correlators.loader._preloaded.clear()
+        shutil.rmtree(self.directory)
+        shutil.rmtree(self.checkpoint_dir)
+
+    def loaded_folders(self):
+        return sorted(set(path for path, name in self.loads))
+
+    def test_bounded_background_loading(self):
+        arguments = [(i, leaf, {}, None, False, None)
+                     for i, leaf in enumerate(self.leaves)]
+
+        seen = []
+        for argument in correlators.traversal.prefetched(arguments, 2):
+            two_points, four_points, parameters = \
+                correlators.loader.folder_loader(argument[1])
+            self.assertEqual(len(two_points), 1)
+            self.assertEqual(len(four_points), 1)
+            self.assertLessEqual(len(correlators.loader._preloaded), 2)
+            seen.append(argument[1])
+
+        self.assertEqual(seen, self.leaves)
+        self.assertEqual(self.loaded_folders(), self.leaves)
+        self.assertEqual(len(self.loads), 6 * 4)
+        main = threading.current_thread().name
+        self.assertTrue(all(name != main for path, name in self.loads))
+        self.assertEqual(correlators.loader._preloaded, {})
+
+    def test_checkpoints_are_not_prefetched(self):
+        def run_traversal(**analysis_options):
+            del self.loads[:]
+            correlators.traversal.handle_path(
+                self.directory, prefetch=2, checkpoint_dir=self.checkpoint_dir,
+                **analysis_options)
+            return self.loaded_folders()
+
+        self.assertEqual(run_traversal(seed=1), self.leaves)
+        self.assertEqual(run_traversal(seed=1), [])
+        self.assertEqual(run_traversal(seed=1, invalidate=['fit']),
+                         self.leaves)
+        self.assertEqual(correlators.loader._preloaded, {})
+
+
+class TestCheckpoints(unittest.TestCase):
+    def setUp(self):
+        self.original = correlators.analysis.handle_path
+        self.analyzed = []
+
+        def count_analysis(path, **analysis_options):
+            self.analyzed.append(path)
+            return os.path.basename(path), pd.Series({'x': 1.0}), \
+                {'leaf_c2_folded': {'path': path}}
+
+        correlators.analysis.handle_path = count_analysis
+        self.directory = tempfile.mkdtemp()
+        self.leaf = os.path.join(self.directory, 'data', 'leaf')
+        os.makedirs(self.leaf)
+        with open(os.path.join(self.leaf, 'data'), 'w') as f:
+            f.write('data')
+
+    def tearDown(self):
+        correlators.analysis.handle_path = self.original
+        shutil.rmtree(self.directory)
+
+    def run_traversal(self, **analysis_options):
+        correlators.traversal.handle_path(
+            os.path.join(self.directory, 'data'), prefetch=0,
+            checkpoint_dir=os.path.join(self.directory, 'checkpoints'),
+            **analysis_options)
+        return len(self.analyzed)
+
+    def test_invalidate_bypasses_checkpoint(self):
+        self.assertEqual(self.run_traversal(seed=1), 1)
+        self.assertEqual(self.run_traversal(seed=1), 1)
+        self.assertEqual(self.run_traversal(
+            seed=1, plot_dir=os.path.join(self.directory, 'plots')), 1)
+        self.assertEqual(self.run_traversal(seed=1, invalidate=['fit']), 2)
+        self.assertEqual(self.run_traversal(seed=1, invalidate=['fit']), 3)
+        self.assertEqual(self.run_traversal(seed=1), 3)
+
+    def test_figures_without_analysis(self):
+        plot_dir = os.path.join(self.directory, 'plots')
+        figure = os.path.join(plot_dir, 'data', 'leaf_c2_folded.pickle')
+
+        self.assertEqual(self.run_traversal(seed=1), 1)
+        self.assertFalse(os.path.exists(plot_dir))
+
+        self.assertEqual(self.run_traversal(seed=1, plot_dir=plot_dir), 1)
+        self.assertTrue(os.path.isfile(figure))
+
+        shutil.rmtree(plot_dir)
+        self.assertEqual(self.run_traversal(seed=1, plot_dir=plot_dir), 1)
+        self.assertTrue(os.path.isfile(figure))
+
+
+@unittest.skipIf(getattr(multiprocessing, 'get_start_method',
+                         lambda: 'fork')() != 'fork',
+                 'The workers need to inherit the replaced analysis.')
+class TestProcessPool(unittest.TestCase):
+    def setUp(self):
+        self.original = correlators.analysis.handle_path
+        correlators.analysis.handle_path = fake_analysis
+        self.directory = tempfile.mkdtemp()
+        self.cpu_count = multiprocessing.cpu_count
+
+    def tearDown(self):
+        correlators.analysis.handle_path = self.original
+        shutil.rmtree(self.directory)
+        multiprocessing.cpu_count = self.cpu_count
+
+    def make_leaves(self, names):
+        for name in names:
+            os.makedirs(os.path.join(self.directory, name))
+            with open(os.path.join(self.directory, name, 'data'), 'w') as f:
+                f.write(name)
+
+    def test_order(self):
+        names = ['leaf{}'.format(i) for i in range(6)]
+        self.make_leaves(names)
+        durations = {name: 0.05 * (6 - i) for i, name in enumerate(names)}
+
+        result = correlators.traversal.handle_path(
+            self.directory, jobs=2, durations=durations)
+
+        self.assertEqual(list(result.index), names)
+        self.assertEqual(list(result['x']), list(range(6)))
+
+    def test_error_stops_queued_folders(self):
+        names = ['failing', 'leaf0', 'leaf1', 'leaf2', 'leaf3']
+        self.make_leaves(names)
+        durations = {name: 2 for name in names}
+
+        start = time.time()
+        with self.assertRaises(RuntimeError):
+            correlators.traversal.handle_path(self.directory, jobs=2,
+                                              durations=durations)
+        self.assertLess(time.time() - start, 3)
+
+    def test_blas_threads(self):
+        self.make_leaves(['leaf0', 'leaf1'])
+        correlators.analysis.handle_path = blas_analysis
+        multiprocessing.cpu_count = lambda: 8
+
+        with threadpoolctl.threadpool_limits(3, user_api='blas'):
+            result = correlators.traversal.handle_path(self.directory,
+                                                       jobs=2)
+
+        self.assertEqual(list(result['threads']), [4, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()